@@ -0,0 +1,3 @@
+from airship.core import main
+
+main()
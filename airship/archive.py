@@ -0,0 +1,281 @@
+import os
+import sys
+import stat
+import errno
+import shutil
+import hashlib
+import logging
+import tarfile
+import threading
+import subprocess
+from path import path
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+XZ_MAGIC = '\xfd7zXZ\x00'
+
+
+class ArchiveError(Exception):
+    """ The archive could not be read. """
+
+
+class HashingReader(object):
+    """ File-like wrapper that hashes everything read through it. """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.digest = hashlib.sha256()
+        self._head = ''
+
+    def peek(self, size):
+        if len(self._head) < size:
+            self._head += self._read(size - len(self._head))
+        return self._head[:size]
+
+    def _read(self, size):
+        data = self.fileobj.read(size)
+        self.digest.update(data)
+        return data
+
+    def read(self, size=-1):
+        head, self._head = self._head, ''
+        if size < 0:
+            return head + self._read(size)
+        if len(head) > size:
+            head, self._head = head[:size], head[size:]
+            return head
+        return head + self._read(size - len(head))
+
+    def drain(self):
+        while self.read(CHUNK_SIZE):
+            pass
+        return self.digest.hexdigest()
+
+
+class XzReader(object):
+    """ Decompress an xz stream with the `xz` tool. Python 2's tarfile
+    can't handle xz by itself. A thread feeds the compressed data so that it
+    still flows through our `HashingReader`. """
+
+    def __init__(self, fileobj):
+        try:
+            self.proc = subprocess.Popen(['xz', '-dc'],
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE)
+        except OSError:
+            raise ArchiveError("xz archives need the `xz` program.")
+        self.feeder = threading.Thread(target=self._feed, args=(fileobj,))
+        self.feeder.daemon = True
+        self.feeder.start()
+
+    def _feed(self, fileobj):
+        try:
+            shutil.copyfileobj(fileobj, self.proc.stdin, CHUNK_SIZE)
+        except IOError:
+            pass  # xz exited early; reported by `close`
+        finally:
+            self.proc.stdin.close()
+
+    def read(self, size=-1):
+        return self.proc.stdout.read(size)
+
+    def close(self):
+        while self.proc.stdout.read(CHUNK_SIZE):
+            pass
+        self.feeder.join()
+        if self.proc.wait() != 0:
+            raise ArchiveError("xz failed to decompress the archive.")
+
+
+def _same_metadata(member, previous_file):
+    try:
+        st = os.lstat(previous_file)
+    except OSError:
+        return False
+    return (stat.S_ISREG(st.st_mode) and
+            st.st_size == member.size and
+            stat.S_IMODE(st.st_mode) == member.mode & 07777)
+
+
+def _remove_file(target):
+    """ Remove the file or link at `target`, e.g. an earlier member of the
+    same name, which may be hardlinked to the previous bucket, so that we
+    write a new file instead of changing the shared one. """
+    try:
+        if not stat.S_ISDIR(os.lstat(target).st_mode):
+            os.unlink(target)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError, e:
+        if e.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+            raise
+        shutil.copy2(source, target)
+
+
+def _materialize(tar, member, target, previous_file):
+    """ Write `member` at `target`. If its content is identical to
+    `previous_file`, hardlink that instead. The comparison reads the archive
+    and the previous file in lockstep, so on the first mismatch the common
+    prefix is copied from `previous_file` and the rest of the member is
+    written from the archive, without reading the member twice. """
+    source = tar.extractfile(member)
+    _remove_file(target)
+    with open(previous_file, 'rb') as old:
+        offset = 0
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                _link_or_copy(previous_file, target)
+                return True
+            if old.read(len(chunk)) != chunk:
+                break
+            offset += len(chunk)
+
+        old.seek(0)
+        with open(target, 'wb') as new:
+            remaining = offset
+            while remaining:
+                data = old.read(min(CHUNK_SIZE, remaining))
+                new.write(data)
+                remaining -= len(data)
+            new.write(chunk)
+            shutil.copyfileobj(source, new, CHUNK_SIZE)
+
+    tar.chmod(member, target)
+    tar.utime(member, target)
+    return False
+
+
+def _is_inside(name):
+    name = os.path.normpath(name)
+    return not (os.path.isabs(name) or name == os.pardir or
+                name.startswith(os.pardir + os.sep))
+
+
+def is_safe_member(member):
+    """ Check that extracting `member` can't write outside the target
+    folder. """
+    if not _is_inside(member.name):
+        return False
+    if member.issym():
+        target = os.path.join(os.path.dirname(member.name), member.linkname)
+        return _is_inside(target)
+    if member.islnk():
+        return _is_inside(member.linkname)
+    return member.isfile() or member.isdir()
+
+
+def _resolves_inside(folder, target):
+    folder = os.path.realpath(folder)
+    target = os.path.realpath(target)
+    return target == folder or target.startswith(folder + os.sep)
+
+
+def stays_inside(member, folder):
+    """ Check that extracting `member` into `folder` can't write outside it
+    by following a symlink that was extracted earlier, and that a link
+    member doesn't point outside it. Unlike `is_safe_member` this looks at
+    the filesystem, so it must be called right before each member is
+    written. """
+    target = os.path.join(folder, member.name)
+    if not (member.issym() or member.islnk()):
+        return _resolves_inside(folder, target)
+    # the link itself replaces whatever is at `target`; only its parent
+    # folder is followed
+    parent = os.path.realpath(os.path.dirname(target))
+    if not _resolves_inside(folder, parent):
+        return False
+    if member.issym():
+        return _resolves_inside(folder, os.path.join(parent, member.linkname))
+    return _resolves_inside(folder, os.path.join(folder, member.linkname))
+
+
+def _open_source(source):
+    if source == '-':
+        return sys.stdin
+    if isinstance(source, basestring):
+        return open(source, 'rb')
+    return source
+
+
+def file_hash(source):
+    """ The sha256 hash of `source`, as `extract` would compute it, if
+    it's a file path. Streams can't be read twice, so for them (and for
+    stdin) it returns `None`. """
+    if not isinstance(source, basestring) or source == '-':
+        return None
+    digest = hashlib.sha256()
+    try:
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+                digest.update(chunk)
+    except IOError, e:
+        raise ArchiveError("Can't read archive: %s" % e)
+    return digest.hexdigest()
+
+
+def extract(source, folder, previous=None):
+    """ Unpack a tarball into `folder`, streaming it from `source` (a path,
+    ``-`` for stdin, or a file object). Gzip, bzip2 and xz compression are
+    detected automatically. Members that would land outside `folder`, and
+    device files, are skipped.
+
+    If `previous` is the folder of an earlier bucket, regular files that
+    have the same size, mode and content there are hardlinked from it
+    instead of being written again.
+
+    Returns a dict with the number of written, linked and skipped files, the
+    total `size` of the files and the sha256 `hash` of the archive as read
+    from `source`. """
+    folder = path(folder)
+    counts = {'written': 0, 'linked': 0, 'skipped': 0, 'size': 0}
+    fileobj = None
+    try:
+        fileobj = _open_source(source)
+        reader = HashingReader(fileobj)
+        stream = reader
+        if reader.peek(len(XZ_MAGIC)) == XZ_MAGIC:
+            stream = XzReader(reader)
+        # errorlevel 1: don't ignore errors writing files, e.g. ENOSPC
+        tar = tarfile.open(fileobj=stream, mode='r|*', errorlevel=1)
+        for member in tar:
+            if not (is_safe_member(member) and stays_inside(member, folder)):
+                log.warning("Skipping unsafe archive member %r", member.name)
+                counts['skipped'] += 1
+                continue
+            if member.isfile():
+                counts['size'] += member.size
+            if previous is not None and member.isfile():
+                previous_file = path(previous) / member.name
+                if _same_metadata(member, previous_file):
+                    target = folder / member.name
+                    target.parent.makedirs_p()
+                    if _materialize(tar, member, target, previous_file):
+                        counts['linked'] += 1
+                    else:
+                        counts['written'] += 1
+                    continue
+            if not member.isdir():
+                _remove_file(folder / member.name)
+            tar.extract(member, folder)
+            if member.isfile():
+                counts['written'] += 1
+        tar.close()
+        if stream is not reader:
+            stream.close()
+        counts['hash'] = reader.drain()
+    except OSError, e:
+        raise ArchiveError("Can't extract archive: %s" % e)
+    except (tarfile.TarError, IOError, EOFError), e:
+        raise ArchiveError("Can't read archive: %s" % e)
+    finally:
+        if fileobj not in (None, source, sys.stdin):
+            fileobj.close()
+    return counts
@@ -1,6 +1,122 @@
 import sys
+import json
+import logging
+import tempfile
 import subprocess
 from path import path
+from .venvcache import VirtualenvCache, DEFAULT_MAX_SIZE
+from . import precompile
+from . import wheels
+from .wheelhouse import Wheelhouse
+
+log = logging.getLogger(__name__)
+
+
+def venv_cache(airship):
+    config = airship.config.get('python', {})
+    max_size = config.get('virtualenv_cache_size', DEFAULT_MAX_SIZE)
+    folder = airship.home_path / 'var' / 'cache' / 'virtualenv'
+    return VirtualenvCache(folder, max_size)
+
+
+def cached_venvs_in_use(airship):
+    in_use = set()
+    deploy_path = airship.home_path / 'var' / 'deploy'
+    if deploy_path.isdir():
+        for bucket_folder in deploy_path.dirs():
+            venv = bucket_folder / '_virtualenv'
+            if venv.islink():
+                in_use.add(venv.realpath().name)
+    return in_use
+
+
+def build_virtualenv(airship, bucket, venv, requirements_file):
+    from airship.deployer import DeployError
+    config = airship.config.get('python', {})
+    index_dir = config['dist']
+    pip = venv / 'bin' / 'pip'
+    virtualenv_py = airship.home_path / 'dist' / 'virtualenv.py'
+    python = config.get('interpreter', 'python')
+
+    try:
+        subprocess.check_call([python, virtualenv_py, venv,
+                               '--distribute', '--never-download',
+                               '--extra-search-dir=' + index_dir])
+    except subprocess.CalledProcessError:
+        raise DeployError(bucket, "Failed to create a virtualenv.")
+
+    index_url = Wheelhouse(index_dir).index_url
+    leftover = install_wheels_directly(airship, venv, requirements_file)
+    if leftover is None:
+        pip_install(bucket, pip, index_url, requirements_file)
+    elif leftover:
+        with tempfile.NamedTemporaryFile(suffix='.txt') as f:
+            f.write(''.join(line + '\n' for line in leftover))
+            f.flush()
+            pip_install(bucket, pip, index_url, f.name)
+
+
+def install_wheels_directly(airship, venv, requirements_file):
+    """ Install the requirements that are pinned to a pure python wheel in
+    the dist folder by unpacking the wheels in parallel, skipping pip.
+    Returns the requirement lines left for pip, or `None` if pip should
+    install everything. """
+    config = airship.config.get('python', {})
+    if not config.get('direct_install', True):
+        return None
+    python = venv / 'bin' / 'python'
+    target = wheels.target_info(python)
+    if target is None:
+        return None
+    manifest = Wheelhouse(config['dist']).manifest()
+    try:
+        found, leftover = wheels.resolve(requirements_file, config['dist'],
+                                         target['version'], manifest)
+        wheels.install_wheels(found, target['paths'], python,
+                              config.get('install_workers'), manifest)
+    except wheels.WheelError, e:
+        log.warning("Direct wheel install failed, falling back to pip: %s",
+                    e)
+        return None
+    log.info("Installed %d wheels directly, %d requirements left for pip",
+             len(found), len(leftover))
+    return leftover
+
+
+def pip_install(bucket, pip, index_url, requirements_file):
+    from airship.deployer import DeployError
+    try:
+        subprocess.check_call([pip, 'install', 'wheel',
+                               '--index-url=' + index_url])
+    except subprocess.CalledProcessError:
+        raise DeployError(bucket, "Failed to install wheel.")
+
+    try:
+        subprocess.check_call([pip, 'install', '-r', requirements_file,
+                               '--use-wheel', '--index-url=' + index_url])
+    except subprocess.CalledProcessError:
+        raise DeployError(bucket, "Failed to install requirements.")
+
+
+def precompile_folder(airship, folder, python):
+    """ Byte-compile the python files in `folder`, unless disabled with
+    `precompile: false`. Globs in `precompile_include` and
+    `precompile_exclude` select the files, relative to `folder`. """
+    config = airship.config.get('python', {})
+    if not config.get('precompile', True):
+        return
+    sources = precompile.find_sources(
+        folder,
+        config.get('precompile_include', precompile.DEFAULT_INCLUDE),
+        config.get('precompile_exclude', []))
+    try:
+        failed = precompile.compile_files(python, sources,
+                                          config.get('precompile_workers'))
+    except OSError, e:
+        log.warning("Could not run %r to compile %r: %s", python, folder, e)
+        return
+    log.info("Compiled %d files in %r (%d failed)",
+             len(sources) - failed, folder, failed)
 
 
 def set_up_virtualenv_and_requirements(airship, bucket, **extra):
@@ -8,31 +124,42 @@ def set_up_virtualenv_and_requirements(airship, bucket, **extra):
     requirements_file = bucket.folder / 'requirements.txt'
     if requirements_file.isfile():
         config = airship.config.get('python', {})
-        index_dir = config['dist']
-        venv = bucket.folder / '_virtualenv'
-        pip = venv / 'bin' / 'pip'
-        virtualenv_py = airship.home_path / 'dist' / 'virtualenv.py'
-        python = config.get('interpreter', 'python')
-
-        try:
-            subprocess.check_call([python, virtualenv_py, venv,
-                                   '--distribute', '--never-download',
-                                   '--extra-search-dir=' + index_dir])
-        except subprocess.CalledProcessError:
-            raise DeployError(bucket, "Failed to create a virtualenv.")
-
-        try:
-            subprocess.check_call([pip, 'install', 'wheel', '--no-index',
-                                   '--find-links=file://' + index_dir])
-        except subprocess.CalledProcessError:
-            raise DeployError(bucket, "Failed to install wheel.")
-
-        try:
-            subprocess.check_call([pip, 'install', '-r', requirements_file,
-                                   '--use-wheel', '--no-index',
-                                   '--find-links=file://' + index_dir])
-        except subprocess.CalledProcessError:
-            raise DeployError(bucket, "Failed to install requirements.")
+        Wheelhouse(config['dist']).ensure_updated()
+        cache = venv_cache(airship)
+        key = cache.key(requirements_file,
+                        config.get('interpreter', 'python'),
+                        config['dist'])
+        with cache.lock(key):
+            cached = cache.lookup(key)
+            if cached is None:
+                cached = cache.prepare(key)
+                try:
+                    build_virtualenv(airship, bucket, cached,
+                                     requirements_file)
+                except DeployError:
+                    cache.discard(key)
+                    raise
+                precompile_folder(airship, cached, cached / 'bin' / 'python')
+                cache.commit(key)
+            (bucket.folder / '_virtualenv').unlink_p()
+            cached.symlink(bucket.folder / '_virtualenv')
+        cache.prune(in_use=cached_venvs_in_use(airship))
+
+
+def precompile_bucket(airship, bucket):
+    venv_python = bucket.folder / '_virtualenv' / 'bin' / 'python'
+    if venv_python.isfile():
+        python = venv_python
+    else:
+        python = airship.config.get('python', {}).get('interpreter', 'python')
+    precompile_folder(airship, bucket.folder, python)
+
+
+def set_up_bucket(airship, bucket, **extra):
+    """ Install the requirements, then compile the bucket's code with the
+    virtualenv's interpreter, so processes start with warm bytecode. """
+    set_up_virtualenv_and_requirements(airship, bucket)
+    precompile_bucket(airship, bucket)
 
 
 def activate_virtualenv(airship, bucket, environ, **extra):
@@ -44,18 +171,56 @@ def activate_virtualenv(airship, bucket, environ, **extra):
 def load(airship):
     from airship.deployer import bucket_setup
     from airship.core import bucket_run
-    bucket_setup.connect(set_up_virtualenv_and_requirements, airship)
+    bucket_setup.connect(set_up_bucket, airship)
     bucket_run.connect(activate_virtualenv, airship)
 
 
 def do_wheel(airship, args):
     config = airship.config.get('python', {})
     index_dir = config['dist']
-    argv = [path(sys.prefix) / 'bin' / 'pip',
+    pip = path(sys.prefix) / 'bin' / 'pip'
+    if args.requirements is not None:
+        return build_wheels(airship, pip, index_dir, args)
+    argv = [pip,
             'wheel',
             '--no-deps',
             '-w', index_dir]
     subprocess.check_call(argv + args.wheel_argv)
+    Wheelhouse(index_dir).update()
+
+
+def build_wheels(airship, pip, index_dir, args):
+    from . import wheelbuild
+    wheelhouse = Wheelhouse(index_dir).ensure_updated()
+    lines = wheelbuild.read_requirements(args.requirements)
+    log_folder = airship.home_path / 'var' / 'log' / 'wheel'
+    results = wheelbuild.build_missing(pip, index_dir, lines,
+                                       wheelhouse.manifest(), log_folder,
+                                       args.jobs)
+    wheelhouse.update()
+    counts = dict((status, 0) for status in
+                  [wheelbuild.BUILT, wheelbuild.SKIPPED, wheelbuild.FAILED])
+    for line, status, log_path in results:
+        counts[status] += 1
+        if status == wheelbuild.FAILED:
+            print "Failed to build %s, see %s" % (line, log_path)
+    print "%(built)d built, %(skipped)d skipped, %(failed)d failed" % counts
+    if counts[wheelbuild.FAILED]:
+        sys.exit(1)
+
+
+def do_virtualenv_cache(airship, args):
+    cache = venv_cache(airship)
+    if args.prune:
+        max_size = cache.max_size
+        if args.max_size is not None:
+            max_size = args.max_size * 1024 * 1024
+        cache.prune(in_use=cached_venvs_in_use(airship), max_size=max_size)
+    in_use = cached_venvs_in_use(airship)
+    entries = cache.entries()
+    for entry in entries:
+        entry['in_use'] = entry['key'] in in_use
+    print json.dumps({'virtualenvs': entries}, indent=2)
 
 
 from airship.core import define_arguments
@@ -65,4 +230,17 @@ from airship.core import define_arguments
 def register_wheel_subcommand(sender, create_command):
     import argparse
     wheel_cmd = create_command('wheel', do_wheel)
+    wheel_cmd.add_argument('-r', '--requirement', dest='requirements',
+                           help="build the requirements in this file that "
+                                "have no wheel yet, in parallel")
+    wheel_cmd.add_argument('-j', '--jobs', type=int,
+                           help="parallel builds (default: number of CPUs)")
     wheel_cmd.add_argument('wheel_argv', nargs=argparse.REMAINDER)
+
+
+@define_arguments.connect
+def register_virtualenv_cache_subcommand(sender, create_command):
+    cache_cmd = create_command('virtualenv-cache', do_virtualenv_cache)
+    cache_cmd.add_argument('--prune', action='store_true')
+    cache_cmd.add_argument('--max-size', type=int,
+                           help="size limit in megabytes (for --prune)")
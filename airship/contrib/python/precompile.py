@@ -0,0 +1,72 @@
+import os
+import fnmatch
+import subprocess
+import multiprocessing
+
+DEFAULT_INCLUDE = ['*.py']
+
+# runs under the application's interpreter, which may be python 3
+COMPILE_SCRIPT = """\
+import sys, py_compile
+failed = 0
+for name in sys.stdin.read().splitlines():
+    try:
+        py_compile.compile(name, doraise=True)
+    except Exception:
+        failed += 1
+sys.stdout.write('%d\\n' % failed)
+"""
+
+
+def _matches(name, patterns):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def find_sources(folder, include=DEFAULT_INCLUDE, exclude=()):
+    """ Source files in `folder` whose path, relative to `folder`, matches
+    one of the `include` globs and none of the `exclude` globs. Symlinked
+    folders are not followed. """
+    sources = []
+    for parent, dirs, files in os.walk(folder):
+        relative_parent = os.path.relpath(parent, folder)
+        for name in files:
+            relative = os.path.normpath(os.path.join(relative_parent, name))
+            if _matches(relative, include) and not _matches(relative, exclude):
+                sources.append(os.path.join(parent, name))
+    return sources
+
+
+def default_workers():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def compile_files(python, sources, workers=None):
+    """ Byte-compile `sources` with the `python` interpreter, so the
+    bytecode matches the one the application runs with. The files are split
+    in `workers` chunks, each compiled by its own interpreter process, all
+    running at once. Returns the number of files that failed to compile,
+    e.g. because of syntax for another python version. """
+    if not sources:
+        return 0
+    workers = max(1, min(workers or default_workers(), len(sources)))
+    procs = []
+    for n in range(workers):
+        chunk = sources[n::workers]
+        proc = subprocess.Popen([python, '-c', COMPILE_SCRIPT],
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE)
+        # the script reads all names before compiling, so this won't block
+        proc.stdin.write('\n'.join(chunk) + '\n')
+        proc.stdin.close()
+        procs.append((proc, len(chunk)))
+    failed = 0
+    for proc, count in procs:
+        out = proc.stdout.read()
+        if proc.wait() != 0:
+            failed += count
+        else:
+            failed += int(out.strip() or 0)
+    return failed
@@ -0,0 +1,156 @@
+import os
+import errno
+import fcntl
+import hashlib
+import time
+from contextlib import contextmanager
+from path import path
+from .wheelhouse import Wheelhouse
+
+COMPLETE_MARKER = '.airship-complete'
+LOCK_SUFFIX = '.lock'
+DEFAULT_MAX_SIZE = 1024  # megabytes
+
+
+def _find_interpreter(python):
+    if os.sep in python:
+        return path(python).abspath().realpath()
+    for folder in os.environ.get('PATH', '').split(os.pathsep):
+        candidate = path(folder) / python
+        if candidate.isfile():
+            return candidate.realpath()
+    return path(python)
+
+
+def _disk_usage(folder):
+    total = 0
+    for parent, dirs, files in os.walk(folder):
+        for name in files:
+            total += os.lstat(os.path.join(parent, name)).st_size
+    return total
+
+
+class VirtualenvCache(object):
+    """ A folder of ready-made virtualenvs, shared by all buckets. Each entry
+    is keyed by a hash of the requirements, interpreter and available wheels,
+    so a deployment with unchanged requirements can link to an existing
+    virtualenv instead of building a new one. An entry is built and evicted
+    only while holding its lock, ``<key>.lock`` next to it, so concurrent
+    deployments don't remove each other's builds. """
+
+    def __init__(self, folder, max_size=DEFAULT_MAX_SIZE):
+        self.folder = folder
+        self.max_size = max_size * 1024 * 1024
+
+    def key(self, requirements_file, python, index_dir):
+        digest = hashlib.sha1()
+        interpreter = _find_interpreter(python)
+        digest.update('interpreter: %s\n' % interpreter)
+        if interpreter.isfile():
+            stat = interpreter.stat()
+            digest.update('%d %d\n' % (stat.st_size, stat.st_mtime))
+        digest.update(requirements_file.bytes())
+        manifest = Wheelhouse(index_dir).manifest()
+        if manifest:
+            for name, entry in sorted(manifest.items()):
+                digest.update('wheel: %s %s\n' % (name, entry['sha256']))
+        else:
+            for wheel in sorted(path(index_dir).files()):
+                digest.update('wheel: %s %d\n' % (wheel.name, wheel.size))
+        return digest.hexdigest()
+
+    def _lock_path(self, key):
+        return self.folder / (key + LOCK_SUFFIX)
+
+    @contextmanager
+    def lock(self, key, wait=True):
+        """ Hold the lock of `key`, waiting for it if another process holds
+        it. With `wait` false, yield `False` instead of waiting. The lock file
+        is never removed, so everyone locks the same file. """
+        self.folder.makedirs_p()
+        with open(self._lock_path(key), 'a') as lock_file:
+            flags = fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file, flags)
+            except IOError, e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _marker(self, key):
+        return self.folder / key / COMPLETE_MARKER
+
+    def lookup(self, key):
+        """ Return the virtualenv for `key` if it's complete, marking it as
+        recently used, else `None`. """
+        marker = self._marker(key)
+        if not marker.isfile():
+            return None
+        now = time.time()
+        os.utime(marker, (now, now))
+        return marker.parent
+
+    def prepare(self, key):
+        """ Make room for building a new virtualenv for `key`. Leftovers of an
+        interrupted build are removed. Call it holding the lock of `key`. """
+        entry = self.folder / key
+        if entry.isdir():
+            entry.rmtree()
+        self.folder.makedirs_p()
+        return entry
+
+    def commit(self, key):
+        entry = self.folder / key
+        self._marker(key).write_text('%d\n' % _disk_usage(entry))
+        return entry
+
+    def discard(self, key):
+        entry = self.folder / key
+        if entry.isdir():
+            entry.rmtree()
+
+    def _entry(self, entry):
+        marker = entry / COMPLETE_MARKER
+        if marker.isfile():
+            size = int(marker.text().strip() or 0)
+            return {'key': entry.name, 'complete': True,
+                    'size': size, 'last_used': marker.mtime}
+        return {'key': entry.name, 'complete': False,
+                'size': _disk_usage(entry), 'last_used': entry.mtime}
+
+    def entries(self):
+        if not self.folder.isdir():
+            return []
+        return [self._entry(entry) for entry in self.folder.dirs()]
+
+    def prune(self, in_use=(), max_size=None):
+        """ Evict least recently used entries, never touching the ones in
+        `in_use`, the ones locked by another process, e.g. because they are
+        being built, and the ones used meanwhile, until the cache fits in
+        `max_size` bytes. Returns the list of evicted keys. """
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        total = sum(e['size'] for e in entries)
+        evicted = []
+        entries.sort(key=lambda e: (e['complete'], e['last_used']))
+        for e in entries:
+            if total <= max_size:
+                break
+            if e['key'] in in_use:
+                continue
+            with self.lock(e['key'], wait=False) as locked:
+                if not locked:
+                    continue
+                entry = self.folder / e['key']
+                if not entry.isdir() or self._entry(entry) != e:
+                    continue  # completed or used since we looked
+                self.discard(e['key'])
+            total -= e['size']
+            evicted.append(e['key'])
+        return evicted
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import subprocess
+from multiprocessing.pool import ThreadPool
+from .precompile import default_workers
+from .wheels import WHEEL_NAME, normalize
+
+BUILT = 'built'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+
+def read_requirements(requirements_file):
+    with open(requirements_file, 'rb') as f:
+        lines = [l.split('#', 1)[0].strip() for l in f]
+    return [l for l in lines if l]
+
+
+def available_wheels(manifest):
+    """ Map project names to the versions that have a wheel in the
+    wheelhouse `manifest`. """
+    versions = {}
+    for name in manifest:
+        match = WHEEL_NAME.match(name)
+        if match is not None:
+            project = normalize(match.group('name'))
+            versions.setdefault(project, set()).add(match.group('version'))
+    return versions
+
+
+def is_satisfied(line, versions):
+    """ Is the requirement `line` met by one of the available wheel
+    `versions`? Lines that aren't plain requirements, e.g. pip options or
+    URLs, never are. """
+    import pkg_resources
+    try:
+        requirement = pkg_resources.Requirement.parse(line)
+    except ValueError:
+        return False
+    for version in versions.get(normalize(requirement.project_name), ()):
+        if version.replace('_', '-') in requirement:
+            return True
+    return False
+
+
+def log_name(line):
+    return normalize(''.join(c if c.isalnum() or c in '._-' else '_'
+                             for c in line)) + '.log'
+
+
+def build(pip, dist, line, log_folder):
+    """ Build the wheel for one requirement with ``pip wheel --no-deps``,
+    logging its output to a file of its own. Returns the status and log
+    path. Each build gets its own build folder; pip removes the whole
+    folder when it's done, which would pull the sources from under builds
+    running in parallel. """
+    log_path = os.path.join(log_folder, log_name(line))
+    build_dir = tempfile.mkdtemp(prefix='airship-wheel-')
+    try:
+        with open(log_path, 'wb') as log_file:
+            returncode = subprocess.call([pip, 'wheel', '--no-deps',
+                                          '--build', build_dir,
+                                          '-w', dist, line],
+                                         stdout=log_file,
+                                         stderr=subprocess.STDOUT)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return (BUILT if returncode == 0 else FAILED), log_path
+
+
+def build_missing(pip, dist, lines, manifest, log_folder, jobs=None):
+    """ Build wheels for the requirement `lines` that no wheel in `dist`
+    satisfies yet, `jobs` at a time. Returns a list of ``(line, status,
+    log_path)``, in the order of `lines`. """
+    versions = available_wheels(manifest)
+    missing = [l for l in lines if not is_satisfied(l, versions)]
+    results = dict((l, (SKIPPED, None)) for l in lines if l not in missing)
+    if missing:
+        if not os.path.isdir(log_folder):
+            os.makedirs(log_folder)
+        pool = ThreadPool(min(jobs or default_workers(), len(missing)))
+        try:
+            built = pool.map(lambda l: build(pip, dist, l, log_folder),
+                             missing)
+        finally:
+            pool.close()
+            pool.join()
+        results.update(zip(missing, built))
+    return [(l,) + results[l] for l in lines]
@@ -0,0 +1,155 @@
+import os
+import re
+import cgi
+import json
+import hashlib
+import logging
+
+log = logging.getLogger(__name__)
+
+INDEX_FOLDER = 'simple'
+MANIFEST_NAME = 'manifest.json'
+EXTENSIONS = ('.whl', '.tar.gz', '.tar.bz2', '.zip')
+CHUNK_SIZE = 64 * 1024
+
+PAGE_TEMPLATE = """\
+<!DOCTYPE html>
+<html><head><title>%(title)s</title></head><body>
+%(links)s
+</body></html>
+"""
+
+
+def normalize(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def project_name(filename):
+    """ The normalized project name of a wheel or sdist filename. """
+    if filename.endswith('.whl'):
+        return normalize(filename.split('-', 1)[0])
+    for extension in EXTENSIONS:
+        if filename.endswith(extension):
+            stem = filename[:-len(extension)]
+            return normalize(stem.rsplit('-', 1)[0])
+    return None
+
+
+def _sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomic(file_path, data):
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_path, file_path)
+
+
+class Wheelhouse(object):
+    """ The `dist` folder, with a PEP 503 "simple" index of its packages in
+    ``simple/`` and a manifest of their sha256 hashes. Pip reads a single
+    project page from the index instead of listing and parsing every
+    filename in the folder, and checks the hashes in the links. """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.index_folder = os.path.join(folder, INDEX_FOLDER)
+        self.manifest_path = os.path.join(folder, MANIFEST_NAME)
+
+    @property
+    def index_url(self):
+        return 'file://' + self.index_folder + '/'
+
+    def manifest(self):
+        if not os.path.isfile(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'rb') as f:
+            return json.load(f)['files']
+
+    def is_stale(self):
+        """ Files were added to or removed from the folder since the last
+        update. """
+        if not os.path.isfile(self.manifest_path):
+            return True
+        return (os.stat(self.folder).st_mtime >
+                os.stat(self.manifest_path).st_mtime)
+
+    def update(self):
+        """ Bring the manifest and index up to date. Only new or modified
+        files are hashed, and only the pages of their projects rewritten.
+        Returns the set of projects that changed. """
+        old = self.manifest()
+        new = {}
+        for name in os.listdir(self.folder):
+            project = project_name(name)
+            file_path = os.path.join(self.folder, name)
+            if project is None or not os.path.isfile(file_path):
+                continue
+            st = os.stat(file_path)
+            entry = old.get(name)
+            if (entry is None or entry['size'] != st.st_size or
+                    entry['mtime'] != int(st.st_mtime)):
+                entry = {'project': project, 'size': st.st_size,
+                         'mtime': int(st.st_mtime),
+                         'sha256': _sha256(file_path)}
+            new[name] = entry
+
+        changed = set(new[n]['project'] for n in new
+                      if old.get(n) != new[n])
+        changed.update(old[n]['project'] for n in old if n not in new)
+        if (not changed and os.path.isdir(self.index_folder) and
+                os.path.isfile(self.manifest_path)):
+            os.utime(self.manifest_path, None)
+            return changed
+
+        self._write_index(new, changed, set(e['project'] for e in
+                                            old.values()))
+        _write_atomic(self.manifest_path,
+                      json.dumps({'files': new}, sort_keys=True))
+        # renaming the manifest into place touched the folder
+        os.utime(self.manifest_path, None)
+        log.info("Updated the wheelhouse index for %d projects", len(changed))
+        return changed
+
+    def _write_index(self, files, changed, old_projects):
+        by_project = {}
+        for name, entry in files.items():
+            by_project.setdefault(entry['project'], []).append(name)
+        if not os.path.isdir(self.index_folder):
+            os.makedirs(self.index_folder)
+            changed = set(by_project)
+
+        for project in changed:
+            project_folder = os.path.join(self.index_folder, project)
+            page = os.path.join(project_folder, 'index.html')
+            if project not in by_project:
+                if os.path.isfile(page):
+                    os.unlink(page)
+                    os.rmdir(project_folder)
+                continue
+            links = ['<a href="../../%s#sha256=%s">%s</a><br/>' % (
+                     cgi.escape(name, True), files[name]['sha256'],
+                     cgi.escape(name))
+                     for name in sorted(by_project[project])]
+            if not os.path.isdir(project_folder):
+                os.mkdir(project_folder)
+            _write_atomic(page, PAGE_TEMPLATE % {
+                'title': 'Links for %s' % cgi.escape(project),
+                'links': '\n'.join(links)})
+
+        root_page = os.path.join(self.index_folder, 'index.html')
+        if set(by_project) != old_projects or not os.path.isfile(root_page):
+            links = ['<a href="%s/">%s</a><br/>' % (p, p)
+                     for p in sorted(by_project)]
+            _write_atomic(root_page, PAGE_TEMPLATE % {
+                'title': 'Simple index', 'links': '\n'.join(links)})
+
+    def ensure_updated(self):
+        if self.is_stale():
+            self.update()
+        return self
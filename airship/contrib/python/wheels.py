@@ -0,0 +1,281 @@
+import os
+import re
+import csv
+import json
+import base64
+import hashlib
+import zipfile
+import logging
+import subprocess
+import ConfigParser
+from StringIO import StringIO
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
+from .precompile import default_workers
+
+log = logging.getLogger(__name__)
+
+PIN = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)\s*==\s*([A-Za-z0-9._+!-]+)$')
+WHEEL_NAME = re.compile(r'^(?P<name>[^-]+)-(?P<version>[^-]+)'
+                        r'(-(?P<build>\d[^-]*))?-(?P<python>[^-]+)'
+                        r'-(?P<abi>[^-]+)-(?P<platform>[^-]+)\.whl$')
+REQUIRES_DIST = re.compile(r'^Requires-Dist:\s*([A-Za-z0-9][A-Za-z0-9._-]*)'
+                           r'[^;\n]*(;\s*(.*))?$', re.MULTILINE)
+
+# runs under the virtualenv's interpreter, which may be python 3
+TARGET_SCRIPT = """\
+import sys, json, sysconfig
+print(json.dumps({'version': list(sys.version_info[:2]),
+                  'paths': sysconfig.get_paths()}))
+"""
+
+CONSOLE_SCRIPT = """\
+#!%(python)s
+# -*- coding: utf-8 -*-
+import re
+import sys
+from %(module)s import %(import_name)s
+
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw|\\.exe)?$', '', sys.argv[0])
+    sys.exit(%(func)s())
+"""
+
+
+class WheelError(Exception):
+    """ A wheel could not be installed. """
+
+
+def normalize(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def target_info(python):
+    """ Version and install paths of the `python` interpreter, or `None` if
+    it can't be run. """
+    try:
+        proc = subprocess.Popen([python, '-c', TARGET_SCRIPT],
+                                stdout=subprocess.PIPE)
+    except OSError:
+        return None
+    out = proc.communicate()[0]
+    if proc.returncode != 0:
+        return None
+    return json.loads(out)
+
+
+def is_compatible(wheel_name, version):
+    """ Pure python wheels only; anything with compiled code is left to pip,
+    which knows about ABI and platform tags. """
+    match = WHEEL_NAME.match(wheel_name)
+    if match is None:
+        return False
+    if match.group('abi') != 'none' or match.group('platform') != 'any':
+        return False
+    major, minor = version
+    supported = set(['py%d' % major, 'py%d%d' % (major, minor),
+                     'cp%d%d' % (major, minor)])
+    return bool(supported.intersection(match.group('python').split('.')))
+
+
+def _index(index_dir, version, filenames):
+    wheels = {}
+    for name in sorted(filenames):
+        if not is_compatible(name, version):
+            continue
+        match = WHEEL_NAME.match(name)
+        key = (normalize(match.group('name')),
+               normalize(match.group('version')))
+        wheels.setdefault(key, os.path.join(index_dir, name))
+    return wheels
+
+
+def _dependencies(wheel_path):
+    try:
+        with closing(zipfile.ZipFile(wheel_path)) as wheel:
+            metadata = wheel.read(_dist_info(wheel) + '/METADATA')
+    except (zipfile.BadZipfile, KeyError), e:
+        raise WheelError("Can't read %s: %s" % (wheel_path, e))
+    return [(normalize(name), marker) for name, _, marker in
+            REQUIRES_DIST.findall(metadata)]
+
+
+def resolve(requirements_file, index_dir, version, manifest=None):
+    """ Match the lines of `requirements_file` to wheels in `index_dir`.
+    Returns the list of wheels and the list of lines that couldn't be
+    matched, to be installed by pip. Only exact pins (``name==version``) of
+    pure python wheels are matched. If the file uses pip options, or a
+    matched wheel depends on a package that's not in the file, all the
+    lines are left to pip. The files in `index_dir` are taken from its
+    `manifest`, if given, instead of listing the folder. """
+    with open(requirements_file, 'rb') as f:
+        lines = [l.split('#', 1)[0].strip() for l in f]
+    lines = [l for l in lines if l]
+    if any(l.startswith('-') for l in lines):
+        return [], lines
+    filenames = manifest.keys() if manifest else os.listdir(index_dir)
+    available = _index(index_dir, version, filenames)
+    wheels = []
+    leftover = []
+    names = set()
+    for line in lines:
+        match = PIN.match(line)
+        if match is not None:
+            names.add(normalize(match.group(1)))
+            key = (normalize(match.group(1)), normalize(match.group(2)))
+            if key in available:
+                wheels.append(available[key])
+                continue
+        leftover.append(line)
+    for wheel_path in wheels:
+        for name, marker in _dependencies(wheel_path):
+            if name not in names and 'extra' not in (marker or ''):
+                log.info("%s requires %r, which is not pinned; "
+                         "leaving all requirements to pip", wheel_path, name)
+                return [], lines
+    return wheels, leftover
+
+
+def _dist_info(wheel):
+    for name in wheel.namelist():
+        parts = name.split('/')
+        if len(parts) == 2 and parts[0].endswith('.dist-info') and \
+                parts[1] == 'WHEEL':
+            return parts[0]
+    raise WheelError("%s has no .dist-info folder" % wheel.filename)
+
+
+def _record_hash(data):
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest())
+    return 'sha256=' + digest.rstrip('=')
+
+
+def _target_path(name, dist_info, root_key, paths):
+    parts = name.split('/')
+    if os.path.isabs(name) or '..' in parts:
+        raise WheelError("Unsafe path in wheel: %r" % name)
+    data_dir = dist_info[:-len('.dist-info')] + '.data'
+    if parts[0] == data_dir and len(parts) > 2:
+        key = parts[1]
+        if key == 'headers':
+            return os.path.join(paths['include'], *parts[2:]), key
+        if key not in ('purelib', 'platlib', 'scripts', 'data'):
+            raise WheelError("Unknown wheel data folder %r" % key)
+        return os.path.join(paths[key], *parts[2:]), key
+    return os.path.join(paths[root_key], *parts), root_key
+
+
+def _write(path, data, executable=False):
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if executable:
+        os.chmod(path, 0755)
+
+
+def _console_scripts(entry_points, python):
+    parser = ConfigParser.RawConfigParser()
+    parser.optionxform = str
+    parser.readfp(StringIO(entry_points))
+    scripts = {}
+    for section in ['console_scripts', 'gui_scripts']:
+        if not parser.has_section(section):
+            continue
+        for name, target in parser.items(section):
+            target = target.split('[', 1)[0].strip()
+            module, func = target.split(':', 1)
+            scripts[name] = CONSOLE_SCRIPT % {
+                'python': python,
+                'module': module.strip(),
+                'import_name': func.strip().split('.')[0],
+                'func': func.strip(),
+            }
+    return scripts
+
+
+def _verify(wheel_path, sha256):
+    digest = hashlib.sha256()
+    with open(wheel_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), ''):
+            digest.update(chunk)
+    if digest.hexdigest() != sha256:
+        raise WheelError("Hash mismatch for %s" % wheel_path)
+
+
+def install_wheel(wheel_path, paths, python, sha256=None):
+    """ Unpack a wheel into the install `paths` of a virtualenv: files in
+    ``.data`` folders go to their scheme path, scripts get `python` as
+    interpreter, console script wrappers are generated from
+    ``entry_points.txt`` and ``RECORD`` lists the installed files. """
+    try:
+        if sha256 is not None:
+            _verify(wheel_path, sha256)
+        return _install_wheel(wheel_path, paths, python)
+    except (zipfile.BadZipfile, KeyError, IOError, OSError), e:
+        raise WheelError("Can't install %s: %s" % (wheel_path, e))
+
+
+def _install_wheel(wheel_path, paths, python):
+    installed = []
+    with closing(zipfile.ZipFile(wheel_path)) as wheel:
+        dist_info = _dist_info(wheel)
+        info = wheel.read(dist_info + '/WHEEL')
+        purelib = 'Root-Is-Purelib: true' in info
+        root_key = 'purelib' if purelib else 'platlib'
+        lib_dir = paths[root_key]
+        for member in wheel.infolist():
+            if member.filename.endswith('/'):
+                continue
+            if member.filename == dist_info + '/RECORD':
+                continue
+            target, key = _target_path(member.filename, dist_info,
+                                       root_key, paths)
+            data = wheel.read(member)
+            executable = bool((member.external_attr >> 16) & 0111)
+            if key == 'scripts':
+                if data.startswith('#!python'):
+                    data = '#!' + python + data[len('#!python'):]
+                executable = True
+            _write(target, data, executable)
+            installed.append((target, data))
+        entry_points = dist_info + '/entry_points.txt'
+        if entry_points in wheel.namelist():
+            scripts = _console_scripts(wheel.read(entry_points), python)
+            for name, data in sorted(scripts.items()):
+                target = os.path.join(paths['scripts'], name)
+                _write(target, data, executable=True)
+                installed.append((target, data))
+
+    installer = os.path.join(lib_dir, dist_info, 'INSTALLER')
+    _write(installer, 'airship\n')
+    installed.append((installer, 'airship\n'))
+    record_path = os.path.join(lib_dir, dist_info, 'RECORD')
+    out = StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    for target, data in installed:
+        writer.writerow([os.path.relpath(target, lib_dir),
+                         _record_hash(data), len(data)])
+    writer.writerow([os.path.relpath(record_path, lib_dir), '', ''])
+    _write(record_path, out.getvalue())
+    return dist_info
+
+
+def install_wheels(wheels, paths, python, workers=None, manifest=None):
+    """ Install `wheels` in parallel, with a pool of threads. Wheels listed
+    in `manifest` are checked against their sha256 hash first. """
+    if not wheels:
+        return []
+    manifest = manifest or {}
+
+    def install(wheel_path):
+        entry = manifest.get(os.path.basename(wheel_path), {})
+        return install_wheel(wheel_path, paths, python, entry.get('sha256'))
+
+    pool = ThreadPool(min(workers or default_workers(), len(wheels)))
+    try:
+        return pool.map(install, wheels)
+    finally:
+        pool.close()
+        pool.join()
@@ -1,6 +1,9 @@
+import time
+_import_started = time.time()
 import os
 import sys
 import logging
+import re
 import json
 import random
 import string
@@ -8,19 +11,25 @@ from pipes import quote as shellquote
 from path import path
 import yaml
 from kv import KV
-import pkg_resources
-import blinker
 from .daemons import Supervisor
+from .registry import BucketRegistry, format_id, now, RUNNING, STOPPED
+from .signals import bucket_run, define_arguments
+from .plugins import registry as plugin_registry
 from . import deployer
+from . import reaper
+from . import logs
+from . import crashloop
+from . import sockets
+from . import stats
+from . import status
+
+_import_finished = time.time()
 
 log = logging.getLogger(__name__)
 
 CFG_LINKS_FOLDER = 'active'
 YAML_EXT = '.yaml'
 
-bucket_run = blinker.Signal()
-define_arguments = blinker.Signal()
-
 
 def random_id(size=6, vocabulary=string.ascii_lowercase + string.digits):
     return ''.join(random.choice(vocabulary) for c in range(size))
@@ -46,35 +55,193 @@ class Bucket(object):
 
     def start(self):
         log.info("Activating bucket %r", self.id_)
+        self.write_launchers()
         self.airship.daemons.configure_bucket_running(self)
+        self.airship.registry.update(self.id_, state=RUNNING, activated=now())
+        self.airship.registry.set_active(self.id_)
+
+    def restart(self):
+        log.info("Restarting bucket %r", self.id_)
+        self.write_launchers()
+        self.airship.daemons.restart_bucket(self)
 
     def stop(self):
+        self.write_launchers()
         self.airship.daemons.configure_bucket_stopped(self)
+        self.airship.registry.update(self.id_, state=STOPPED)
+
+    def port_for(self, procname):
+        ports = self.config.get('ports') or {}
+        if procname in ports:
+            return ports[procname]
+        return self.airship.config.get('port_map', {}).get(procname)
+
+    def instances(self, procname):
+        """ Number of processes to run for `procname`, from ``concurrency``
+        in the bucket metadata (set by `airship scale`) or else in
+        ``airship.yaml``. """
+        for concurrency in [self.config.get('concurrency'),
+                            self.airship.config.get('concurrency')]:
+            if procname in (concurrency or {}):
+                return int(concurrency[procname])
+        return 1
+
+    def instance_ports(self, procname):
+        """ Ports of all instances of `procname`; they get consecutive ports
+        starting with `port_for`. """
+        port = self.port_for(procname)
+        if port is None:
+            return []
+        return [port + i for i in range(self.instances(procname))]
+
+    def uses_socket_activation(self, procname):
+        """ Does airship open the listening socket of `procname`, as listed
+        in ``socket_activation``, instead of the process binding ``PORT``
+        itself? """
+        activated = self.airship.config.get('socket_activation') or []
+        return procname in activated and self.port_for(procname) is not None
+
+    def _listen_args(self):
+        host = self.airship.config.get('socket_host', sockets.DEFAULT_HOST)
+        return [sys.executable, '-m', 'airship.listen', '--host', host,
+                '--holder', self.airship.sockets_path]
+
+    def notifies_ready(self, procname):
+        """ Does `procname`, as listed in ``notify_ready``, tell when it's
+        ready to serve, by sending ``READY=1`` to ``NOTIFY_SOCKET``? """
+        return procname in (self.airship.config.get('notify_ready') or [])
+
+    @property
+    def notify_folder(self):
+        return self.airship.var_path / 'run' / 'notify' / self.id_
+
+    def notify_paths(self, procname):
+        """ The ``NOTIFY_SOCKET`` of each instance of `procname`. """
+        return [self.notify_folder / ('%s-%d' % (procname, i))
+                for i in range(self.instances(procname))]
+
+    def update_metadata(self, **values):
+        self.airship.registry.update(self.id_, **values)
+        self.config = self.airship.registry.get(self.id_)['config']
 
     def destroy(self):
         self.airship.daemons.remove_bucket(self.id_)
         if self.folder.isdir():
-            self.folder.rmtree()
-        self.airship.buckets_db.pop(self.id_, None)
+            self.airship.trash(self.folder)
+        if self.launchers_folder.isdir():
+            self.launchers_folder.rmtree()
+        if self.log_folder.isdir():
+            self.airship.trash(self.log_folder)
+        self.airship.registry.remove(self.id_)
+
+    def _environ(self, procname=None):
+        environ = Environ(os.environ)
+        environ.update(self.airship.config.get('env') or {})
+        bucket_run.send(self.airship, bucket=self, environ=environ)
+        if procname is not None:
+            port = self.port_for(procname)
+            if port is not None:
+                environ['PORT'] = str(port)
+        return environ
 
     def run(self, command):
         os.chdir(self.folder)
-        environ = dict(os.environ)
-        environ.update(self.airship.config.get('env') or {})
-        bucket_run.send(self.airship, bucket=self, environ=environ)
         shell_args = ['/bin/bash']
+        procname = None
         if command:
             if command in self.process_types:
                 procname = command
-                port_map = self.airship.config.get('port_map', {})
-                if procname in port_map:
-                    environ['PORT'] = str(port_map[procname])
                 command = self.process_types[procname]
             shell_args += ['-c', command]
+        environ = self._environ(procname)
+        if procname is not None and self.uses_socket_activation(procname):
+            shell_args = (self._listen_args() + [environ['PORT']] +
+                          shell_args)
         os.execve(shell_args[0], shell_args, environ)
 
+    @property
+    def launchers_folder(self):
+        return self.airship.var_path / 'launch' / self.id_
 
-_newest = object()
+    @property
+    def log_folder(self):
+        return self.airship.log_path / self.id_
+
+    def launcher_path(self, procname):
+        return self.launchers_folder / procname
+
+    def write_launchers(self):
+        """ Write a shell script for each process type, with the environment
+        and command resolved, so that supervisor can start the process with
+        a single exec instead of booting airship (`airship run`) each time.
+        The variables set by the ``env`` configuration and by `bucket_run`
+        handlers are exported; values that extend airship's own environment,
+        like ``PATH``, are written relative to the variable so they extend
+        supervisord's environment at runtime.
+
+        The launcher takes the instance number as argument and exports it as
+        ``PROCESS_INDEX``; ``PORT`` is the base port plus the index. Process
+        types with socket activation are started by `airship.listen`, which
+        gets the socket for ``PORT`` from the socket holder and passes it
+        on. """
+        self.launchers_folder.makedirs_p()
+        environ = self._environ()
+        for procname, command in self.process_types.items():
+            lines = ['#!/bin/bash', 'cd %s' % shellquote(self.folder)]
+            for key in sorted(environ.changed):
+                lines.append(_export_line(key, environ[key],
+                                          os.environ.get(key)))
+            lines.append('export PROCESS_INDEX="${1:-0}"')
+            port = self.port_for(procname)
+            if port is not None:
+                lines.append('export PORT=$((%d + PROCESS_INDEX))' % port)
+            if self.notifies_ready(procname):
+                lines.append('export NOTIFY_SOCKET=%s/%s-"$PROCESS_INDEX"'
+                             % (shellquote(self.notify_folder), procname))
+            exec_args = ['/bin/bash', '-c', shellquote(command)]
+            if self.uses_socket_activation(procname):
+                exec_args = ([shellquote(a) for a in self._listen_args()] +
+                             ['"$PORT"'] + exec_args)
+            lines.append('exec ' + ' '.join(exec_args))
+            launcher = self.launcher_path(procname)
+            launcher.write_text('\n'.join(l for l in lines if l) + '\n')
+            launcher.chmod(0755)
+
+
+class Environ(dict):
+    """ Environment variables that remember which of them were set. """
+
+    def __init__(self, *args, **kwargs):
+        super(Environ, self).__init__(*args, **kwargs)
+        self.changed = set()
+
+    def __setitem__(self, key, value):
+        self.changed.add(key)
+        super(Environ, self).__setitem__(key, value)
+
+    def update(self, *args, **kwargs):
+        values = dict(*args, **kwargs)
+        self.changed.update(values)
+        super(Environ, self).update(values)
+
+    def setdefault(self, key, value=None):
+        if key not in self:
+            self[key] = value
+        return self[key]
+
+
+def _export_line(key, value, original):
+    if original and value != original:
+        if value.endswith(original):
+            prefix = value[:-len(original)]
+            return 'export %s=%s"$%s"' % (key, shellquote(prefix), key)
+        if value.startswith(original):
+            suffix = value[len(original):]
+            return 'export %s="$%s"%s' % (key, key, shellquote(suffix))
+    return 'export %s=%s' % (key, shellquote(value))
+
+
+_current = object()
 
 
 class Airship(object):
@@ -87,13 +254,18 @@ class Airship(object):
         self.var_path = self.home_path / 'var'
         self.log_path = self.var_path / 'log'
         self.deploy_path = self.var_path / 'deploy'
+        self.trash_path = self.var_path / 'trash'
         self.config = config
         etc = self.home_path / 'etc'
         etc.mkdir_p()
-        self.buckets_db = KV(etc / 'buckets.db', table='bucket')
+        self.registry = BucketRegistry(etc / 'buckets.db')
         self.meta_db = KV(etc / 'buckets.db', table='meta')
         self.daemons = Supervisor(etc)
 
+    @property
+    def sockets_path(self):
+        return self.var_path / 'run' / sockets.SOCKET_NAME
+
     @property
     def cfg_links_folder(self):
         folder = self.home_path / CFG_LINKS_FOLDER
@@ -106,20 +278,36 @@ class Airship(object):
         self.log_path.mkdir_p()
         (self.var_path / 'run').mkdir_p()
         self.deploy_path.mkdir_p()
+        self.trash_path.mkdir_p()
         self.generate_supervisord_configuration()
 
     def generate_supervisord_configuration(self):
-        self.daemons.configure(self.home_path)
+        self.daemons.configure(self.home_path, self.config.get('crashloop'),
+                               watchdog='watchdog' in self.config,
+                               exporter='exporter' in self.config,
+                               sockets=bool(self.config.get(
+                                   'socket_activation')),
+                               logs=self.config.get('logs'))
 
     def _get_bucket_by_id(self, bucket_id):
-        config = self.buckets_db[bucket_id]
+        config = self.registry.get(bucket_id)['config']
         return Bucket(bucket_id, self, config)
 
-    def get_bucket(self, name=_newest):
-        if name is _newest:
-            name = max(self.buckets_db)
+    def get_bucket(self, name=_current):
+        """ Return the bucket called `name`. By default, return the active
+        bucket or, if no bucket was started yet, the newest one. """
+        if name is _current:
+            name = self.registry.get_active() or self.registry.newest()
+            if name is None:
+                raise KeyError("There are no buckets")
         return self._get_bucket_by_id(name)
 
+    def trash(self, folder):
+        """ Move `folder` to the trash, to be deleted in the background. """
+        self.trash_path.mkdir_p()
+        folder.rename(self.trash_path / (folder.name + '-' + random_id()))
+        reaper.spawn(self.trash_path)
+
     def _bucket_folder(self, id_):
         return self.deploy_path / id_
 
@@ -127,32 +315,38 @@ class Airship(object):
         with self.meta_db.lock():
             next_id = self.meta_db.get('next_bucket_id', 1)
             self.meta_db['next_bucket_id'] = next_id + 1
-        id_ = 'd%d' % (next_id,)
+        id_ = format_id(next_id)
         self._bucket_folder(id_).mkdir()
         return id_
 
     def new_bucket(self, config={}):
         bucket_id = self._generate_bucket_id()
-        self.buckets_db[bucket_id] = {}
+        self.registry.add(bucket_id)
         bucket = self._get_bucket_by_id(bucket_id)
         return bucket
 
     def list_buckets(self):
-        return {'buckets': [{'id': id_} for id_ in self.buckets_db]}
+        active = self.registry.get_active()
+        buckets = []
+        for record in self.registry.records():
+            del record['config']
+            record['active'] = (record['id'] == active)
+            buckets.append(record)
+        return {'buckets': buckets}
 
 
-# we load the entry points here so they can do import-time signal registrations
-_plugin_callbacks = [ep.load() for ep in
-                     pkg_resources.iter_entry_points('airship_plugins')]
-
-
-def load_plugins(airship):
-    for callback in _plugin_callbacks:
-        callback(airship)
+def load_plugins(airship, command=None):
+    """ Prepare the plugin registry for `airship` and load the plugins that
+    provide `command`. Other plugins are loaded when one of the signals they
+    subscribe to is sent. """
+    plugin_registry.setup(airship, airship.var_path / 'cache' / 'plugins.json')
+    plugin_registry.load_for_command(command)
 
 
+# run the package directly; the setuptools console script would import
+# pkg_resources, which is slow
 AIRSHIP_SCRIPT = """#!/bin/bash
-exec '{prefix}/bin/airship' '{home}' "$@"
+exec '{python}' -m airship '{home}' "$@"
 """
 
 SUPERVISORD_SCRIPT = """#!/bin/bash
@@ -172,9 +366,10 @@ def init_cmd(airship, args):
     airship.initialize()
 
     airship_bin = airship.home_path / 'bin'
-    airship_bin.makedirs()
+    airship_bin.makedirs_p()
 
-    kw = {'home': airship.home_path, 'prefix': sys.prefix}
+    kw = {'home': airship.home_path, 'prefix': sys.prefix,
+          'python': sys.executable}
 
     with open(airship_bin / 'airship', 'wb') as f:
         f.write(AIRSHIP_SCRIPT.format(**kw))
@@ -194,19 +389,24 @@ def list_cmd(airship, args):
 
 
 def destroy_cmd(airship, args):
-    airship.get_bucket(args.bucket_id or _newest).destroy()
+    airship.get_bucket(args.bucket_id or _current).destroy()
 
 
 def run_cmd(airship, args):
     command = ' '.join(shellquote(a) for a in args.command)
-    airship.get_bucket(args.bucket_id or _newest).run(command)
+    airship.get_bucket(args.bucket_id or _current).run(command)
 
 
 def deploy_cmd(airship, args):
+    previous = deployer.active_bucket(airship)
     try:
-        deployer.deploy(airship, args.tarfile)
+        bucket = deployer.deploy(airship, args.tarfile,
+                                 incremental=args.incremental,
+                                 restart=args.restart, force=args.force)
     except deployer.DeployError, e:
         print "Deployment failed:", e.message
+        if e.bucket is None:
+            return
         try:
             e.bucket.destroy()
         except:
@@ -214,12 +414,154 @@ def deploy_cmd(airship, args):
                    % e.bucket.id_)
         else:
             print "Cleaned up failed deployment."
+    else:
+        if previous is not None and bucket.id_ == previous.id_:
+            print ("Archive is unchanged since bucket %s; %s."
+                   % (bucket.id_, "restarted its processes" if args.restart
+                                  else "nothing to do"))
+
+
+def stage_cmd(airship, args):
+    try:
+        bucket = deployer.stage(airship, args.tarfile,
+                                incremental=args.incremental)
+    except deployer.DeployError, e:
+        print >> sys.stderr, "Staging failed:", e.message
+        e.bucket.destroy()
+        sys.exit(1)
+    print bucket.id_
+
+
+def activate_cmd(airship, args):
+    try:
+        bucket = deployer.activate(airship, args.bucket_id)
+    except deployer.DeployError, e:
+        print >> sys.stderr, "Activation failed:", e.message
+        sys.exit(1)
+    else:
+        print "Bucket %s is active." % bucket.id_
+
+
+def scale_cmd(airship, args):
+    bucket = airship.get_bucket(args.bucket_id or _current)
+    concurrency = dict(bucket.config.get('concurrency') or {})
+    scaled = []
+    for item in args.process_counts:
+        if '=' not in item:
+            print "Expected PROCNAME=COUNT, got %r." % item
+            return
+        procname, count = item.split('=', 1)
+        if procname not in bucket.process_types:
+            print "Unknown process type %r." % procname
+            return
+        if not count.isdigit() or int(count) < 1:
+            print "Invalid count %r for %s, must be at least 1." % (
+                count, procname)
+            return
+        concurrency[procname] = int(count)
+        scaled.append(procname)
+    running = airship.registry.get(bucket.id_)['state'] == RUNNING
+    # the port ranges with the new counts, before they are saved; the ports
+    # of other buckets only matter if this one is running, else they are
+    # checked when it's activated
+    bucket.config = dict(bucket.config, concurrency=concurrency)
+    taken = deployer.used_ports(airship, bucket) if running else set()
+    for procname in scaled:
+        taken_by_others = taken.union(*[bucket.instance_ports(other)
+                                        for other in bucket.process_types
+                                        if other != procname])
+        overlap = taken_by_others.intersection(bucket.instance_ports(procname))
+        if overlap:
+            print "Instances of %s would use port %d, which is taken." % (
+                procname, min(overlap))
+            return
+    bucket.update_metadata(concurrency=concurrency)
+    if running:
+        bucket.start()
+
+
+def stats_cmd(airship, args):
+    records = stats.read_records(airship.log_path / stats.STATS_FILE_NAME,
+                                 args.last)
+    rows = stats.summarize(records)
+    if args.json:
+        print json.dumps({'deploys': len(records), 'phases': rows}, indent=2)
+    elif not rows:
+        print "No deployment stats yet."
+    else:
+        print stats.format_summary(rows)
+
+
+def logs_cmd(airship, args):
+    bucket = airship.get_bucket(args.bucket_id or _current)
+    paths = logs.log_files(bucket.log_folder, args.procname)
+    if not paths:
+        print "No logs for bucket %s." % bucket.id_
+        return
+    since = None
+    if args.since is not None:
+        try:
+            since = logs.parse_since(args.since)
+        except ValueError, e:
+            print e
+            return
+    try:
+        regex = re.compile(args.grep, re.M) if args.grep else None
+    except re.error, e:
+        print "Invalid --grep pattern: %s" % e
+        return
+    try:
+        logs.show(paths, args.lines, since, regex, args.follow)
+    except KeyboardInterrupt:
+        pass
+
+
+def status_cmd(airship, args):
+    rows = status.collect(airship, args.interval)
+    if args.json:
+        print json.dumps({'processes': rows}, indent=2)
+    elif not rows:
+        print "No bucket processes."
+    else:
+        print status.format_table(rows)
+
+
+def crashloop_cmd(airship, args):
+    tracker = crashloop.CrashLoop(airship.var_path / 'run' /
+                                  crashloop.STATE_NAME)
+    if args.reset is None:
+        print json.dumps(tracker.load(), indent=2, sort_keys=True)
+        return
+    with tracker.locked():
+        state = tracker.load()
+        parked = tracker.forget(state, args.reset or None)
+        tracker.save(state)
+    airship.daemons.start_processes(parked)
+    for name in parked:
+        print "Started %s." % name
+
+
+def reap_cmd(airship, args):
+    airship.trash_path.mkdir_p()
+    reaper.reap(airship.trash_path)
+
+
+def rollback_cmd(airship, args):
+    try:
+        bucket = deployer.rollback(airship, args.bucket_id)
+    except deployer.DeployError, e:
+        print >> sys.stderr, "Rollback failed:", e.message
+        sys.exit(1)
+    else:
+        print "Bucket %s is active." % bucket.id_
 
 
 def build_args_parser():
     import argparse
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(prog='airship')
     parser.add_argument('airship_home')
+    parser.add_argument('--timing', action='store_true',
+                        help="print a breakdown of startup time to stderr")
     subparsers = parser.add_subparsers()
 
     def create_command(name, handler):
@@ -239,7 +581,69 @@ def build_args_parser():
     run_parser.add_argument('command', nargs=argparse.REMAINDER)
 
     deploy_parser = create_command('deploy', deploy_cmd)
-    deploy_parser.add_argument('tarfile')
+    deploy_parser.add_argument('tarfile',
+                               help="application tarball (plain, gzip, "
+                                    "bzip2 or xz), or - to read from stdin")
+    deploy_parser.add_argument('--incremental', action='store_true',
+                               help="hardlink files unchanged since the "
+                                    "previous bucket")
+    deploy_parser.add_argument('--restart', action='store_true',
+                               help="if the archive is unchanged, restart "
+                                    "the active bucket's processes")
+    deploy_parser.add_argument('--force', action='store_true',
+                               help="deploy even if the archive is "
+                                    "unchanged")
+
+    stage_parser = create_command('stage', stage_cmd)
+    stage_parser.add_argument('tarfile',
+                              help="application tarball, or - to read "
+                                   "from stdin")
+    stage_parser.add_argument('--incremental', action='store_true',
+                              help="hardlink files unchanged since the "
+                                   "active bucket")
+
+    activate_parser = create_command('activate', activate_cmd)
+    activate_parser.add_argument('-d', '--bucket_id', required=True)
+
+    rollback_parser = create_command('rollback', rollback_cmd)
+    rollback_parser.add_argument('-d', '--bucket_id')
+
+    create_command('reap', reap_cmd)
+
+    logs_parser = create_command('logs', logs_cmd)
+    logs_parser.add_argument('-d', '--bucket_id')
+    logs_parser.add_argument('procname', nargs='?',
+                             help="process type, e.g. web, or instance, "
+                                  "e.g. web-2")
+    logs_parser.add_argument('-n', '--lines', type=int, default=10)
+    logs_parser.add_argument('-f', '--follow', action='store_true')
+    logs_parser.add_argument('--since',
+                             help="print the segments written since this "
+                                  "long ago (e.g. 2h) or this local time")
+    logs_parser.add_argument('--grep', metavar='REGEX',
+                             help="print only matching lines")
+
+    status_parser = create_command('status', status_cmd)
+    status_parser.add_argument('--interval', type=float, default=0,
+                               help="measure CPU use over this many "
+                                    "seconds instead of since start")
+    status_parser.add_argument('--json', action='store_true')
+
+    crashloop_parser = create_command('crashloop', crashloop_cmd)
+    crashloop_parser.add_argument('--reset', nargs='*', metavar='process',
+                                  help="forget the failures of these "
+                                       "processes, or of all, and start "
+                                       "the parked ones")
+
+    stats_parser = create_command('stats', stats_cmd)
+    stats_parser.add_argument('--last', type=int, default=100,
+                              help="summarize this many recent deployments")
+    stats_parser.add_argument('--json', action='store_true')
+
+    scale_parser = create_command('scale', scale_cmd)
+    scale_parser.add_argument('-d', '--bucket_id')
+    scale_parser.add_argument('process_counts', nargs='+',
+                              metavar='procname=count')
 
     define_arguments.send(None, create_command=create_command)
 
@@ -256,21 +660,60 @@ def set_up_logging(airship_home):
     logging.getLogger().addHandler(handler)
 
 
-def main(raw_arguments=None):
-    parser = build_args_parser()
-    args = parser.parse_args(raw_arguments or sys.argv[1:])
-    airship_home = path(args.airship_home).abspath()
-    set_up_logging(airship_home)
+def peek_arguments(raw_arguments):
+    """ Find `airship_home` and the subcommand name before the full parser,
+    which needs the plugins, is built. Top-level options take no values, so
+    the first two positional arguments are the ones we want. """
+    positional = [a for a in raw_arguments if not a.startswith('-')]
+    positional += [None, None]
+    return positional[0], positional[1]
+
+
+def load_config(airship_home):
     airship_yaml_path = airship_home / 'etc' / 'airship.yaml'
     if airship_yaml_path.isfile():
         with airship_yaml_path.open('rb') as f:
-            config = yaml.load(f)
+            config = yaml.load(f) or {}
     else:
         config = {}
     config['home'] = airship_home
+    return config
+
+
+def print_timings(timings):
+    for label, seconds in timings:
+        print >> sys.stderr, "%-30s %8.1f ms" % (label, seconds * 1000)
+
+
+def main(raw_arguments=None):
+    timings = [('import airship.core', _import_finished - _import_started)]
+    t0 = time.time()
+    raw_arguments = raw_arguments or sys.argv[1:]
+    airship_home_arg, command = peek_arguments(raw_arguments)
+    if airship_home_arg is None:
+        build_args_parser().parse_args(raw_arguments)  # prints usage
+
+    airship_home = path(airship_home_arg).abspath()
+    set_up_logging(airship_home)
+    config = load_config(airship_home)
+    timings.append(('read configuration', time.time() - t0))
+
+    t0 = time.time()
     airship = Airship(config)
-    load_plugins(airship)
-    args.func(airship, args)
+    timings.append(('open airship', time.time() - t0))
+
+    load_plugins(airship, command)
+    parser = build_args_parser()
+    args = parser.parse_args(raw_arguments)
+
+    t0 = time.time()
+    try:
+        args.func(airship, args)
+    finally:
+        if args.timing:
+            timings += plugin_registry.timings
+            timings.append(('run command', time.time() - t0))
+            print_timings(timings)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,210 @@
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import logging
+import argparse
+from contextlib import contextmanager
+from .daemons import RPC_ERRORS
+
+log = logging.getLogger(__name__)
+
+STATE_NAME = 'crashloop.json'
+WINDOW = 60
+THRESHOLD = 3
+PARK_AFTER = 10
+BASE_DELAY = 5
+MAX_DELAY = 300
+FORGET_AFTER = 24 * 3600
+BUCKET_GROUP = re.compile(r'^d\d+-')
+
+RETRY = 'retry'
+PARK = 'park'
+
+
+class CrashLoop(object):
+    """ Exit history of the bucket processes, kept in a JSON file in
+    ``var/run`` so that airship commands can report it. A process that
+    exits unexpectedly less than `window` seconds after it started running
+    is failing; from the `threshold`-th consecutive failure on, it's
+    stopped and started again after a delay that doubles with every
+    failure, up to `max_delay`. After `park_after` failures it's parked:
+    stopped until someone resets it. Changes are made holding `locked`,
+    since the listener and `airship crashloop --reset` both update the
+    file. """
+
+    def __init__(self, state_path, window=WINDOW, threshold=THRESHOLD,
+                 park_after=PARK_AFTER, base_delay=BASE_DELAY,
+                 max_delay=MAX_DELAY):
+        self.state_path = state_path
+        self.window = window
+        self.threshold = threshold
+        self.park_after = park_after
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @contextmanager
+    def locked(self):
+        """ Hold an exclusive lock on the state, from `load` until `save`. """
+        with open(self.state_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self):
+        try:
+            with open(self.state_path, 'rb') as f:
+                return json.load(f)
+        except IOError:
+            return {}
+        except ValueError:
+            log.warning("Ignoring corrupt %s", self.state_path)
+            return {}
+
+    def save(self, state):
+        tmp_path = '%s.%d.tmp' % (self.state_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.state_path)
+
+    def _entry(self, state, name):
+        return state.setdefault(name, {
+            'failures': 0, 'exits': 0, 'running_since': None,
+            'last_exit': None, 'retry_at': None, 'parked': False})
+
+    def running(self, state, name, now):
+        """ Record that `name` is running. A parked process only runs again
+        if someone started it, so it gets a clean slate. """
+        entry = self._entry(state, name)
+        entry['running_since'] = now
+        if entry['parked']:
+            entry['parked'] = False
+            entry['failures'] = 0
+
+    def exited(self, state, name, expected, now):
+        """ Record the exit of process `name`. Returns `RETRY` and the
+        delay, `PARK`, or `None` if supervisor should restart it as usual. """
+        entry = self._entry(state, name)
+        since = entry['running_since']
+        entry['running_since'] = None
+        entry['last_exit'] = now
+        entry['exits'] = entry.get('exits', 0) + 1
+        if expected:
+            entry['failures'] = 0
+            return None
+        if since is not None and now - since >= self.window:
+            entry['failures'] = 0
+        entry['failures'] += 1
+        if entry['failures'] >= self.park_after:
+            entry['parked'] = True
+            entry['retry_at'] = None
+            return PARK, None
+        if entry['failures'] >= self.threshold:
+            delay = min(self.base_delay *
+                        2 ** (entry['failures'] - self.threshold),
+                        self.max_delay)
+            entry['retry_at'] = now + delay
+            return RETRY, delay
+        return None
+
+    def due(self, state, now):
+        """ Processes whose backoff delay is over; they are taken off the
+        schedule. Entries of processes that haven't failed for a day, e.g.
+        because their bucket is gone, are dropped. """
+        names = []
+        for name, entry in sorted(state.items()):
+            if entry['retry_at'] is not None and entry['retry_at'] <= now:
+                entry['retry_at'] = None
+                names.append(name)
+            elif (not entry['parked'] and entry['retry_at'] is None and
+                    now - (entry['last_exit'] or now) > FORGET_AFTER):
+                del state[name]
+        return names
+
+    def forget(self, state, names):
+        """ Reset the history of `names`, or of all processes. Returns the
+        ones that were parked, to be started again. """
+        if names is None:
+            names = list(state)
+        parked = [n for n in names if n in state and state[n]['parked']]
+        for name in names:
+            state.pop(name, None)
+        return parked
+
+
+def _call(func, *args):
+    try:
+        func(*args)
+    except RPC_ERRORS, e:
+        log.warning("%s%r failed: %s", func, args, e)
+
+
+def handle(crashloop, supervisor, eventname, headers, now):
+    with crashloop.locked():
+        _handle(crashloop, supervisor, eventname, headers, now)
+
+
+def _handle(crashloop, supervisor, eventname, headers, now):
+    state = crashloop.load()
+    if eventname.startswith('TICK'):
+        for name in crashloop.due(state, now):
+            log.info("Starting %s after backoff", name)
+            _call(supervisor.startProcess, name, False)
+        crashloop.save(state)
+        return
+    if not BUCKET_GROUP.match(headers['groupname']):
+        return
+    name = '%s:%s' % (headers['groupname'], headers['processname'])
+    if eventname == 'PROCESS_STATE_RUNNING':
+        crashloop.running(state, name, now)
+    elif eventname == 'PROCESS_STATE_EXITED':
+        action = crashloop.exited(state, name, int(headers['expected']), now)
+        if action is not None:
+            action, delay = action
+            failures = state[name]['failures']
+            if action == PARK:
+                log.warning("Parking %s after %d failures", name, failures)
+            else:
+                log.warning("%s failed %d times, starting it again in %ds",
+                            name, failures, delay)
+            _call(supervisor.stopProcess, name, False)
+    crashloop.save(state)
+
+
+def listen(crashloop, supervisor, stdin=sys.stdin, stdout=sys.stdout):
+    """ Supervisor event listener loop. """
+    from supervisor import childutils
+    while True:
+        headers, payload = childutils.listener.wait(stdin, stdout)
+        try:
+            handle(crashloop, supervisor, headers['eventname'],
+                   childutils.get_headers(payload.split('\n', 1)[0]),
+                   time.time())
+        except Exception:
+            log.exception("Failed to handle %s", headers['eventname'])
+        childutils.listener.ok(stdout)
+
+
+def main(argv=None):
+    from supervisor import childutils
+    parser = argparse.ArgumentParser(prog='python -m airship.crashloop')
+    parser.add_argument('state_path')
+    parser.add_argument('--window', type=int, default=WINDOW)
+    parser.add_argument('--threshold', type=int, default=THRESHOLD)
+    parser.add_argument('--park-after', type=int, default=PARK_AFTER)
+    parser.add_argument('--max-delay', type=int, default=MAX_DELAY)
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    crashloop = CrashLoop(args.state_path, args.window, args.threshold,
+                          args.park_after, max_delay=args.max_delay)
+    rpc = childutils.getRPCInterface(os.environ)
+    listen(crashloop, rpc.supervisor)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,17 @@
 import os
 import sys
-import subprocess
-from path import path
+import socket
+import xmlrpclib
 
 
 class SupervisorError(Exception):
     """ Something went wrong while talking to supervisord. """
 
 
+SUCCESS = 80  # supervisor.xmlrpc.Faults.SUCCESS
+RPC_ERRORS = (socket.error, xmlrpclib.Fault, xmlrpclib.ProtocolError)
+
+
 SUPERVISORD_CFG_TEMPLATE = """\
 [unix_http_server]
 file = %(home_path)s/var/run/supervisor.sock
@@ -24,31 +28,77 @@ directory = %(home_path)s
 [supervisorctl]
 serverurl = unix://%(home_path)s/var/run/supervisor.sock
 
+[eventlistener:airship-crashloop]
+command = %(python)s -m airship.crashloop \
+%(home_path)s/var/run/crashloop.json%(crashloop_args)s
+events = PROCESS_STATE_RUNNING,PROCESS_STATE_EXITED,TICK_5
+stderr_logfile = %(home_path)s/var/log/crashloop.log
+
 [include]
 files = %(include_files)s
 """
 
+SUPERVISORD_WATCHDOG_TEMPLATE = """
+[eventlistener:airship-watchdog]
+command = %(python)s -m airship.watchdog %(home_path)s
+events = TICK_5
+stderr_logfile = %(home_path)s/var/log/watchdog.log
+"""
+
+SUPERVISORD_EXPORTER_TEMPLATE = """
+[program:airship-exporter]
+command = %(python)s -m airship.exporter %(home_path)s
+redirect_stderr = true
+stdout_logfile = %(home_path)s/var/log/exporter.log
+"""
+
+SUPERVISORD_SOCKETS_TEMPLATE = """
+[program:airship-sockets]
+command = %(python)s -m airship.sockets %(home_path)s/var/run/sockets.sock
+priority = 1
+redirect_stderr = true
+stdout_logfile = %(home_path)s/var/log/sockets.log
+"""
+
+SUPERVISORD_LOGS_TEMPLATE = """
+[eventlistener:airship-logs]
+command = %(python)s -m airship.logs %(home_path)s/var/log --keep %(keep)d
+events = TICK_60
+stderr_logfile = %(home_path)s/var/log/logs.log
+"""
+
+LOG_MAXBYTES = '50MB'
+LOG_BACKUPS = 10
+
+CRASHLOOP_OPTIONS = ['window', 'threshold', 'park_after', 'max_delay']
+
 
 SUPERVISORD_PROGRAM_TEMPLATE = """\
 [program:%(bucket)s-%(procname)s]
 redirect_stderr = true
-stdout_logfile = %(var)s/log/%(procname)s.log
+stdout_logfile = %(log_folder)s/%(procname)s%(instance_suffix)s.log
+stdout_logfile_maxbytes = %(log_maxbytes)s
+stdout_logfile_backups = %(log_backups)d
 startsecs = %(startsecs)s
 startretries = 1
 autostart = %(autostart)s
-command = bin/airship run -d %(bucket_id)s %(procname)s
+command = %(launcher)s%(launcher_args)s
+%(instances)s
+"""
 
+SUPERVISORD_INSTANCES_TEMPLATE = """\
+numprocs = %(numprocs)d
+process_name = %%(program_name)s-%%(process_num)d
 """
 
 
 class Supervisor(object):
     """ Wrapper for supervisor configuration and control """
 
-    ctl_path = str(path(sys.prefix).abspath() / 'bin' / 'supervisorctl')
-
     def __init__(self, etc):
         self.etc = etc
         self.config_dir.makedirs_p()
+        self._rpc = None
 
     @property
     def config_path(self):
@@ -58,50 +108,165 @@ class Supervisor(object):
     def config_dir(self):
         return self.etc / 'supervisor.d'
 
+    @property
+    def socket_path(self):
+        return self.etc.parent / 'var' / 'run' / 'supervisor.sock'
+
+    @property
+    def rpc(self):
+        """ XML-RPC proxy for supervisord. The connection is kept open and
+        reused for subsequent calls. """
+        if self._rpc is None:
+            from supervisor.xmlrpc import SupervisorTransport
+            transport = SupervisorTransport(serverurl='unix://' +
+                                            self.socket_path)
+            self._rpc = xmlrpclib.ServerProxy('http://127.0.0.1', transport)
+        return self._rpc
+
     def _bucket_cfg(self, bucket_id):
         return self.config_dir / bucket_id
 
-    def configure(self, home_path):
+    def configure(self, home_path, crashloop=None, watchdog=False,
+                  exporter=False, sockets=False, logs=None):
+        """ Write the supervisord configuration. `crashloop` holds settings
+        for the crash loop event listener, see `airship.crashloop`. The
+        `watchdog` listener, the metrics `exporter` and the `sockets`
+        holder are added if enabled, and the listener that compresses
+        rotated logs unless the `logs` settings disable it. """
+        logs = logs or {}
+        crashloop_args = ''.join(
+            ' --%s %d' % (name.replace('_', '-'), crashloop[name])
+            for name in CRASHLOOP_OPTIONS if name in (crashloop or {}))
+        values = {
+            'home_path': home_path,
+            'python': sys.executable,
+            'crashloop_args': crashloop_args,
+            'include_files': self.etc / 'supervisor.d' / '*',
+        }
         with open(self.config_path, 'wb') as f:
-            f.write(SUPERVISORD_CFG_TEMPLATE % {
-                'home_path': home_path,
-                'include_files': self.etc / 'supervisor.d' / '*',
-            })
+            f.write(SUPERVISORD_CFG_TEMPLATE % values)
+            if watchdog:
+                f.write(SUPERVISORD_WATCHDOG_TEMPLATE % values)
+            if exporter:
+                f.write(SUPERVISORD_EXPORTER_TEMPLATE % values)
+            if sockets:
+                f.write(SUPERVISORD_SOCKETS_TEMPLATE % values)
+            if logs.get('compress', True):
+                f.write(SUPERVISORD_LOGS_TEMPLATE % dict(
+                    values, keep=logs.get('backups', LOG_BACKUPS)))
 
     def _configure_bucket(self, bucket, autostart):
+        logs = bucket.airship.config.get('logs') or {}
+        bucket.log_folder.makedirs_p()
         with self._bucket_cfg(bucket.id_).open('wb') as f:
             for procname in bucket.process_types:
+                numprocs = bucket.instances(procname)
+                multiple = numprocs > 1
                 f.write(SUPERVISORD_PROGRAM_TEMPLATE % {
-                    'var': bucket.airship.var_path,
+                    'log_folder': bucket.log_folder,
+                    'log_maxbytes': logs.get('maxbytes', LOG_MAXBYTES),
+                    'log_backups': logs.get('backups', LOG_BACKUPS),
                     'bucket': bucket.id_,
                     'directory': bucket.folder,
                     'bucket_id': bucket.id_,
                     'autostart': 'true' if autostart else 'false',
                     'startsecs': 2 if autostart else 0,
                     'procname': procname,
+                    'launcher': bucket.launcher_path(procname),
+                    'launcher_args': ' %(process_num)d' if multiple else '',
+                    'instance_suffix': '-%(process_num)d' if multiple else '',
+                    'instances': (SUPERVISORD_INSTANCES_TEMPLATE %
+                                  {'numprocs': numprocs} if multiple else ''),
                 })
 
+    def _group_names(self, bucket):
+        return ['%s-%s' % (bucket.id_, procname)
+                for procname in bucket.process_types]
+
     def remove_bucket(self, bucket_id):
         self._bucket_cfg(bucket_id).unlink_p()
         try:
-            self.ctl(['update'])
+            self.update(bucket_id)
         except SupervisorError:
             pass  # maybe supervisord is stopped
 
-    def ctl(self, cmd_args):
+    def update(self, bucket_id, start_groups=()):
+        """ Make supervisord reread its configuration, then add, remove or
+        restart the programs of `bucket_id` that have changed. Programs of
+        other buckets are left alone. Groups in `start_groups` are started
+        if they are not running already. """
+        if os.environ.get('AIRSHIP_NO_SUPERVISORCTL'):
+            return
+        prefix = bucket_id + '-'
+        supervisor = self.rpc.supervisor
+        try:
+            [[added, changed, removed]] = supervisor.reloadConfig()
+            for name in removed + changed:
+                if name.startswith(prefix):
+                    supervisor.stopProcessGroup(name)
+                    supervisor.removeProcessGroup(name)
+            for name in changed + added:
+                if name.startswith(prefix):
+                    supervisor.addProcessGroup(name)
+            for name in start_groups:
+                self._start_group(supervisor, name)
+        except RPC_ERRORS, e:
+            raise SupervisorError(str(e))
+
+    def _start_group(self, supervisor, name):
+        for result in supervisor.startProcessGroup(name):
+            if result['status'] != SUCCESS:
+                raise SupervisorError(result['description'])
+
+    def restart_bucket(self, bucket):
+        """ Stop and start the programs of `bucket`, without rereading the
+        supervisor configuration. """
         if os.environ.get('AIRSHIP_NO_SUPERVISORCTL'):
             return
-        base_args = [self.ctl_path, '-c', self.config_path]
+        supervisor = self.rpc.supervisor
         try:
-            return subprocess.check_call(base_args + cmd_args,
-                                         stdout=sys.stderr)
-        except subprocess.CalledProcessError:
-            raise SupervisorError
+            for name in self._group_names(bucket):
+                supervisor.stopProcessGroup(name)
+                self._start_group(supervisor, name)
+        except RPC_ERRORS, e:
+            raise SupervisorError(str(e))
+
+    def start_processes(self, names):
+        """ Start the processes `names`, given as ``group:name``. """
+        if os.environ.get('AIRSHIP_NO_SUPERVISORCTL'):
+            return
+        try:
+            for name in names:
+                self.rpc.supervisor.startProcess(name)
+        except RPC_ERRORS, e:
+            raise SupervisorError(str(e))
+
+    def all_process_info(self):
+        """ Supervisor's information about all its processes, fetched with a
+        single call. Returns `None` if supervisor is disabled. """
+        if os.environ.get('AIRSHIP_NO_SUPERVISORCTL'):
+            return None
+        try:
+            return self.rpc.supervisor.getAllProcessInfo()
+        except RPC_ERRORS, e:
+            raise SupervisorError(str(e))
+
+    def process_states(self, bucket_id):
+        """ Map the processes of `bucket_id`, as ``group:name``, to their
+        supervisor state name, e.g. ``RUNNING``. Returns `None` if supervisor
+        is disabled. """
+        infos = self.all_process_info()
+        if infos is None:
+            return None
+        prefix = bucket_id + '-'
+        return dict(('%s:%s' % (info['group'], info['name']),
+                     info['statename'])
+                    for info in infos if info['group'].startswith(prefix))
 
     def configure_bucket_running(self, bucket):
         self._configure_bucket(bucket, True)
-        self.ctl(['update'])
+        self.update(bucket.id_, start_groups=self._group_names(bucket))
 
     def configure_bucket_stopped(self, bucket):
         self._configure_bucket(bucket, False)
-        self.ctl(['update'])
+        self.update(bucket.id_)
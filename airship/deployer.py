@@ -1,9 +1,17 @@
-import subprocess
-import blinker
+import time
+import socket
+import logging
 from .daemons import SupervisorError
+from .signals import bucket_setup
+from .registry import parse_id, STAGED, RUNNING, STOPPED
+from . import archive
+from . import sockets
+from . import stats
 
+log = logging.getLogger(__name__)
 
-bucket_setup = blinker.Signal()
+READINESS_TIMEOUT = 30
+READINESS_POLL_INTERVAL = 0.5
 
 
 class DeployError(Exception):
@@ -21,20 +29,433 @@ def get_procs(bucket):
 
 
 def remove_old_buckets(bucket):
+    """ Stop the `keep_buckets` most recent buckets that were ever active,
+    so they can be rolled back to, and destroy all the others. Staged
+    buckets are left alone; they are waiting to be activated. """
     airship = bucket.airship
+    keep = airship.config.get('keep_buckets', 0)
+    for bucket_info in reversed(airship.list_buckets()['buckets']):
+        if bucket_info['id'] == bucket.id_:
+            continue
+        if bucket_info['state'] == STAGED:
+            continue
+        old_bucket = airship.get_bucket(bucket_info['id'])
+        if keep > 0 and bucket_info['activated'] is not None:
+            keep -= 1
+            if bucket_info['state'] != STOPPED:
+                old_bucket.stop()
+        else:
+            old_bucket.destroy()
+
+
+def active_bucket(airship):
+    try:
+        return airship.get_bucket()
+    except KeyError:
+        return None
+
+
+def extract(bucket, source, previous=None):
+    try:
+        counts = archive.extract(source, bucket.folder,
+                                 previous and previous.folder)
+    except archive.ArchiveError, e:
+        raise DeployError(bucket, "Failed to extract archive: %s" % e)
+    log.info("Extracted %d files into %r (%d linked, %d skipped), "
+             "archive hash %s", counts['written'] + counts['linked'],
+             bucket.id_, counts['linked'], counts['skipped'], counts['hash'])
+    bucket.update_metadata(archive_hash=counts['hash'],
+                           disk_size=counts['size'])
+
+
+def _ports(bucket):
+    ports = set()
+    for procname in bucket.process_types:
+        ports.update(bucket.instance_ports(procname))
+    return ports
+
+
+def used_ports(airship, bucket):
+    """ Ports of the running buckets other than `bucket`. """
+    used = set()
     for bucket_info in airship.list_buckets()['buckets']:
         if bucket_info['id'] == bucket.id_:
             continue
-        airship.get_bucket(bucket_info['id']).destroy()
+        if bucket_info['state'] != RUNNING:
+            continue
+        used.update(_ports(airship.get_bucket(bucket_info['id'])))
+    return used
 
 
-def deploy(airship, tarfile):
-    bucket = airship.new_bucket()
-    subprocess.check_call(['tar', 'xf', tarfile, '-C', bucket.folder])
-    bucket._read_procfile()
-    bucket_setup.send(airship, bucket=bucket)
-    remove_old_buckets(bucket)
+def allocate_ports(bucket):
+    """ Pick, for each process type listed in `port_pool`, a base port such
+    that the ports of all its instances are not used by any other running
+    bucket. Other process types keep their port, so unless they use socket
+    activation, that port must not be used by a running bucket either:
+    they would fail to bind it, or pass the readiness check on the running
+    bucket's processes. """
+    airship = bucket.airship
+    used = used_ports(airship, bucket)
+    for procname in bucket.process_types:
+        if (procname not in airship.config['port_pool'] and
+                not bucket.uses_socket_activation(procname) and
+                used.intersection(bucket.instance_ports(procname))):
+            raise DeployError(bucket, "Process type %r uses the port of the "
+                                      "running bucket and is not in "
+                                      "port_pool." % procname)
+    ports = {}
+    for procname, pool in airship.config['port_pool'].items():
+        if procname not in bucket.process_types:
+            continue
+        count = bucket.instances(procname)
+        free = [port for port in pool
+                if not used.intersection(range(port, port + count))]
+        if not free:
+            raise DeployError(bucket, "No free port in port_pool for %r."
+                                      % procname)
+        ports[procname] = free[0]
+    bucket.update_metadata(ports=ports)
+
+
+def _port_is_open(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=1).close()
+    except socket.error:
+        return False
+    return True
+
+
+def _probed_ports(bucket):
+    """ Ports that show whether the processes of `bucket` listen. The
+    sockets of process types with socket activation are opened by the
+    socket holder, so they accept connections before the processes do. """
+    ports = set()
+    for procname in bucket.process_types:
+        if not bucket.uses_socket_activation(procname):
+            ports.update(bucket.instance_ports(procname))
+    return ports
+
+
+def ready_notifications(bucket):
+    """ Bind the sockets where the processes of `bucket` listed in
+    ``notify_ready`` send ``READY=1``; they must exist before the processes
+    start. Returns `None` if there are no such processes. """
+    paths = []
+    for procname in bucket.process_types:
+        if bucket.notifies_ready(procname):
+            paths.extend(bucket.notify_paths(procname))
+    return sockets.ReadyNotifications(paths) if paths else None
+
+
+def wait_until_ready(bucket, timeout, notifications=None):
+    """ Wait until all processes of `bucket` are running, listening on
+    their ports and, if they send `notifications`, have said they are
+    ready. Returns `False` if that doesn't happen within `timeout` seconds
+    or if a process fails. """
+    groups = ['%s-%s' % (bucket.id_, p) for p in bucket.process_types]
+    ports = _probed_ports(bucket)
+    deadline = time.time() + timeout
+    notified = notifications is None
+    while True:
+        states = bucket.airship.daemons.process_states(bucket.id_)
+        if states is not None:
+            if any(s in ('FATAL', 'EXITED') for s in states.values()):
+                return False
+            started = set(name.split(':')[0] for name in states)
+            running = (started.issuperset(groups) and
+                       all(s == 'RUNNING' for s in states.values()))
+        else:
+            running = True
+        if (running and notified and
+                all(_port_is_open(p) for p in ports)):
+            return True
+        if time.time() > deadline:
+            return False
+        if notifications is None:
+            time.sleep(READINESS_POLL_INTERVAL)
+        else:
+            notified = notifications.receive(READINESS_POLL_INTERVAL)
+
+
+def start(bucket):
     try:
         bucket.start()
     except SupervisorError:
         raise DeployError(bucket, "Failed to start bucket.")
+
+
+def shares_ports(bucket):
+    """ Can `bucket` run next to another bucket on the same ports? That's
+    the case if every process type that has a port uses socket activation,
+    so it gets its socket from the socket holder. """
+    ported = [p for p in bucket.process_types
+              if bucket.port_for(p) is not None]
+    return bool(ported) and all(bucket.uses_socket_activation(p)
+                                for p in ported)
+
+
+def start_and_wait(bucket):
+    """ Start `bucket` and wait until it's ready, see `wait_until_ready`.
+    Returns `False` if it's not ready within ``readiness_timeout``. """
+    notifications = ready_notifications(bucket)
+    try:
+        with stats.phase('start'):
+            start(bucket)
+        timeout = bucket.airship.config.get('readiness_timeout',
+                                            READINESS_TIMEOUT)
+        with stats.phase('readiness'):
+            return wait_until_ready(bucket, timeout,
+                                    notifications=notifications)
+    finally:
+        if notifications is not None:
+            notifications.close()
+
+
+def activate_blue_green(bucket, allocate=True):
+    """ Start `bucket` next to the running one, on ports from `port_pool`
+    if `allocate` is set, else on the same ports, shared with socket
+    activation, and only remove the old bucket once the new one is
+    ready. """
+    if allocate:
+        allocate_ports(bucket)
+    if not start_and_wait(bucket):
+        raise DeployError(bucket, "Bucket failed the readiness check.")
+    with stats.phase('remove_old_buckets'):
+        remove_old_buckets(bucket)
+
+
+def _timer(airship, kind):
+    return stats.DeployTimer(airship.log_path / stats.STATS_FILE_NAME, kind)
+
+
+def _new_bucket(airship, tarfile, incremental, timer):
+    previous = active_bucket(airship) if incremental else None
+    bucket = airship.new_bucket()
+    timer.bucket_id = bucket.id_
+    with stats.phase('extract'):
+        extract(bucket, tarfile, previous)
+    return bucket
+
+
+def _set_up(airship, bucket):
+    bucket._read_procfile()
+    with stats.phase('bucket_setup'):
+        bucket_setup.send(airship, bucket=bucket)
+
+
+def _stage(airship, tarfile, incremental, timer):
+    bucket = _new_bucket(airship, tarfile, incremental, timer)
+    _set_up(airship, bucket)
+    return bucket
+
+
+def stop_running_buckets(bucket):
+    """ Stop the running buckets other than `bucket`, so it can take over
+    their ports, and return them. """
+    airship = bucket.airship
+    stopped = []
+    for bucket_info in airship.list_buckets()['buckets']:
+        if bucket_info['id'] == bucket.id_:
+            continue
+        if bucket_info['state'] != RUNNING:
+            continue
+        old_bucket = airship.get_bucket(bucket_info['id'])
+        old_bucket.stop()
+        stopped.append(old_bucket)
+    return stopped
+
+
+def _start_again(bucket, stopped):
+    """ `bucket` failed to start; stop it and start the `stopped` buckets
+    again. """
+    try:
+        bucket.stop()
+    except SupervisorError:
+        log.exception("Failed to stop bucket %r", bucket.id_)
+    for old_bucket in stopped:
+        log.info("Starting bucket %r again", old_bucket.id_)
+        try:
+            old_bucket.start()
+        except SupervisorError:
+            log.exception("Failed to start bucket %r again", old_bucket.id_)
+
+
+def activate_in_place(bucket):
+    """ Stop the running bucket and start `bucket` on the same ports. Old
+    buckets are only removed once `bucket` has started; if it fails to
+    start, the stopped buckets are started again. """
+    with stats.phase('stop_old_buckets'):
+        stopped = stop_running_buckets(bucket)
+    try:
+        with stats.phase('start'):
+            start(bucket)
+    except DeployError:
+        _start_again(bucket, stopped)
+        raise
+    with stats.phase('remove_old_buckets'):
+        remove_old_buckets(bucket)
+
+
+def _restore_active(airship, bucket_id):
+    """ Point the registry back at `bucket_id`, the bucket that was active
+    before a failed activation; starting the new bucket had moved the
+    pointer to it. """
+    if bucket_id is not None and bucket_id not in airship.registry:
+        bucket_id = None
+    airship.registry.set_active(bucket_id)
+
+
+def _activate(airship, bucket):
+    previous_id = airship.registry.get_active()
+    try:
+        if airship.config.get('port_pool'):
+            activate_blue_green(bucket)
+        elif airship.config.get('socket_activation') and shares_ports(bucket):
+            activate_blue_green(bucket, allocate=False)
+        else:
+            activate_in_place(bucket)
+    except DeployError:
+        _restore_active(airship, previous_id)
+        raise
+
+
+def unchanged_bucket(airship, archive_hash):
+    """ The active bucket, if it's running and was deployed from an archive
+    with `archive_hash`. """
+    current = active_bucket(airship)
+    if current is None or archive_hash is None:
+        return None
+    record = airship.registry.get(current.id_)
+    if record['state'] == RUNNING and record['archive_hash'] == archive_hash:
+        return current
+    return None
+
+
+def _redeploy(bucket, restart, timer):
+    log.info("Archive unchanged since bucket %r, skipping deployment",
+             bucket.id_)
+    timer.kind = 'unchanged'
+    timer.bucket_id = bucket.id_
+    if restart:
+        with stats.phase('restart'):
+            try:
+                bucket.restart()
+            except SupervisorError:
+                raise DeployError(None, "Failed to restart bucket.")
+    return bucket
+
+
+def deploy(airship, tarfile, incremental=False, restart=False, force=False):
+    """ Deploy `tarfile` into a new bucket and return it. The duration of
+    each phase is appended to the deployment stats in ``var/log``.
+
+    Unless `force` is set, an archive identical to the one of the active
+    bucket is not deployed again; the active bucket is returned instead,
+    and its processes are restarted if `restart` is set. A file is hashed
+    before anything is extracted; a stream is hashed while extracting, and
+    the new bucket is then thrown away before its setup. """
+    with _timer(airship, 'deploy') as timer:
+        if not force:
+            with stats.phase('hash'):
+                try:
+                    archive_hash = archive.file_hash(tarfile)
+                except archive.ArchiveError, e:
+                    raise DeployError(None, str(e))
+            current = unchanged_bucket(airship, archive_hash)
+            if current is not None:
+                return _redeploy(current, restart, timer)
+        bucket = _new_bucket(airship, tarfile, incremental, timer)
+        if not force:
+            archive_hash = airship.registry.get(bucket.id_)['archive_hash']
+            current = unchanged_bucket(airship, archive_hash)
+            if current is not None:
+                bucket.destroy()
+                return _redeploy(current, restart, timer)
+        _set_up(airship, bucket)
+        _activate(airship, bucket)
+        return bucket
+
+
+def stage(airship, tarfile, incremental=False):
+    """ Prepare a new bucket from `tarfile`: extract it and run the
+    `bucket_setup` handlers, e.g. to install dependencies, but don't start
+    it. The bucket stays in the staged state until it's activated. """
+    with _timer(airship, 'stage') as timer:
+        return _stage(airship, tarfile, incremental, timer)
+
+
+def activate(airship, bucket_id):
+    """ Start a staged bucket and retire the active one, like the second
+    half of `deploy`. If that fails, the bucket is stopped and staged again,
+    and the previously active bucket stays active. """
+    try:
+        bucket = airship.get_bucket(bucket_id)
+    except KeyError:
+        raise DeployError(None, "There is no bucket %s." % bucket_id)
+    if airship.registry.get(bucket.id_)['state'] != STAGED:
+        raise DeployError(bucket, "Bucket %s is not staged." % bucket.id_)
+    with _timer(airship, 'activate') as timer:
+        timer.bucket_id = bucket.id_
+        try:
+            _activate(airship, bucket)
+        except DeployError:
+            bucket.stop()
+            bucket.update_metadata(state=STAGED)
+            raise
+    return bucket
+
+
+def previous_bucket(airship, current):
+    """ The newest retained bucket older than `current`. """
+    candidates = [info['id'] for info in airship.list_buckets()['buckets']
+                  if info['state'] == STOPPED and
+                  info['activated'] is not None and
+                  parse_id(info['id']) < parse_id(current.id_)]
+    if not candidates:
+        return None
+    return airship.get_bucket(candidates[-1])
+
+
+def rollback(airship, bucket_id=None):
+    """ Reactivate a retained bucket, `bucket_id` or else the one before the
+    active bucket, and stop the active bucket. Nothing is reinstalled; only
+    the supervisor configuration is rewritten. If the two buckets don't
+    share ports, or share them through socket activation, the retained
+    bucket is started first and the active one is stopped once the retained
+    one is ready. Otherwise the active bucket is stopped first, and started
+    again if the retained one fails to start. """
+    current = active_bucket(airship)
+    if current is None:
+        raise DeployError(None, "There is no active bucket.")
+    if bucket_id is not None:
+        try:
+            target = airship.get_bucket(bucket_id)
+        except KeyError:
+            raise DeployError(None, "There is no bucket %s." % bucket_id)
+    else:
+        target = previous_bucket(airship, current)
+        if target is None:
+            raise DeployError(current, "No retained bucket to roll back to.")
+    if target.id_ == current.id_:
+        raise DeployError(target, "Bucket %s is already active." % target.id_)
+    record = airship.registry.get(target.id_)
+    if record['state'] != STOPPED or record['activated'] is None:
+        raise DeployError(target, "Bucket %s is not a retained bucket."
+                                  % target.id_)
+
+    if (_ports(target) & _ports(current) and
+            not (shares_ports(target) and shares_ports(current))):
+        current.stop()
+        try:
+            start(target)
+        except DeployError:
+            _start_again(target, [current])
+            _restore_active(airship, current.id_)
+            raise
+    else:
+        if not start_and_wait(target):
+            target.stop()
+            _restore_active(airship, current.id_)
+            raise DeployError(target, "Bucket failed the readiness check.")
+        current.stop()
+    return target
@@ -0,0 +1,189 @@
+import sys
+import time
+import logging
+import argparse
+import SocketServer
+import BaseHTTPServer
+from path import path
+from . import stats
+from . import status
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9105
+TTL = 10
+LAST_DEPLOYS = 100
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PROCESS_LABELS = ['bucket', 'procname', 'name']
+
+
+def _escape(value):
+    return (unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class Metrics(object):
+    """ Lines of the Prometheus text exposition format. """
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help_text):
+        self.lines.append('# HELP %s %s' % (name, help_text))
+        self.lines.append('# TYPE %s %s' % (name, kind))
+
+    def add(self, name, value, labels=None):
+        if value is None:
+            return
+        if labels:
+            name += '{%s}' % ','.join('%s="%s"' % (k, _escape(v))
+                                      for k, v in sorted(labels.items()))
+        self.lines.append('%s %s' % (name, repr(float(value))))
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def deploy_metrics(metrics, airship):
+    rows = stats.summarize(stats.read_records(
+        airship.log_path / stats.STATS_FILE_NAME, LAST_DEPLOYS))
+    metrics.family('airship_deploy_duration_seconds', 'summary',
+                   "Duration of deployment phases and signal receivers, "
+                   "over the last %d deployments." % LAST_DEPLOYS)
+    for row in rows:
+        labels = {'phase': row['name']}
+        for p in stats.PERCENTILES:
+            metrics.add('airship_deploy_duration_seconds', row['p%d' % p],
+                        dict(labels, quantile='%g' % (p / 100.0)))
+        metrics.add('airship_deploy_duration_seconds_sum', row['sum'], labels)
+        metrics.add('airship_deploy_duration_seconds_count', row['count'],
+                    labels)
+
+
+def bucket_metrics(metrics, airship):
+    buckets = airship.list_buckets()['buckets']
+    metrics.family('airship_bucket_disk_bytes', 'gauge',
+                   "Size of the files deployed in a bucket.")
+    for bucket in buckets:
+        metrics.add('airship_bucket_disk_bytes', bucket['disk_size'],
+                    {'bucket': bucket['id'], 'state': bucket['state']})
+    metrics.family('airship_bucket_active', 'gauge',
+                   "1 for the active bucket, 0 for the others.")
+    for bucket in buckets:
+        metrics.add('airship_bucket_active', int(bucket['active']),
+                    {'bucket': bucket['id']})
+
+
+PROCESS_METRICS = [
+    ('airship_process_up', 'gauge', "1 if the process is running.", None),
+    ('airship_process_restarts_total', 'counter',
+     "Exits recorded by the crash loop listener.", 'restarts'),
+    ('airship_process_resident_memory_bytes', 'gauge',
+     "Resident memory size.", 'rss'),
+    ('airship_process_cpu_seconds_total', 'counter',
+     "User and system CPU time.", 'cpu_time'),
+    ('airship_process_open_fds', 'gauge',
+     "Open file descriptors.", 'fds'),
+    ('airship_process_uptime_seconds', 'gauge',
+     "Time since the process started.", 'uptime'),
+]
+
+
+def process_metrics(metrics, airship):
+    rows = status.collect(airship)
+    for name, kind, help_text, key in PROCESS_METRICS:
+        metrics.family(name, kind, help_text)
+        for row in rows:
+            labels = dict((k, row[k]) for k in PROCESS_LABELS)
+            if key is None:
+                value = int(row['state'] == 'RUNNING')
+            else:
+                value = row[key]
+            metrics.add(name, value, labels)
+
+
+class Collector(object):
+    """ Render the metrics of `airship`, at most once every `ttl` seconds;
+    scrapes in between get the cached text. """
+
+    sources = [deploy_metrics, bucket_metrics, process_metrics]
+
+    def __init__(self, airship, ttl=TTL):
+        self.airship = airship
+        self.ttl = ttl
+        self._text = None
+        self._expires = 0
+
+    def render(self):
+        now = time.time()
+        if self._text is None or now >= self._expires:
+            metrics = Metrics()
+            for source in self.sources:
+                try:
+                    source(metrics, self.airship)
+                except Exception:
+                    log.exception("Failed to collect %s", source.__name__)
+            self._text = metrics.text()
+            self._expires = now + self.ttl
+        return self._text
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.collector.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class UnixHTTPServer(SocketServer.UnixStreamServer):
+
+    def get_request(self):
+        request, client_address = self.socket.accept()
+        return request, ('',)
+
+
+def make_server(airship, settings):
+    """ An HTTP server for the metrics, on the unix socket given as
+    ``socket`` in `settings`, relative to airship's home, or else on
+    ``host`` and ``port``. """
+    if settings.get('socket'):
+        socket_path = airship.home_path / settings['socket']
+        socket_path.parent.makedirs_p()
+        if socket_path.exists():
+            socket_path.unlink()
+        server = UnixHTTPServer(socket_path, MetricsHandler)
+    else:
+        server = BaseHTTPServer.HTTPServer(
+            (settings.get('host', DEFAULT_HOST),
+             settings.get('port', DEFAULT_PORT)),
+            MetricsHandler)
+    server.collector = Collector(airship, settings.get('ttl', TTL))
+    return server
+
+
+def main(argv=None):
+    from .core import Airship, load_config
+    parser = argparse.ArgumentParser(prog='python -m airship.exporter')
+    parser.add_argument('airship_home')
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    airship = Airship(load_config(path(args.airship_home).abspath()))
+    server = make_server(airship, airship.config.get('exporter') or {})
+    log.info("Serving metrics on %r", server.server_address)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
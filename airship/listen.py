@@ -0,0 +1,67 @@
+import os
+import sys
+import fcntl
+import socket
+import argparse
+from .sockets import listen, fetch, DEFAULT_HOST, BACKLOG
+
+LISTEN_FDS_START = 3
+
+
+def open_socket(holder_path, host, port, backlog=BACKLOG):
+    """ A file descriptor for the listening socket on `host` and `port`:
+    the one kept by the socket holder at `holder_path`, or, if there is no
+    holder, e.g. because supervisord isn't running, a socket of our own. """
+    if holder_path is not None:
+        try:
+            return fetch(holder_path, host, port, backlog)
+        except (socket.error, OSError), e:
+            print >> sys.stderr, ("Can't get the socket for port %d from "
+                                  "%s (%s), listening myself."
+                                  % (port, holder_path, e))
+    sock = listen(host, port, backlog)
+    fd = os.dup(sock.fileno())
+    sock.close()
+    return fd
+
+
+def pass_sockets(fds, environ):
+    """ Move the socket file descriptors `fds` to 3, 4, ... and set
+    ``LISTEN_FDS`` and ``LISTEN_PID`` in `environ`, the way systemd passes
+    sockets to the processes it starts. ``LISTEN_PID`` is our own pid,
+    which the program we exec next keeps. """
+    count = len(fds)
+    moved = [fcntl.fcntl(fd, fcntl.F_DUPFD, LISTEN_FDS_START + count)
+             for fd in fds]
+    for fd in fds:
+        os.close(fd)
+    for n, fd in enumerate(moved):
+        os.dup2(fd, LISTEN_FDS_START + n)
+        os.close(fd)
+    environ['LISTEN_FDS'] = str(count)
+    environ['LISTEN_PID'] = str(os.getpid())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m airship.listen',
+        description="Get sockets for PORTS and exec COMMAND with them.")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--backlog', type=int, default=BACKLOG)
+    parser.add_argument('--holder',
+                        help="unix socket of the socket holder "
+                             "(python -m airship.sockets)")
+    parser.add_argument('ports', help="comma-separated port numbers")
+    parser.add_argument('command', nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.error("no command given")
+    fds = [open_socket(args.holder, args.host, int(port), args.backlog)
+           for port in args.ports.split(',')]
+    environ = dict(os.environ)
+    pass_sockets(fds, environ)
+    os.execve(args.command[0], args.command, environ)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
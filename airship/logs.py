@@ -0,0 +1,322 @@
+import os
+import re
+import sys
+import gzip
+import mmap
+import time
+import shutil
+import logging
+import argparse
+from contextlib import closing
+from datetime import datetime
+from .registry import parse_id
+
+log = logging.getLogger(__name__)
+
+KEEP = 10
+BLOCK_SIZE = 64 * 1024
+POLL_INTERVAL = 0.25
+STAMP_FORMAT = '%Y%m%dT%H%M%S'
+# supervisor rotates `web.log` to `web.log.1`, `web.log.2`, ...; they are
+# renamed to `web.log-<mtime>` while being compressed to `web.log-<mtime>.gz`
+ROTATED = re.compile(r'^(?P<base>.+\.log)\.\d+$')
+PENDING = re.compile(r'^(?P<base>.+\.log)-\d{8}T\d{6}(-\d+)?$')
+COMPRESSED = re.compile(r'^(?P<base>.+\.log)-\d{8}T\d{6}(-\d+)?\.gz$')
+DURATION = re.compile(r'^(\d+)([smhd])$')
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def _bucket_folders(log_folder):
+    for name in sorted(os.listdir(log_folder)):
+        folder = os.path.join(log_folder, name)
+        try:
+            parse_id(name)
+        except KeyError:
+            continue
+        if os.path.isdir(folder):
+            yield folder
+
+
+def _pending_name(folder, base, mtime):
+    stamp = datetime.fromtimestamp(mtime).strftime(STAMP_FORMAT)
+    name = '%s-%s' % (base, stamp)
+    n = 1
+    while (os.path.exists(os.path.join(folder, name)) or
+           os.path.exists(os.path.join(folder, name + '.gz'))):
+        name = '%s-%s-%d' % (base, stamp, n)
+        n += 1
+    return name
+
+
+def _gzip(source):
+    with open(source, 'rb') as f_in:
+        with closing(gzip.open(source + '.gz.tmp', 'wb')) as f_out:
+            shutil.copyfileobj(f_in, f_out, BLOCK_SIZE)
+    shutil.copystat(source, source + '.gz.tmp')
+    os.rename(source + '.gz.tmp', source + '.gz')
+    os.unlink(source)
+
+
+def compress_folder(folder, keep=KEEP):
+    """ Compress the segments of the logs in `folder` that supervisor has
+    rotated, and delete all but the `keep` newest compressed segments of
+    each log. A segment is first renamed, atomically, so supervisor can't
+    rotate another file into its place meanwhile. Returns the number of
+    segments compressed. """
+    count = 0
+    for name in sorted(os.listdir(folder)):
+        match = ROTATED.match(name) or PENDING.match(name)
+        if match is None:
+            continue
+        path = os.path.join(folder, name)
+        if ROTATED.match(name):
+            try:
+                mtime = os.stat(path).st_mtime
+                pending = os.path.join(folder, _pending_name(
+                    folder, match.group('base'), mtime))
+                os.rename(path, pending)
+            except OSError:
+                continue  # rotated again by supervisor
+            path = pending
+        _gzip(path)
+        count += 1
+
+    segments = {}
+    for name in os.listdir(folder):
+        match = COMPRESSED.match(name)
+        if match is not None:
+            segments.setdefault(match.group('base'), []).append(
+                (os.stat(os.path.join(folder, name)).st_mtime, name))
+    for base, names in segments.items():
+        for mtime, name in sorted(names)[:-keep or None]:
+            os.unlink(os.path.join(folder, name))
+    return count
+
+
+def compress(log_folder, keep=KEEP):
+    count = 0
+    for folder in _bucket_folders(log_folder):
+        count += compress_folder(folder, keep)
+    return count
+
+
+def log_files(folder, procname=None):
+    """ Current log files in a bucket's log `folder`: all of them, or those
+    of `procname`, which may be a process type (``web``, for all its
+    instances) or an instance (``web-2``). """
+    if not os.path.isdir(folder):
+        return []
+    names = [n for n in sorted(os.listdir(folder)) if n.endswith('.log')]
+    if procname is not None:
+        pattern = re.compile(r'^%s(-\d+)?\.log$' % re.escape(procname))
+        names = [n for n in names if pattern.match(n)]
+    return [os.path.join(folder, n) for n in names]
+
+
+def segments(log_path, since):
+    """ The segments of `log_path`, oldest first, that were still being
+    written at `since` (a timestamp): rotated ones, compressed or not, and
+    the current file. """
+    folder, base = os.path.split(log_path)
+    found = []
+    for name in os.listdir(folder):
+        for pattern in (ROTATED, PENDING, COMPRESSED):
+            match = pattern.match(name)
+            if match is not None and match.group('base') == base:
+                path = os.path.join(folder, name)
+                mtime = os.stat(path).st_mtime
+                if mtime >= since:
+                    found.append((mtime, path))
+                break
+    return [p for m, p in sorted(found)] + [log_path]
+
+
+def parse_since(value, now=None):
+    """ A timestamp from a duration ago, like ``30s``, ``10m``, ``2h`` or
+    ``1d``, or a local time like ``2014-05-01T12:00``. """
+    match = DURATION.match(value)
+    if match is not None:
+        seconds = int(match.group(1)) * UNITS[match.group(2)]
+        return (time.time() if now is None else now) - seconds
+    for template in ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d']:
+        try:
+            return time.mktime(datetime.strptime(value, template).timetuple())
+        except ValueError:
+            pass
+    raise ValueError("Can't parse time %r" % value)
+
+
+def tail(path, count):
+    """ The last `count` lines of the file at `path`, read backwards from
+    the end one block at a time. """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = ''
+        while position > 0 and data.count('\n') <= count:
+            size = min(BLOCK_SIZE, position)
+            position -= size
+            f.seek(position)
+            data = f.read(size) + data
+    lines = data.splitlines(True)
+    return lines[-count:] if count else []
+
+
+def _open(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def read_lines(path):
+    with closing(_open(path)) as f:
+        for line in f:
+            yield line
+
+
+def grep(path, regex):
+    """ Lines of the file at `path` matching `regex`. Plain files are
+    memory-mapped and searched as a whole, so only the pages around matches
+    are turned into lines; compressed segments are read line by line. For
+    ``^`` and ``$`` to match at line boundaries, compile `regex` with
+    `re.MULTILINE`. """
+    if path.endswith('.gz'):
+        for line in read_lines(path):
+            if regex.search(line):
+                yield line
+        return
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            position = 0
+            while position < len(data):
+                match = regex.search(data, position)
+                if match is None:
+                    break
+                start = data.rfind('\n', 0, match.start()) + 1
+                end = data.find('\n', match.end())
+                end = len(data) if end == -1 else end + 1
+                yield data[start:end]
+                position = end
+        finally:
+            data.close()
+
+
+class Follower(object):
+    """ Read what's appended to a log file, reopening it when supervisor
+    rotates it. """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.buffer = ''
+        self._open(at_end=True)
+
+    def _open(self, at_end=False):
+        try:
+            self.file = open(self.path, 'rb')
+        except IOError:
+            self.file = None
+            return
+        if at_end:
+            self.file.seek(0, os.SEEK_END)
+
+    def _rotated(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        current = os.fstat(self.file.fileno())
+        return (st.st_ino != current.st_ino or
+                st.st_size < self.file.tell())
+
+    def read_lines(self):
+        if self.file is None:
+            self._open()
+            if self.file is None:
+                return []
+        data = self.file.read()
+        if self._rotated():
+            # finish the old file, then start the new one from the top
+            data += self.file.read()
+            self.file.close()
+            self._open()
+            if self.file is not None:
+                data += self.file.read()
+        lines = (self.buffer + data).split('\n')
+        self.buffer = lines.pop()
+        return [l + '\n' for l in lines]
+
+
+def _label(path):
+    return os.path.basename(path).split('.log', 1)[0]
+
+
+def show(paths, lines=10, since=None, regex=None, follow=False,
+         out=sys.stdout):
+    """ Print the end of the logs at `paths` or, with `since`, all their
+    segments written since then; only lines matching `regex` if given.
+    Lines are prefixed with the log name when there are several. Then, if
+    `follow` is set, print lines as they are appended, until interrupted. """
+    prefix = len(paths) > 1
+
+    def write(path, line):
+        if prefix:
+            out.write('%s | ' % _label(path))
+        out.write(line if line.endswith('\n') else line + '\n')
+
+    for path in paths:
+        if since is not None:
+            sources = segments(path, since)
+        else:
+            sources = [path]
+        for source in sources:
+            if regex is not None:
+                found = grep(source, regex)
+            elif since is not None:
+                found = read_lines(source)
+            else:
+                found = tail(source, lines)
+            for line in found:
+                write(path, line)
+    out.flush()
+
+    if not follow:
+        return
+    followers = [Follower(path) for path in paths]
+    while True:
+        for follower in followers:
+            for line in follower.read_lines():
+                if regex is None or regex.search(line):
+                    write(follower.path, line)
+        out.flush()
+        time.sleep(POLL_INTERVAL)
+
+
+def listen(log_folder, keep, stdin=sys.stdin, stdout=sys.stdout):
+    """ Supervisor event listener loop; compresses rotated segments on every
+    tick. """
+    from supervisor import childutils
+    while True:
+        headers, payload = childutils.listener.wait(stdin, stdout)
+        try:
+            count = compress(log_folder, keep)
+            if count:
+                log.info("Compressed %d log segments", count)
+        except Exception:
+            log.exception("Failed to compress logs")
+        childutils.listener.ok(stdout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m airship.logs')
+    parser.add_argument('log_folder')
+    parser.add_argument('--keep', type=int, default=KEEP)
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    listen(args.log_folder, args.keep)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
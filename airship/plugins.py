@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+from importlib import import_module
+from .signals import _signals, define_arguments
+
+log = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = 'airship_plugins'
+CACHE_VERSION = 1
+
+
+def path_fingerprint(paths=None):
+    """ Hash the modification times of the `sys.path` entries. Installing or
+    removing a distribution changes the mtime of its parent folder. The
+    current directory (an empty entry) is skipped. """
+    digest = hashlib.sha1('%d\n' % CACHE_VERSION)
+    for entry in (sys.path if paths is None else paths):
+        if not entry:
+            continue
+        try:
+            mtime = os.stat(entry).st_mtime
+        except OSError:
+            mtime = None
+        digest.update('%s %r\n' % (entry, mtime))
+    return digest.hexdigest()
+
+
+class _CommandRecorder(object):
+    """ Stand-in for `create_command` that remembers command names. """
+
+    def __init__(self):
+        import argparse
+        self.names = []
+        self.subparsers = argparse.ArgumentParser().add_subparsers()
+
+    def __call__(self, name, handler):
+        self.names.append(name)
+        return self.subparsers.add_parser(name)
+
+
+class PluginRegistry(object):
+    """ Keeps track of the `airship_plugins` entry points, and which signals
+    and subcommands each of them provides, in a JSON cache file. Plugins are
+    imported only when one of their signals is sent or one of their
+    subcommands is invoked. The cache is rebuilt, by loading every plugin,
+    when the `sys.path` fingerprint changes. """
+
+    def __init__(self):
+        self.airship = None
+        self.plugins = {}
+        self.loaded = set()
+        self.timings = []
+
+    def _timed(self, label, func, *args):
+        t0 = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.timings.append((label, time.time() - t0))
+
+    def setup(self, airship, cache_path):
+        self.airship = airship
+        self.loaded = set()
+        self.timings = []
+        self._timed('plugin registry', self._read_or_scan, cache_path)
+
+    def _read_or_scan(self, cache_path):
+        fingerprint = path_fingerprint()
+        if cache_path.isfile():
+            with cache_path.open('rb') as f:
+                cache = json.load(f)
+            if cache.get('fingerprint') == fingerprint:
+                self.plugins = cache['plugins']
+                return
+        log.debug("Scanning for plugins")
+        self.plugins = self.scan()
+        cache_path.parent.makedirs_p()
+        tmp_path = cache_path + '.tmp'
+        with tmp_path.open('wb') as f:
+            json.dump({'fingerprint': fingerprint, 'plugins': self.plugins}, f)
+        tmp_path.rename(cache_path)
+
+    def scan(self):
+        import pkg_resources
+        plugins = {}
+        for ep in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+            target = '%s:%s' % (ep.module_name, '.'.join(ep.attrs))
+            plugins[ep.name] = {'entry_point': target}
+            plugins[ep.name].update(self._record(ep.name, target))
+        return plugins
+
+    def _record(self, name, target):
+        """ Load a plugin and find out what it subscribes to. """
+        def receivers():
+            return dict((signal_name,
+                         set(signal.receivers_for(self.airship)))
+                        for signal_name, signal in _signals.items())
+        before = receivers()
+        before_commands = set(define_arguments.receivers_for(None))
+        self._load(name, target)
+        after = receivers()
+        signals = sorted(signal_name for signal_name in after
+                         if after[signal_name] -
+                         before.get(signal_name, set()))
+        recorder = _CommandRecorder()
+        for receiver in list(define_arguments.receivers_for(None)):
+            if receiver not in before_commands:
+                receiver(None, create_command=recorder)
+        return {'signals': signals, 'commands': recorder.names}
+
+    def _load(self, name, target):
+        if name in self.loaded:
+            return
+        self.loaded.add(name)
+        module_name, attr = target.split(':')
+
+        def load():
+            callback = import_module(module_name)
+            for part in attr.split('.'):
+                callback = getattr(callback, part)
+            if self.airship is not None:
+                callback(self.airship)
+
+        self._timed('plugin %s' % name, load)
+
+    def load(self, name):
+        self._load(name, self.plugins[name]['entry_point'])
+
+    def load_all(self):
+        for name in sorted(self.plugins):
+            self.load(name)
+
+    def load_for_signal(self, signal_name):
+        for name, info in self.plugins.items():
+            if signal_name in info['signals']:
+                self.load(name)
+
+    def load_for_command(self, command):
+        """ Load the plugins that define `command`. Without a command, e.g.
+        for ``--help``, all plugins are loaded so every command is listed. """
+        if command is None:
+            return self.load_all()
+        for name, info in self.plugins.items():
+            if command in info['commands']:
+                self.load(name)
+
+
+registry = PluginRegistry()
@@ -0,0 +1,149 @@
+import os
+import time
+from collections import namedtuple
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+Sample = namedtuple('Sample', ['pid', 'time', 'rss', 'cpu', 'started'])
+
+
+def read_boot_time():
+    try:
+        with open('/proc/stat', 'rb') as f:
+            for line in f:
+                if line.startswith('btime '):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return 0
+
+
+BOOT_TIME = read_boot_time()
+
+
+# /proc/<pid>/task/<tid>/children needs CONFIG_PROC_CHILDREN
+HAS_CHILDREN_FILE = os.path.exists('/proc/self/task/%d/children'
+                                   % os.getpid())
+
+
+def _stat_fields(pid):
+    """ The fields of ``/proc/<pid>/stat`` after the command name, or `None`
+    if there is no such process. """
+    try:
+        with open('/proc/%d/stat' % pid, 'rb') as f:
+            data = f.read()
+    except IOError:
+        return None
+    # the command name, in parentheses, may contain spaces
+    return data.rsplit(')', 1)[1].split()
+
+
+def _children(pid):
+    rv = []
+    try:
+        tasks = os.listdir('/proc/%d/task' % pid)
+    except OSError:
+        return rv
+    for tid in tasks:
+        try:
+            with open('/proc/%d/task/%s/children' % (pid, tid), 'rb') as f:
+                rv.extend(int(child) for child in f.read().split())
+        except IOError:
+            pass  # the thread is gone
+    return rv
+
+
+def _children_by_parent():
+    """ Scan ``/proc`` for the children of every process, for kernels
+    without ``children`` files. """
+    rv = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            fields = _stat_fields(int(name))
+            if fields is not None:
+                rv.setdefault(int(fields[1]), []).append(int(name))
+    return rv
+
+
+def descendants(pid):
+    """ Pids of the children of `pid`, their children and so on. """
+    if HAS_CHILDREN_FILE:
+        children = _children
+    else:
+        children = _children_by_parent().get
+    rv = []
+    pending = [pid]
+    while pending:
+        found = children(pending.pop()) or []
+        rv.extend(found)
+        pending.extend(found)
+    return rv
+
+
+def proportional_memory(pid):
+    """ Proportional set size of process `pid` in bytes: its resident
+    memory, with pages shared by several processes divided among them,
+    from ``/proc/<pid>/smaps_rollup`` or, on older kernels, ``smaps``.
+    Returns `None` if neither can be read. """
+    for name in ['smaps_rollup', 'smaps']:
+        try:
+            with open('/proc/%d/%s' % (pid, name), 'rb') as f:
+                return 1024 * sum(int(line.split()[1]) for line in f
+                                  if line.startswith('Pss:'))
+        except IOError:
+            pass
+    return None
+
+
+def sample(pid, now=None):
+    """ Memory (bytes), CPU time used so far (seconds) and start time of
+    process `pid`, read from ``/proc/<pid>/stat``. Memory and CPU time are
+    summed over the process and its descendants, so a launcher shell that
+    runs the actual program as its child, e.g. for ``cd app && ./serve``,
+    or a master with worker processes, are measured as a whole; the CPU
+    time of children that have exited and been waited for is included.
+    Memory is the proportional set size, so pages that forked workers share
+    with their master are counted once; if that can't be read, it's the
+    resident memory. Returns `None` if there is no such process. """
+    fields = _stat_fields(pid)
+    if fields is None:
+        return None
+    started = BOOT_TIME + float(fields[19]) / CLOCK_TICKS
+    memory = ticks = 0
+    tree = [(pid, fields)] + [(child, _stat_fields(child))
+                              for child in descendants(pid)]
+    for tree_pid, tree_fields in tree:
+        if tree_fields is None:
+            continue  # exited meanwhile
+        # utime, stime, cutime and cstime
+        ticks += sum(int(f) for f in tree_fields[11:15])
+        pss = proportional_memory(tree_pid)
+        if pss is None:
+            pss = int(tree_fields[21]) * PAGE_SIZE
+        memory += pss
+    return Sample(pid=pid,
+                  time=time.time() if now is None else now,
+                  rss=memory,
+                  cpu=float(ticks) / CLOCK_TICKS,
+                  started=started)
+
+
+def cpu_percent(previous, current):
+    """ CPU use of a process between two samples, in percent of one core,
+    or `None` if they aren't of the same process. """
+    if (previous is None or current is None or
+            previous.pid != current.pid or
+            previous.started != current.started or
+            current.time <= previous.time):
+        return None
+    return 100 * (current.cpu - previous.cpu) / (current.time - previous.time)
+
+
+def open_fds(pid):
+    """ Number of file descriptors open by process `pid`, or `None` if we
+    may not look. """
+    try:
+        return len(os.listdir('/proc/%d/fd' % pid))
+    except OSError:
+        return None
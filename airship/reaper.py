@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import fcntl
+import errno
+import logging
+import subprocess
+
+log = logging.getLogger(__name__)
+
+LOCK_NAME = '.lock'
+BATCH_SIZE = 500
+PAUSE = 0.05
+IONICE_PATHS = ['/usr/bin/ionice', '/bin/ionice']
+
+
+def _lower_priority():
+    os.setsid()
+    os.nice(19)
+
+
+def spawn(trash_path):
+    """ Start a detached process that deletes the contents of `trash_path`,
+    with the lowest CPU and I/O priority, pausing regularly, so that it
+    doesn't compete with the applications for the disk. """
+    args = [sys.executable, '-m', 'airship.reaper', trash_path]
+    for ionice in IONICE_PATHS:
+        if os.path.isfile(ionice):
+            args = [ionice, '-c', '3'] + args
+            break
+    with open(os.devnull, 'r+b') as devnull:
+        subprocess.Popen(args, stdin=devnull, stdout=devnull, stderr=devnull,
+                         close_fds=True, preexec_fn=_lower_priority)
+
+
+def _pending(trash_path):
+    return sorted(name for name in os.listdir(trash_path)
+                  if name != LOCK_NAME)
+
+
+def _delete_tree(folder, batch_size, pause):
+    count = 0
+    for parent, dirs, files in os.walk(folder, topdown=False):
+        for name in files:
+            os.unlink(os.path.join(parent, name))
+            count += 1
+            if count % batch_size == 0:
+                time.sleep(pause)
+        for name in dirs:
+            child = os.path.join(parent, name)
+            if os.path.islink(child):
+                os.unlink(child)
+            else:
+                os.rmdir(child)
+    os.rmdir(folder)
+
+
+def _remove(entry, batch_size, pause):
+    try:
+        if os.path.isdir(entry) and not os.path.islink(entry):
+            _delete_tree(entry, batch_size, pause)
+        else:
+            os.unlink(entry)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def reap(trash_path, batch_size=BATCH_SIZE, pause=PAUSE):
+    """ Delete everything in `trash_path`. Returns immediately if another
+    reaper holds the lock; that one will take care of the new entries. """
+    lock_file = open(os.path.join(trash_path, LOCK_NAME), 'a')
+    try:
+        while _pending(trash_path):
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError, e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return
+                raise
+            try:
+                for name in _pending(trash_path):
+                    log.debug("Deleting %r", name)
+                    _remove(os.path.join(trash_path, name), batch_size, pause)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        lock_file.close()
+
+
+if __name__ == '__main__':
+    reap(sys.argv[1])
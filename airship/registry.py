@@ -0,0 +1,157 @@
+import re
+import json
+import sqlite3
+from datetime import datetime
+
+STAGED = 'staged'
+RUNNING = 'running'
+STOPPED = 'stopped'
+
+COLUMNS = ['state', 'created', 'activated', 'archive_hash', 'disk_size']
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS bucket_record ("
+    " id INTEGER PRIMARY KEY,"
+    " state TEXT NOT NULL,"
+    " created TEXT NOT NULL,"
+    " activated TEXT,"
+    " archive_hash TEXT,"
+    " disk_size INTEGER,"
+    " config TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS bucket_record_state"
+    " ON bucket_record (state)",
+    "CREATE TABLE IF NOT EXISTS bucket_pointer"
+    " (name TEXT PRIMARY KEY, bucket INTEGER)",
+]
+
+
+def now():
+    return datetime.utcnow().isoformat()
+
+
+def parse_id(bucket_id):
+    """ Convert a bucket id like ``d12`` to its number. Raises `KeyError` for
+    anything that doesn't look like a bucket id. """
+    match = re.match(r'^d(\d+)$', str(bucket_id))
+    if match is None:
+        raise KeyError(bucket_id)
+    return int(match.group(1))
+
+
+def format_id(number):
+    return 'd%d' % number
+
+
+class BucketRegistry(object):
+    """ Records of all buckets, stored in sqlite, with the bucket's state
+    (staged, running or stopped), timestamps, archive hash, disk size and
+    configuration. An explicit pointer marks the active bucket, i.e. the
+    one that was most recently started and passed activation. """
+
+    def __init__(self, db_path, timeout=5):
+        self._db = sqlite3.connect(db_path, timeout=timeout)
+        self._db.isolation_level = None
+        for statement in SCHEMA:
+            self._execute(statement)
+        self._migrate_kv_table()
+
+    def _execute(self, *args):
+        return self._db.cursor().execute(*args)
+
+    def _migrate_kv_table(self):
+        """ Import buckets from the key-value table used by earlier versions
+        of airship. """
+        [[has_kv_table]] = self._execute(
+            "SELECT COUNT(*) FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'bucket'")
+        if not has_kv_table:
+            return
+        self._execute('BEGIN IMMEDIATE TRANSACTION')
+        try:
+            for key, value in list(self._execute(
+                    'SELECT key, value FROM bucket')):
+                self._execute(
+                    'INSERT OR IGNORE INTO bucket_record '
+                    '(id, state, created, config) VALUES (?, ?, ?, ?)',
+                    (parse_id(key), RUNNING, now(), value or '{}'))
+            self._execute('DROP TABLE bucket')
+        except:
+            self._execute('ROLLBACK')
+            raise
+        self._execute('COMMIT')
+
+    def _record(self, row):
+        record = dict(zip(['id'] + COLUMNS + ['config'], row))
+        record['id'] = format_id(record['id'])
+        record['config'] = json.loads(record['config'])
+        return record
+
+    def _select(self, where='', args=()):
+        return self._execute('SELECT id, %s, config FROM bucket_record %s'
+                             % (', '.join(COLUMNS), where), args)
+
+    def add(self, bucket_id, config=None):
+        self._execute('INSERT INTO bucket_record '
+                      '(id, state, created, config) VALUES (?, ?, ?, ?)',
+                      (parse_id(bucket_id), STAGED, now(),
+                       json.dumps(config or {})))
+
+    def get(self, bucket_id):
+        for row in self._select('WHERE id = ?', (parse_id(bucket_id),)):
+            return self._record(row)
+        raise KeyError(bucket_id)
+
+    def __contains__(self, bucket_id):
+        try:
+            self.get(bucket_id)
+        except KeyError:
+            return False
+        return True
+
+    def update(self, bucket_id, **values):
+        """ Set record columns; other values are merged into the bucket's
+        configuration. """
+        number = parse_id(bucket_id)
+        columns = dict((k, v) for k, v in values.items() if k in COLUMNS)
+        extra = dict((k, v) for k, v in values.items() if k not in COLUMNS)
+        if extra:
+            config = self.get(bucket_id)['config']
+            config.update(extra)
+            columns['config'] = json.dumps(config)
+        if columns:
+            assignments = ', '.join('%s = ?' % k for k in columns)
+            self._execute('UPDATE bucket_record SET %s WHERE id = ?'
+                          % assignments, columns.values() + [number])
+
+    def remove(self, bucket_id):
+        number = parse_id(bucket_id)
+        self._execute('DELETE FROM bucket_record WHERE id = ?', (number,))
+        self._execute('DELETE FROM bucket_pointer WHERE bucket = ?',
+                      (number,))
+
+    def records(self, state=None):
+        if state is None:
+            rows = self._select('ORDER BY id')
+        else:
+            rows = self._select('WHERE state = ? ORDER BY id', (state,))
+        return [self._record(row) for row in rows]
+
+    def newest(self):
+        [[number]] = self._execute('SELECT MAX(id) FROM bucket_record')
+        return None if number is None else format_id(number)
+
+    def get_active(self):
+        for [number] in self._execute('SELECT bucket FROM bucket_pointer '
+                                      'WHERE name = ?', ('active',)):
+            return format_id(number)
+        return None
+
+    def set_active(self, bucket_id):
+        """ Point at `bucket_id` as the active bucket, or at none if it's
+        `None`. """
+        if bucket_id is None:
+            self._execute('DELETE FROM bucket_pointer WHERE name = ?',
+                          ('active',))
+            return
+        self._execute('INSERT OR REPLACE INTO bucket_pointer (name, bucket) '
+                      'VALUES (?, ?)', ('active', parse_id(bucket_id)))
@@ -0,0 +1,36 @@
+import blinker
+
+_signals = {}
+
+
+class Signal(blinker.NamedSignal):
+    """ A signal that makes sure the plugins which subscribe to it are loaded
+    before it's sent, and times each receiver for the deployment stats. """
+
+    def send(self, *sender, **kwargs):
+        from .plugins import registry
+        from . import stats
+        registry.load_for_signal(self.name)
+        if len(sender) > 1:
+            raise TypeError('send() accepts only one positional argument, '
+                            '%s given' % len(sender))
+        sender = sender[0] if sender else None
+        results = []
+        for receiver in self.receivers_for(sender):
+            with stats.receiver(self.name, receiver):
+                results.append((receiver, receiver(sender, **kwargs)))
+        return results
+
+
+def signal(name):
+    if name not in _signals:
+        _signals[name] = Signal(name)
+    return _signals[name]
+
+
+bucket_setup = signal('bucket_setup')
+bucket_run = signal('bucket_run')
+
+# plugins that define subcommands are loaded before the argument parser is
+# built (see `PluginRegistry.load_for_command`), so this one is not lazy
+define_arguments = blinker.NamedSignal('define_arguments')
@@ -0,0 +1,165 @@
+import sys
+import time
+import errno
+import select
+import socket
+import logging
+import argparse
+import SocketServer
+import _multiprocessing
+from path import path
+
+log = logging.getLogger(__name__)
+
+SOCKET_NAME = 'sockets.sock'
+# not exported by python 2's socket module; this is the value on linux
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+DEFAULT_HOST = '0.0.0.0'
+BACKLOG = 128
+CONNECT_TIMEOUT = 5
+CONNECT_RETRY_INTERVAL = 0.1
+
+
+def listen(host, port, backlog=BACKLOG):
+    """ Open a listening TCP socket. It's opened with ``SO_REUSEPORT``, so
+    that a restarted holder can listen again while processes still have
+    the old socket. """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+class SocketHolder(object):
+    """ Listening sockets, opened on first request and kept open for as
+    long as the holder runs. Every process that asks for a port gets the
+    same socket, so the port stays open while processes restart, and
+    connections waiting in its queue when a process exits are accepted by
+    the others, e.g. those of the next bucket. """
+
+    def __init__(self):
+        self.sockets = {}
+
+    def get(self, host, port, backlog=BACKLOG):
+        key = (host, port)
+        if key not in self.sockets:
+            log.info("Listening on %s:%d", host, port)
+            self.sockets[key] = listen(host, port, backlog)
+        return self.sockets[key]
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """ Read a ``<host> <port> <backlog>`` line, reply ``ok`` and pass the
+    socket's file descriptor, or reply with an error. """
+
+    def handle(self):
+        try:
+            host, port, backlog = self.rfile.readline().split()
+            sock = self.server.holder.get(host, int(port), int(backlog))
+        except (ValueError, socket.error), e:
+            log.warning("Can't hand out socket: %s", e)
+            self.wfile.write('error %s\n' % e)
+            return
+        self.wfile.write('ok\n')
+        _multiprocessing.sendfd(self.connection.fileno(), sock.fileno())
+
+
+def make_server(socket_path):
+    socket_path = path(socket_path)
+    socket_path.parent.makedirs_p()
+    if socket_path.exists():
+        socket_path.unlink()
+    server = SocketServer.UnixStreamServer(socket_path, RequestHandler)
+    server.holder = SocketHolder()
+    return server
+
+
+def _connect(socket_path, timeout):
+    """ Connect to the holder, waiting for it to start, e.g. when supervisord
+    starts it together with the bucket processes. """
+    deadline = time.time() + timeout
+    while True:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(socket_path)
+            return client
+        except socket.error:
+            client.close()
+            if time.time() > deadline:
+                raise
+        time.sleep(CONNECT_RETRY_INTERVAL)
+
+
+def fetch(socket_path, host, port, backlog=BACKLOG,
+          timeout=CONNECT_TIMEOUT):
+    """ Get the listening socket for `host` and `port` from the holder at
+    `socket_path`, as a file descriptor. """
+    client = _connect(socket_path, timeout)
+    try:
+        client.sendall('%s %d %d\n' % (host, port, backlog))
+        reply = ''
+        while not reply.endswith('\n'):
+            data = client.recv(1)
+            if not data:
+                raise socket.error("The socket holder hung up.")
+            reply += data
+        if reply != 'ok\n':
+            raise socket.error(reply.strip())
+        return _multiprocessing.recvfd(client.fileno())
+    finally:
+        client.close()
+
+
+class ReadyNotifications(object):
+    """ Receive systemd-style ``READY=1`` notifications, which a process
+    sends to the datagram socket named in its ``NOTIFY_SOCKET`` once it's
+    ready to serve. A socket is bound at each of `paths`. """
+
+    def __init__(self, paths):
+        self.paths = {}
+        self.ready = set()
+        for socket_path in paths:
+            socket_path = path(socket_path)
+            socket_path.parent.makedirs_p()
+            socket_path.unlink_p()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(socket_path)
+            self.paths[sock] = socket_path
+
+    def receive(self, timeout):
+        """ Wait up to `timeout` seconds for notifications. Returns `True`
+        once every socket was notified. """
+        pending = [s for s in self.paths if self.paths[s] not in self.ready]
+        if pending:
+            try:
+                readable = select.select(pending, [], [], timeout)[0]
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                readable = []
+            for sock in readable:
+                if 'READY=1' in sock.recv(4096).splitlines():
+                    self.ready.add(self.paths[sock])
+        return len(self.ready) == len(self.paths)
+
+    def close(self):
+        for sock, socket_path in self.paths.items():
+            sock.close()
+            socket_path.unlink_p()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m airship.sockets')
+    parser.add_argument('socket_path')
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    server = make_server(args.socket_path)
+    log.info("Holding sockets for %s", args.socket_path)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import math
+import time
+import json
+import logging
+from collections import deque
+from contextlib import contextmanager
+from .registry import now
+
+log = logging.getLogger(__name__)
+
+STATS_FILE_NAME = 'deploy-stats.log'
+PERCENTILES = [50, 90, 99]
+
+_timers = []
+
+
+class DeployTimer(object):
+    """ Time the phases of a deployment, and each signal receiver called
+    during it. On exit, the timings are appended as a JSON line to
+    `stats_path`, whether the deployment succeeded or not. """
+
+    def __init__(self, stats_path, kind='deploy'):
+        self.stats_path = stats_path
+        self.kind = kind
+        self.bucket_id = None
+        self.phases = {}
+        self.receivers = {}
+
+    def __enter__(self):
+        self.started = now()
+        self._t0 = time.time()
+        _timers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _timers.remove(self)
+        self.write({
+            'kind': self.kind,
+            'bucket': self.bucket_id,
+            'started': self.started,
+            'ok': exc_type is None,
+            'total': time.time() - self._t0,
+            'phases': self.phases,
+            'receivers': self.receivers,
+        })
+
+    def add(self, timings, name, seconds):
+        timings[name] = timings.get(name, 0) + seconds
+
+    def write(self, record):
+        try:
+            self.stats_path.parent.makedirs_p()
+            with self.stats_path.open('ab') as f:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+        except (IOError, OSError), e:
+            log.warning("Could not write deployment stats: %s", e)
+
+
+def _current():
+    return _timers[-1] if _timers else None
+
+
+@contextmanager
+def phase(name):
+    """ Time a phase of the current deployment, if there is one. """
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        timer = _current()
+        if timer is not None:
+            timer.add(timer.phases, name, time.time() - t0)
+
+
+def receiver_name(receiver):
+    return '%s.%s' % (getattr(receiver, '__module__', '?'),
+                      getattr(receiver, '__name__', repr(receiver)))
+
+
+@contextmanager
+def receiver(signal_name, func):
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        timer = _current()
+        if timer is not None:
+            name = '%s %s' % (signal_name, receiver_name(func))
+            timer.add(timer.receivers, name, time.time() - t0)
+
+
+def read_records(stats_path, last=None):
+    """ The `last` records from `stats_path`, oldest first. Lines that can't
+    be parsed, e.g. one cut short by a crash, are skipped. """
+    if not stats_path.isfile():
+        return []
+    records = []
+    with stats_path.open('rb') as f:
+        for line in deque(f, maxlen=last):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile of a non-empty list. """
+    values = sorted(values)
+    index = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(index, 0)]
+
+
+def summarize(records):
+    """ Aggregate the timings of `records` per phase and per receiver.
+    Returns a list of dicts with the `name`, `count`, `sum`, percentiles and
+    `max`: the phases first, then the totals, then the receivers. The total
+    of a `stage` or `activate` command is reported apart from full
+    deployments. """
+    samples = {}
+
+    def collect(name, seconds):
+        samples.setdefault(name, []).append(seconds)
+
+    for record in records:
+        for name, seconds in sorted(record.get('phases', {}).items()):
+            collect(name, seconds)
+        kind = record.get('kind', 'deploy')
+        collect('total' if kind == 'deploy' else 'total %s' % kind,
+                record['total'])
+        for name, seconds in sorted(record.get('receivers', {}).items()):
+            collect('receiver ' + name, seconds)
+
+    rows = []
+    for name in sorted(samples, key=lambda n: (n.startswith('receiver '),
+                                               n.startswith('total'), n)):
+        values = samples[name]
+        row = {'name': name, 'count': len(values), 'sum': sum(values),
+               'max': max(values)}
+        for p in PERCENTILES:
+            row['p%d' % p] = percentile(values, p)
+        rows.append(row)
+    return rows
+
+
+def format_summary(rows):
+    columns = ['p%d' % p for p in PERCENTILES] + ['max']
+    width = max([len(r['name']) for r in rows] + [5])
+    lines = [('%-*s %6s' % (width, 'phase', 'count')) +
+             ''.join(' %9s' % c for c in columns)]
+    for row in rows:
+        lines.append(('%-*s %6d' % (width, row['name'], row['count'])) +
+                     ''.join(' %8.2fs' % row[c] for c in columns))
+    return '\n'.join(lines)
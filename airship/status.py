@@ -0,0 +1,123 @@
+import time
+from .registry import parse_id
+from .crashloop import CrashLoop, BUCKET_GROUP, STATE_NAME
+from . import procstats
+
+MEGABYTE = 1024 * 1024
+
+
+def _instance(info):
+    """ The instance number of a process; processes of a group with several
+    instances are called ``<group>-<n>``. """
+    if info['name'] == info['group']:
+        return 0
+    return int(info['name'].rsplit('-', 1)[1])
+
+
+def _bucket_ports(airship, bucket_ids):
+    ports = {}
+    for bucket_id in bucket_ids:
+        try:
+            bucket = airship.get_bucket(bucket_id)
+        except KeyError:
+            continue
+        ports[bucket_id] = bucket.instance_ports
+    return ports
+
+
+def collect(airship, interval=0):
+    """ Join the supervisor information about every bucket process, fetched
+    in one call, with its bucket's metadata, its port, the exits recorded by
+    the crash loop listener and its stats from ``/proc``. CPU use is
+    averaged since the process started or, if `interval` is given, measured
+    over that many seconds. """
+    infos = [info for info in airship.daemons.all_process_info() or []
+             if BUCKET_GROUP.match(info['group'])]
+    records = dict((b['id'], b) for b in airship.list_buckets()['buckets'])
+    bucket_ids = set(info['group'].split('-', 1)[0] for info in infos)
+    ports = _bucket_ports(airship, bucket_ids & set(records))
+    crashes = CrashLoop(airship.var_path / 'run' / STATE_NAME).load()
+
+    samples = dict((info['pid'], procstats.sample(info['pid']))
+                   for info in infos if info['pid'])
+    if interval and samples:
+        time.sleep(interval)
+        previous, samples = samples, dict((pid, procstats.sample(pid))
+                                          for pid in samples)
+
+    now = time.time()
+    rows = []
+    for info in infos:
+        bucket_id, procname = info['group'].split('-', 1)
+        record = records.get(bucket_id, {})
+        name = '%s:%s' % (info['group'], info['name'])
+        row = {
+            'name': name,
+            'bucket': bucket_id,
+            'procname': procname,
+            'instance': _instance(info),
+            'bucket_state': record.get('state'),
+            'active': record.get('active', False),
+            'state': info['statename'],
+            'pid': info['pid'] or None,
+            'uptime': None,
+            'port': None,
+            'rss': None,
+            'cpu': None,
+            'cpu_time': None,
+            'fds': None,
+            'restarts': crashes.get(name, {}).get('exits', 0),
+        }
+        if bucket_id in ports:
+            instance_ports = ports[bucket_id](procname)
+            if row['instance'] < len(instance_ports):
+                row['port'] = instance_ports[row['instance']]
+        sample = samples.get(info['pid'])
+        if sample is not None:
+            row['uptime'] = int(now - sample.started)
+            row['rss'] = sample.rss
+            row['cpu_time'] = sample.cpu
+            row['fds'] = procstats.open_fds(info['pid'])
+            if interval:
+                row['cpu'] = procstats.cpu_percent(previous[info['pid']],
+                                                   sample)
+            elif now > sample.started:
+                row['cpu'] = 100 * sample.cpu / (now - sample.started)
+        rows.append(row)
+    rows.sort(key=lambda r: (parse_id(r['bucket']), r['procname'],
+                             r['instance']))
+    return rows
+
+
+def _uptime(seconds):
+    if seconds is None:
+        return '-'
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return '%dd%02dh' % (days, hours)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+def _value(value, template='%s'):
+    return '-' if value is None else template % value
+
+
+def format_table(rows):
+    header = ('process', 'state', 'pid', 'uptime', 'rss', 'cpu',
+              'fds', 'restarts', 'port')
+    lines = [[row['name'] + (' *' if row['active'] else ''),
+              row['state'],
+              _value(row['pid']),
+              _uptime(row['uptime']),
+              _value(None if row['rss'] is None else row['rss'] / MEGABYTE,
+                     '%dM'),
+              _value(row['cpu'], '%.1f%%'),
+              _value(row['fds']),
+              str(row['restarts']),
+              _value(row['port'])] for row in rows]
+    width = max([len(l[0]) for l in lines] + [len(header[0])])
+    template = '%-*s %-8s %7s %9s %7s %7s %5s %8s %6s'
+    return '\n'.join(template % ((width,) + tuple(l))
+                     for l in [header] + lines)
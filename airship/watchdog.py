@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+from path import path
+from .daemons import RPC_ERRORS
+from .crashloop import BUCKET_GROUP
+from . import procstats
+
+log = logging.getLogger(__name__)
+
+INTERVAL = 30
+CPU_PERIOD = 300
+JITTER = 0.1
+MEGABYTE = 1024 * 1024
+
+
+def _spread(name, started):
+    """ A number in [0, 1) that's fixed for one run of a process and differs
+    between instances. """
+    return random.Random('%s %s' % (name, started)).random()
+
+
+class Watchdog(object):
+    """ Decide which bucket processes to recycle, given `limits` for each
+    process type: ``max_rss`` (megabytes), ``max_cpu`` (percent of a core)
+    sustained for ``cpu_period`` seconds, and ``max_age`` (seconds), which is
+    shortened by up to ``jitter`` (a fraction) for each instance, so
+    instances started together are not recycled together. """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.samples = {}
+        self.cpu_over_since = {}
+
+    def _reason(self, name, info, limits, now, sample):
+        max_rss = limits.get('max_rss')
+        if max_rss is not None and sample.rss > max_rss * MEGABYTE:
+            return "rss %dMB over %dMB" % (sample.rss / MEGABYTE, max_rss)
+
+        max_age = limits.get('max_age')
+        if max_age is not None:
+            jitter = limits.get('jitter', JITTER)
+            limit = max_age * (1 - jitter * _spread(name, info['start']))
+            if now - info['start'] > limit:
+                return "running for over %ds" % limit
+
+        max_cpu = limits.get('max_cpu')
+        if max_cpu is not None:
+            cpu = procstats.cpu_percent(self.samples.get(name), sample)
+            if cpu is None or cpu <= max_cpu:
+                self.cpu_over_since.pop(name, None)
+            else:
+                since = self.cpu_over_since.setdefault(
+                    name, self.samples[name].time)
+                period = limits.get('cpu_period', CPU_PERIOD)
+                if now - since >= period:
+                    return "cpu over %d%% for %ds" % (max_cpu, now - since)
+        return None
+
+    def check(self, infos, now, sample=procstats.sample):
+        """ Sample the running bucket processes among `infos`, from
+        supervisor's ``getAllProcessInfo``, and return the ``(name,
+        reason)`` of those to recycle; at most one per group, so the other
+        instances keep serving meanwhile. """
+        recycle = []
+        groups = set()
+        seen = set()
+        for info in infos:
+            if info['statename'] != 'RUNNING':
+                continue
+            if not BUCKET_GROUP.match(info['group']):
+                continue
+            procname = info['group'].split('-', 1)[1]
+            limits = self.limits.get(procname)
+            if not limits:
+                continue
+            name = '%s:%s' % (info['group'], info['name'])
+            current = sample(info['pid'], now)
+            if current is None:
+                continue
+            seen.add(name)
+            reason = self._reason(name, info, limits, now, current)
+            self.samples[name] = current
+            if reason is not None and info['group'] not in groups:
+                groups.add(info['group'])
+                recycle.append((name, reason))
+                del self.samples[name]
+                self.cpu_over_since.pop(name, None)
+        for name in set(self.samples) - seen:
+            del self.samples[name]
+            self.cpu_over_since.pop(name, None)
+        return recycle
+
+
+def recycle(supervisor, name, reason):
+    log.warning("Recycling %s: %s", name, reason)
+    try:
+        supervisor.stopProcess(name, True)
+        supervisor.startProcess(name, False)
+    except RPC_ERRORS, e:
+        log.warning("Failed to recycle %s: %s", name, e)
+
+
+def load_settings(airship_home):
+    from .core import load_config
+    return load_config(path(airship_home)).get('watchdog') or {}
+
+
+def listen(airship_home, supervisor, stdin=sys.stdin, stdout=sys.stdout):
+    """ Supervisor event listener loop; checks the processes on the first
+    tick after every ``interval`` seconds. The settings are read from
+    ``airship.yaml`` each time. """
+    from supervisor import childutils
+    watchdog = Watchdog({})
+    last_check = 0
+    while True:
+        headers, payload = childutils.listener.wait(stdin, stdout)
+        try:
+            settings = load_settings(airship_home)
+            now = time.time()
+            if now - last_check >= settings.get('interval', INTERVAL):
+                last_check = now
+                watchdog.limits = settings.get('limits') or {}
+                infos = supervisor.getAllProcessInfo()
+                for name, reason in watchdog.check(infos, now):
+                    recycle(supervisor, name, reason)
+        except Exception:
+            log.exception("Watchdog check failed")
+        childutils.listener.ok(stdout)
+
+
+def main(argv=None):
+    from supervisor import childutils
+    parser = argparse.ArgumentParser(prog='python -m airship.watchdog')
+    parser.add_argument('airship_home')
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    rpc = childutils.getRPCInterface(os.environ)
+    listen(args.airship_home, rpc.supervisor)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import os
+import threading
+import SocketServer
+import ConfigParser
+from SimpleXMLRPCServer import (SimpleXMLRPCDispatcher,
+                                SimpleXMLRPCRequestHandler)
+
+SUCCESS = 80
+
+
+class UnixXMLRPCServer(SocketServer.ThreadingMixIn,
+                       SocketServer.UnixStreamServer,
+                       SimpleXMLRPCDispatcher):
+
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        SimpleXMLRPCDispatcher.__init__(self, allow_none=True, encoding=None)
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               UnixRequestHandler)
+
+
+class UnixRequestHandler(SimpleXMLRPCRequestHandler):
+
+    disable_nagle_algorithm = False  # not a TCP socket
+
+    def address_string(self):
+        return 'unix'
+
+    def log_request(self, *args):
+        pass
+
+
+def read_groups(config_dir):
+    """ Map the program groups defined in `config_dir` to their number of
+    processes and raw configuration. """
+    groups = {}
+    for name in sorted(os.listdir(config_dir)):
+        parser = ConfigParser.RawConfigParser()
+        parser.read([os.path.join(config_dir, name)])
+        for section in parser.sections():
+            if not section.startswith('program:'):
+                continue
+            options = dict(parser.items(section))
+            numprocs = int(options.get('numprocs', 1))
+            groups[section.split(':', 1)[1]] = (numprocs, options)
+    return groups
+
+
+class FakeSupervisord(object):
+    """ Stand-in for supervisord that speaks the parts of its XML-RPC API
+    that airship uses, on the same unix socket, without running any
+    processes. Programs are reported as ``RUNNING`` once started. """
+
+    def __init__(self, airship_home):
+        self.config_dir = os.path.join(airship_home, 'etc', 'supervisor.d')
+        self.socket_path = os.path.join(airship_home, 'var', 'run',
+                                        'supervisor.sock')
+        self.groups = {}
+        self.pending = {}
+        self.running = set()
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = UnixXMLRPCServer(self.socket_path)
+        for name in ['reloadConfig', 'addProcessGroup', 'removeProcessGroup',
+                     'startProcessGroup', 'stopProcessGroup',
+                     'getAllProcessInfo']:
+            self.server.register_function(self._counted(getattr(self, name)),
+                                          'supervisor.' + name)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.unlink(self.socket_path)
+
+    def _counted(self, func):
+        def wrapper(*args):
+            with self.lock:
+                self.calls += 1
+                return func(*args)
+        return wrapper
+
+    def reloadConfig(self):
+        self.pending = read_groups(self.config_dir)
+        added = [g for g in self.pending if g not in self.groups]
+        removed = [g for g in self.groups if g not in self.pending]
+        changed = [g for g in self.pending
+                   if g in self.groups and self.groups[g] != self.pending[g]]
+        return [[added, changed, removed]]
+
+    def addProcessGroup(self, name):
+        self.groups[name] = self.pending[name]
+        return True
+
+    def removeProcessGroup(self, name):
+        del self.groups[name]
+        self.running.discard(name)
+        return True
+
+    def _results(self, name):
+        return [{'name': process, 'group': name, 'status': SUCCESS,
+                 'description': 'OK'} for process in self._processes(name)]
+
+    def _processes(self, name):
+        numprocs = self.groups[name][0]
+        if numprocs == 1:
+            return [name]
+        return ['%s-%d' % (name, n) for n in range(numprocs)]
+
+    def startProcessGroup(self, name, wait=True):
+        self.running.add(name)
+        return self._results(name)
+
+    def stopProcessGroup(self, name, wait=True):
+        self.running.discard(name)
+        return self._results(name)
+
+    def getAllProcessInfo(self):
+        infos = []
+        for name in sorted(self.groups):
+            state = 'RUNNING' if name in self.running else 'STOPPED'
+            for process in self._processes(name):
+                infos.append({'name': process, 'group': name,
+                              'statename': state})
+        return infos
@@ -0,0 +1,69 @@
+import os
+import base64
+import hashlib
+import tarfile
+import zipfile
+from StringIO import StringIO
+
+PROCFILE = 'web: python -m SimpleHTTPServer $PORT\n'
+WHEEL_NAME = 'airshipbench'
+WHEEL_VERSION = '1.0'
+
+
+def _add_file(tar, name, data, mode=0644):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    tar.addfile(info, StringIO(data))
+
+
+def make_archive(archive_path, files, file_size, compression='',
+                 requirements=None, seed=0):
+    """ Write an application tarball with a Procfile and `files` files of
+    `file_size` bytes, spread over folders of 100 files. The content is
+    derived from `seed`, so two archives with the same arguments are
+    identical and a different seed changes every file. """
+    mode = 'w:' + compression if compression else 'w'
+    with tarfile.open(archive_path, mode) as tar:
+        _add_file(tar, 'Procfile', PROCFILE)
+        if requirements is not None:
+            _add_file(tar, 'requirements.txt', requirements)
+        block = hashlib.sha512('%d' % seed).digest()
+        for n in range(files):
+            prefix = hashlib.sha512(block + '%d' % n).digest()
+            data = (prefix * (file_size // len(prefix) + 1))[:file_size]
+            _add_file(tar, 'app/%03d/file%d.py' % (n // 100, n), data)
+    return os.path.getsize(archive_path)
+
+
+def _record_line(name, data):
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest())
+    return '%s,sha256=%s,%d\n' % (name, digest.rstrip('='), len(data))
+
+
+def make_wheelhouse(folder):
+    """ Build a wheelhouse with a single, dependency-free pure python wheel,
+    so the python plugin can install requirements without network access.
+    Returns the requirement line for it. """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    dist_info = '%s-%s.dist-info' % (WHEEL_NAME, WHEEL_VERSION)
+    members = [
+        ('%s.py' % WHEEL_NAME, 'VALUE = 42\n'),
+        (dist_info + '/METADATA', 'Metadata-Version: 2.0\n'
+                                  'Name: %s\nVersion: %s\n'
+                                  % (WHEEL_NAME, WHEEL_VERSION)),
+        (dist_info + '/WHEEL', 'Wheel-Version: 1.0\n'
+                               'Generator: airship-benchmarks\n'
+                               'Root-Is-Purelib: true\n'
+                               'Tag: py2-none-any\n'),
+    ]
+    record = ''.join(_record_line(name, data) for name, data in members)
+    record += dist_info + '/RECORD,,\n'
+    members.append((dist_info + '/RECORD', record))
+    wheel_path = os.path.join(folder, '%s-%s-py2-none-any.whl'
+                                      % (WHEEL_NAME, WHEEL_VERSION))
+    with zipfile.ZipFile(wheel_path, 'w') as wheel:
+        for name, data in members:
+            wheel.writestr(name, data)
+    return '%s==%s\n' % (WHEEL_NAME, WHEEL_VERSION)
@@ -0,0 +1,223 @@
+""" Benchmark airship's own overhead: deployments, the bucket registry and
+supervisor configuration, against synthetic archives, a local wheelhouse
+and a fake supervisord. Nothing is downloaded and no processes are run.
+
+    python benchmarks/run.py --buckets 1,10,100 --files 100,1000
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+from path import path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from airship import core, deployer, stats
+from fakesupervisord import FakeSupervisord
+import fixtures
+
+
+def percentile(values, p):
+    return stats.percentile(values, p) if values else 0
+
+
+class Results(object):
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, operation, scale, latencies, units=None):
+        """ Record the `latencies` (seconds) of an `operation`. `units` maps
+        a unit name, e.g. ``MB``, to the amount processed per run, to report
+        throughput in that unit as well. """
+        total = sum(latencies)
+        row = {
+            'operation': operation,
+            'scale': scale,
+            'runs': len(latencies),
+            'mean_ms': total / len(latencies) * 1000,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p90_ms': percentile(latencies, 90) * 1000,
+            'max_ms': max(latencies) * 1000,
+            'per_second': {'ops': len(latencies) / total if total else 0},
+        }
+        for unit, amount in (units or {}).items():
+            row['per_second'][unit] = (amount * len(latencies) / total
+                                       if total else 0)
+        self.rows.append(row)
+        return row
+
+    def format(self):
+        lines = ['%-36s %-14s %5s %10s %10s %10s  %s' % (
+            'operation', 'scale', 'runs', 'mean', 'p50', 'p90', 'throughput')]
+        for row in self.rows:
+            throughput = ', '.join('%.1f %s/s' % (value, unit) for unit, value
+                                   in sorted(row['per_second'].items()))
+            lines.append('%-36s %-14s %5d %8.2fms %8.2fms %8.2fms  %s' % (
+                row['operation'], row['scale'], row['runs'], row['mean_ms'],
+                row['p50_ms'], row['p90_ms'], throughput))
+        return '\n'.join(lines)
+
+
+def timed(func, *args, **kwargs):
+    t0 = time.time()
+    func(*args, **kwargs)
+    return time.time() - t0
+
+
+class Home(object):
+    """ A throwaway airship home with a fake supervisord listening on its
+    socket. """
+
+    def __init__(self, config=None):
+        self.path = path(tempfile.mkdtemp(prefix='airship-bench-'))
+        (self.path / 'etc').mkdir()
+        config = dict(config or {})
+        config['home'] = self.path
+        self.airship = core.Airship(config)
+        self.airship.initialize()
+        (self.path / 'etc' / 'supervisor.d').makedirs_p()
+        core.load_plugins(self.airship)
+        self.supervisord = FakeSupervisord(self.path).start()
+
+    def close(self):
+        self.supervisord.stop()
+        shutil.rmtree(self.path)
+
+
+def bench_registry(results, bucket_counts, repeat, procs):
+    for count in bucket_counts:
+        home = Home({'concurrency': {'web': procs}})
+        airship = home.airship
+        try:
+            scale = '%d buckets' % count
+            latencies = [timed(airship.new_bucket) for n in range(count)]
+            results.add('new_bucket', scale, latencies)
+
+            results.add('list_buckets', scale,
+                        [timed(airship.list_buckets) for n in range(repeat)])
+
+            ids = [b['id'] for b in airship.list_buckets()['buckets']]
+            results.add('get_bucket', scale,
+                        [timed(airship.get_bucket, random.choice(ids))
+                         for n in range(repeat)])
+
+            bucket = airship.get_bucket(ids[-1])
+            bucket.process_types = {'web': 'serve', 'worker': 'work'}
+            results.add('_configure_bucket', scale,
+                        [timed(airship.daemons._configure_bucket, bucket, True)
+                         for n in range(repeat)])
+
+            results.add('Bucket.destroy', scale,
+                        [timed(airship.get_bucket(bucket_id).destroy)
+                         for bucket_id in ids])
+        finally:
+            home.close()
+
+
+def bench_deploy(results, file_counts, file_size, repeat, compression,
+                 incremental, wheelhouse):
+    for files in file_counts:
+        config = {}
+        requirements = None
+        if wheelhouse is not None:
+            config['python'] = {'dist': wheelhouse,
+                                'interpreter': sys.executable}
+            requirements = fixtures.make_wheelhouse(wheelhouse)
+        home = Home(config)
+        if wheelhouse is not None:
+            import virtualenv
+            (home.path / 'dist').mkdir_p()
+            shutil.copy(virtualenv.__file__.rstrip('c'),
+                        home.path / 'dist' / 'virtualenv.py')
+        try:
+            scale = '%d x %dB' % (files, file_size)
+            megabytes = files * file_size / 1024.0 / 1024
+            latencies = []
+            for n in range(repeat):
+                archive = home.path / ('app%d.tar' % n)
+                fixtures.make_archive(archive, files, file_size, compression,
+                                      requirements, seed=0 if incremental
+                                      else n)
+                # force, or identical archives would be skipped as unchanged
+                latencies.append(timed(deployer.deploy, home.airship,
+                                       archive, incremental=incremental,
+                                       force=True))
+                archive.unlink()
+            results.add('deploy', scale, latencies,
+                        {'files': files, 'MB': megabytes})
+            add_phases(results, scale, stats.read_records(
+                home.airship.log_path / stats.STATS_FILE_NAME))
+        finally:
+            home.close()
+
+
+def add_phases(results, scale, records):
+    """ Break the deployments down by phase and signal receiver, from the
+    deployment stats airship recorded. """
+    timings = {}
+    for record in records:
+        for name, seconds in record['phases'].items():
+            timings.setdefault(name, []).append(seconds)
+        for name, seconds in record['receivers'].items():
+            label = '~' + name.rsplit('.', 1)[-1]
+            timings.setdefault(label, []).append(seconds)
+    for name in sorted(timings):
+        results.add('  ' + name, scale, timings[name])
+
+
+def comma_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--buckets', type=comma_list, default=[1, 10, 100],
+                        help="bucket counts for the registry benchmarks")
+    parser.add_argument('--files', type=comma_list, default=[100, 1000],
+                        help="files per archive for the deploy benchmarks")
+    parser.add_argument('--file-size', type=int, default=4096)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--procs', type=int, default=1,
+                        help="instances of each process type")
+    parser.add_argument('--compression', choices=['', 'gz', 'bz2'],
+                        default='')
+    parser.add_argument('--incremental', action='store_true',
+                        help="deploy identical archives with --incremental")
+    parser.add_argument('--wheelhouse',
+                        help="folder with the wheels needed to bootstrap a "
+                             "virtualenv (e.g. wheel); enables the python "
+                             "plugin with a local requirements.txt")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    os.environ.pop('AIRSHIP_NO_SUPERVISORCTL', None)
+    wheelhouse = None
+    if args.wheelhouse:
+        wheelhouse = path(tempfile.mkdtemp(prefix='airship-wheels-'))
+        for wheel in path(args.wheelhouse).files('*.whl'):
+            wheel.copy(wheelhouse)
+
+    results = Results()
+    try:
+        bench_registry(results, args.buckets, args.repeat, args.procs)
+        bench_deploy(results, args.files, args.file_size, args.repeat,
+                     args.compression, args.incremental, wheelhouse)
+    finally:
+        if wheelhouse is not None:
+            wheelhouse.rmtree()
+
+    if args.json:
+        print json.dumps({'python': sys.version.split()[0],
+                          'results': results.rows}, indent=2)
+    else:
+        print results.format()
+
+
+if __name__ == '__main__':
+    main()
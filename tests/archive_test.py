@@ -0,0 +1,159 @@
+import tarfile
+import hashlib
+from StringIO import StringIO
+from common import HandyTestCase
+
+
+def make_tar(members, mode='w'):
+    data = StringIO()
+    with tarfile.open(fileobj=data, mode=mode) as tar:
+        for info, content in members:
+            tar.addfile(info, content and StringIO(content))
+    return data.getvalue()
+
+
+def file_info(name, content):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    return info, content
+
+
+def link_info(name, target):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.SYMTYPE
+    info.linkname = target
+    return info, None
+
+
+class StreamingExtractTest(HandyTestCase):
+
+    def extract(self, data):
+        from airship.archive import extract
+        folder = self.tmp / 'out'
+        folder.mkdir()
+        return folder, extract(StringIO(data), folder)
+
+    def test_compressed_archives_are_extracted(self):
+        for mode in ['w', 'w:gz', 'w:bz2']:
+            data = make_tar([file_info('a/hello.txt', 'hi!')], mode)
+            folder, counts = self.extract(data)
+            self.assertEqual((folder / 'a' / 'hello.txt').bytes(), 'hi!')
+            folder.rmtree()
+
+    def test_hash_covers_whole_archive(self):
+        data = make_tar([file_info('hello.txt', 'hi!')], 'w:gz')
+        folder, counts = self.extract(data)
+        self.assertEqual(counts['hash'], hashlib.sha256(data).hexdigest())
+
+    def test_members_outside_folder_are_skipped(self):
+        data = make_tar([
+            file_info('../evil.txt', 'x'),
+            file_info('/tmp/evil.txt', 'x'),
+            link_info('escape', '../../etc'),
+            link_info('fine', 'sub/ok.txt'),
+            file_info('sub/ok.txt', 'ok'),
+        ])
+        folder, counts = self.extract(data)
+        self.assertEqual(counts['skipped'], 3)
+        self.assertFalse((self.tmp / 'evil.txt').exists())
+        self.assertFalse((folder / 'escape').islink())
+        self.assertEqual((folder / 'fine').bytes(), 'ok')
+
+    def test_symlink_chains_cant_escape_folder(self):
+        data = make_tar([
+            link_info('sub/b', '..'),
+            link_info('sub/c', 'b/..'),
+            file_info('sub/c/escaped.txt', 'x'),
+            link_info('sub/d', 'b/../..'),
+            file_info('sub/d/escaped.txt', 'x'),
+        ])
+        folder, counts = self.extract(data)
+        self.assertEqual(counts['skipped'], 2)
+        self.assertFalse((self.tmp / 'escaped.txt').exists())
+        self.assertFalse((folder / 'sub' / 'c').islink())
+        self.assertEqual((folder / 'sub' / 'c' / 'escaped.txt').bytes(), 'x')
+
+    def test_hardlinks_through_symlinks_are_skipped(self):
+        (self.tmp / 'secret.txt').write_bytes('secret')
+        hardlink = tarfile.TarInfo('stolen')
+        hardlink.type = tarfile.LNKTYPE
+        hardlink.linkname = 'sub/up/../secret.txt'
+        data = make_tar([
+            link_info('sub/up', '..'),
+            (hardlink, None),
+        ])
+        folder, counts = self.extract(data)
+        self.assertEqual(counts['skipped'], 1)
+        self.assertFalse((folder / 'stolen').exists())
+
+    def test_garbage_raises_archive_error(self):
+        from airship.archive import extract, ArchiveError
+        with self.assertRaises(ArchiveError):
+            extract(StringIO('not a tarball' * 100), self.tmp)
+
+    def test_garbage_file_is_closed(self):
+        import os
+        from airship.archive import extract, ArchiveError
+        archive_path = self.tmp / 'garbage.tar'
+        archive_path.write_bytes('not a tarball' * 100)
+        open_fds = len(os.listdir('/proc/self/fd'))
+        with self.assertRaises(ArchiveError):
+            extract(archive_path, self.tmp)
+        self.assertEqual(len(os.listdir('/proc/self/fd')), open_fds)
+
+    def test_write_errors_raise_archive_error(self):
+        from airship.archive import ArchiveError
+        # `a/b` can't be created below the file `a`
+        data = make_tar([file_info('a', 'x'), file_info('a/b', 'y')])
+        with self.assertRaises(ArchiveError):
+            self.extract(data)
+
+
+class IncrementalExtractTest(HandyTestCase):
+
+    def make_archive(self, name, files):
+        src = self.tmp / (name + '-src')
+        src.mkdir()
+        for filename, content in files.items():
+            (src / filename).parent.makedirs_p()
+            (src / filename).write_bytes(content)
+        archive_path = self.tmp / (name + '.tar')
+        with tarfile.open(archive_path, 'w') as tar:
+            for filename in files:
+                tar.add(src / filename, filename)
+        return archive_path
+
+    def extract(self, archive_path, name, previous=None):
+        from airship.archive import extract
+        folder = self.tmp / name
+        folder.mkdir()
+        return folder, extract(archive_path, folder, previous)
+
+    def test_unchanged_files_are_hardlinked(self):
+        files = {'static/big.js': 'x' * 200000, 'app.py': 'print 1\n'}
+        old, _ = self.extract(self.make_archive('a', files), 'old')
+        new, counts = self.extract(self.make_archive('b', files), 'new', old)
+        self.assertEqual((counts['written'], counts['linked']), (0, 2))
+        self.assertEqual((new / 'static/big.js').stat().st_ino,
+                         (old / 'static/big.js').stat().st_ino)
+
+    def test_changed_files_are_written(self):
+        old_files = {'app.py': 'print 1\n', 'big': 'a' * 100000 + 'b'}
+        new_files = {'app.py': 'print 2\n', 'big': 'a' * 100000 + 'c',
+                     'new.txt': 'hi'}
+        old, _ = self.extract(self.make_archive('a', old_files), 'old')
+        new, counts = self.extract(self.make_archive('b', new_files),
+                                   'new', old)
+        self.assertEqual((counts['written'], counts['linked']), (3, 0))
+        for filename, content in new_files.items():
+            self.assertEqual((new / filename).bytes(), content)
+        self.assertEqual((old / 'big').bytes(), old_files['big'])
+        self.assertNotEqual((new / 'app.py').stat().st_ino,
+                            (old / 'app.py').stat().st_ino)
+
+    def test_files_with_different_mode_are_not_linked(self):
+        files = {'run.sh': 'echo hi\n'}
+        old, _ = self.extract(self.make_archive('a', files), 'old')
+        (old / 'run.sh').chmod(0700)
+        new, counts = self.extract(self.make_archive('b', files), 'new', old)
+        self.assertEqual((counts['written'], counts['linked']), (1, 0))
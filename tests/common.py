@@ -45,4 +45,6 @@ class AirshipTestCase(HandyTestCase):
         super(AirshipTestCase, self)._pre_setup()
         (self.tmp / 'etc').mkdir()
         (self.tmp / 'var' / 'deploy').makedirs_p()
-        self.mock_subprocess = self.patch('airship.daemons.subprocess')
+        self.mock_reaper_spawn = self.patch('airship.reaper.spawn')
+        self.mock_rpc = self.patch('airship.daemons.Supervisor.rpc')
+        self.mock_rpc.supervisor.reloadConfig.return_value = [[[], [], []]]
@@ -0,0 +1,95 @@
+from mock import Mock, call
+from common import AirshipTestCase
+
+
+class CrashLoopTest(AirshipTestCase):
+
+    def setUp(self):
+        from airship.crashloop import CrashLoop
+        self.crashloop = CrashLoop(self.tmp / 'crashloop.json', window=60,
+                                   threshold=3, park_after=5, max_delay=12)
+        self.supervisor = Mock()
+
+    def event(self, eventname, now, name='d1-web:d1-web', expected=0):
+        from airship.crashloop import handle
+        group, process = name.split(':')
+        handle(self.crashloop, self.supervisor, eventname,
+               {'groupname': group, 'processname': process,
+                'expected': str(expected)}, now)
+
+    def crash(self, now, ran=1, name='d1-web:d1-web'):
+        self.event('PROCESS_STATE_RUNNING', now - ran, name)
+        self.event('PROCESS_STATE_EXITED', now, name)
+
+    def entry(self):
+        return self.crashloop.load()['d1-web:d1-web']
+
+    def test_quick_exits_below_threshold_are_left_to_supervisor(self):
+        self.crash(10)
+        self.crash(20)
+        self.assertEqual(self.entry()['failures'], 2)
+        self.assertEqual(self.supervisor.mock_calls, [])
+
+    def test_process_that_ran_for_a_while_starts_over(self):
+        self.crash(10)
+        self.crash(20)
+        self.crash(200, ran=100)
+        self.assertEqual(self.entry()['failures'], 1)
+
+    def test_delay_doubles_with_each_failure(self):
+        delays = []
+        for n in range(4):
+            self.crash(n * 100)
+            entry = self.entry()
+            if entry['retry_at'] is not None:
+                delays.append(entry['retry_at'] - n * 100)
+        self.assertEqual(delays, [5, 10])
+        self.assertEqual(self.supervisor.stopProcess.mock_calls,
+                         [call('d1-web:d1-web', False)] * 2)
+
+    def test_process_is_started_again_after_delay(self):
+        for n in range(3):
+            self.crash(n)
+        self.event('TICK_5', 5)
+        self.assertEqual(self.supervisor.startProcess.mock_calls, [])
+        self.event('TICK_5', 10)
+        self.assertEqual(self.supervisor.startProcess.mock_calls,
+                         [call('d1-web:d1-web', False)])
+        self.assertIsNone(self.entry()['retry_at'])
+
+    def test_flapping_process_is_parked(self):
+        for n in range(5):
+            self.crash(n * 100)
+        self.assertTrue(self.entry()['parked'])
+        self.event('TICK_5', 10000)
+        self.assertEqual(self.supervisor.startProcess.mock_calls, [])
+
+    def test_other_groups_are_ignored(self):
+        for n in range(5):
+            self.crash(n, name='airship-crashloop:airship-crashloop')
+        self.assertEqual(self.crashloop.load(), {})
+
+    def test_reset_returns_parked_processes(self):
+        for n in range(5):
+            self.crash(n * 100)
+        self.crash(10, name='d1-worker:d1-worker')
+        state = self.crashloop.load()
+        parked = self.crashloop.forget(state, None)
+        self.assertEqual(parked, ['d1-web:d1-web'])
+        self.assertEqual(state, {})
+
+    def test_events_wait_for_changes_made_holding_the_lock(self):
+        import threading
+        for n in range(5):
+            self.crash(n * 100)
+        with self.crashloop.locked():
+            listener = threading.Thread(target=self.crash, args=(1000,),
+                                        kwargs={'name': 'd2-web:d2-web'})
+            listener.start()
+            listener.join(.2)
+            self.assertTrue(listener.is_alive())
+            state = self.crashloop.load()
+            self.crashloop.forget(state, None)
+            self.crashloop.save(state)
+        listener.join()
+        self.assertEqual(self.crashloop.load().keys(), ['d2-web:d2-web'])
@@ -1,15 +1,450 @@
+import socket
+import tarfile
+from StringIO import StringIO
 from common import AirshipTestCase
 
 
+def make_app_tarball(archive_path, procfile='web: ./runweb $PORT\n'):
+    with tarfile.open(archive_path, 'w') as tar:
+        info = tarfile.TarInfo('Procfile')
+        info.size = len(procfile)
+        tar.addfile(info, StringIO(procfile))
+
+
 class DaemonErrorTest(AirshipTestCase):
 
-    def test_supervisorctl_failure_raises_daemon_error(self):
+    def test_supervisor_failure_raises_daemon_error(self):
         from airship.daemons import SupervisorError
-        from subprocess import CalledProcessError
-        subprocess = self.patch('airship.daemons.subprocess')
-        subprocess.CalledProcessError = CalledProcessError
-        subprocess.check_call.side_effect = CalledProcessError(3, '')
+        self.mock_rpc.supervisor.reloadConfig.side_effect = socket.error
         airship = self.create_airship()
         bucket = airship.new_bucket()
         with self.assertRaises(SupervisorError):
             bucket.start()
+
+    def test_failure_to_start_raises_daemon_error(self):
+        from airship.daemons import SupervisorError
+        self.mock_rpc.supervisor.startProcessGroup.return_value = [
+            {'status': 60, 'description': "spawn error"}]
+        airship = self.create_airship()
+        bucket = airship.new_bucket()
+        bucket.process_types = {'web': 'serve'}
+        with self.assertRaises(SupervisorError):
+            bucket.start()
+
+
+class BlueGreenDeployTest(AirshipTestCase):
+
+    def setUp(self):
+        self.archive = self.tmp / 'app.tar'
+        make_app_tarball(self.archive)
+        self.wait_until_ready = self.patch('airship.deployer.wait_until_ready')
+        self.airship = self.create_airship({
+            'port_map': {'web': 8000},
+            'port_pool': {'web': [8000, 8001]},
+        })
+
+    def deploy(self):
+        from airship.deployer import deploy
+        deploy(self.airship, self.archive, force=True)
+        return self.airship.get_bucket()
+
+    def bucket_ids(self):
+        return [b['id'] for b in self.airship.list_buckets()['buckets']]
+
+    def test_new_bucket_gets_port_not_used_by_running_bucket(self):
+        seen_while_waiting = []
+
+        def wait_until_ready(bucket, timeout, notifications=None):
+            seen_while_waiting.append(sorted(self.bucket_ids()))
+            return True
+
+        self.wait_until_ready.side_effect = wait_until_ready
+        bucket_1 = self.deploy()
+        bucket_2 = self.deploy()
+        self.assertEqual(bucket_1.port_for('web'), 8000)
+        self.assertEqual(bucket_2.port_for('web'), 8001)
+        self.assertEqual(seen_while_waiting, [['d1'], ['d1', 'd2']])
+        self.assertEqual(self.bucket_ids(), ['d2'])
+
+    def test_failed_readiness_check_keeps_old_bucket(self):
+        from airship.deployer import DeployError
+        self.wait_until_ready.return_value = True
+        bucket_1 = self.deploy()
+        self.wait_until_ready.return_value = False
+        with self.assertRaises(DeployError):
+            self.deploy()
+        self.assertIn(bucket_1.id_, self.bucket_ids())
+        self.assertTrue(bucket_1.folder.isdir())
+
+    def test_ported_process_types_must_be_in_port_pool(self):
+        from airship.deployer import DeployError
+        make_app_tarball(self.archive, 'web: ./runweb\nadmin: ./runadmin\n')
+        self.airship.config['port_map']['admin'] = 9000
+        self.wait_until_ready.return_value = True
+        bucket_1 = self.deploy()
+        self.wait_until_ready.reset_mock()
+        with self.assertRaises(DeployError) as raised:
+            self.deploy()
+        self.assertIn("'admin'", raised.exception.message)
+        self.assertFalse(self.wait_until_ready.called)
+        self.assertIn(bucket_1.id_, self.bucket_ids())
+
+
+class SocketHandoverTest(AirshipTestCase):
+
+    def setUp(self):
+        self.archive = self.tmp / 'app.tar'
+        make_app_tarball(self.archive)
+        self.wait_until_ready = self.patch('airship.deployer.wait_until_ready')
+
+    def bucket_ids(self, airship):
+        return [b['id'] for b in airship.list_buckets()['buckets']]
+
+    def test_new_bucket_shares_port_with_running_bucket(self):
+        from airship.deployer import deploy
+        airship = self.create_airship({'port_map': {'web': 8000},
+                                       'socket_activation': ['web']})
+        seen_while_waiting = []
+
+        def wait_until_ready(bucket, timeout, notifications=None):
+            seen_while_waiting.append(self.bucket_ids(airship))
+            return True
+
+        self.wait_until_ready.side_effect = wait_until_ready
+        deploy(airship, self.archive, force=True)
+        deploy(airship, self.archive, force=True)
+        self.assertEqual(seen_while_waiting, [['d1'], ['d1', 'd2']])
+        self.assertEqual(self.bucket_ids(airship), ['d2'])
+        self.assertEqual(airship.get_bucket().port_for('web'), 8000)
+
+    def test_processes_binding_their_own_port_are_stopped_first(self):
+        from airship.deployer import deploy
+        airship = self.create_airship({'port_map': {'web': 8000}})
+        deploy(airship, self.archive, force=True)
+        deploy(airship, self.archive, force=True)
+        self.assertFalse(self.wait_until_ready.called)
+
+
+class ReadinessTest(AirshipTestCase):
+
+    def setUp(self):
+        self.airship = self.create_airship()
+        self.bucket = self.airship.new_bucket()
+        self.bucket.process_types = {'web': './runweb'}
+
+    def test_running_processes_are_ready(self):
+        from airship.deployer import wait_until_ready
+        self.mock_rpc.supervisor.getAllProcessInfo.return_value = [
+            {'group': 'd1-web', 'name': 'd1-web', 'statename': 'RUNNING'},
+            {'group': 'd11-web', 'name': 'd11-web', 'statename': 'FATAL'},
+        ]
+        self.assertTrue(wait_until_ready(self.bucket, 0))
+
+    def test_fatal_process_is_not_ready(self):
+        from airship.deployer import wait_until_ready
+        self.mock_rpc.supervisor.getAllProcessInfo.return_value = [
+            {'group': 'd1-web', 'name': 'd1-web', 'statename': 'FATAL'},
+        ]
+        self.assertFalse(wait_until_ready(self.bucket, 10))
+
+    def test_socket_activated_ports_are_not_probed(self):
+        from airship.deployer import wait_until_ready
+        airship = self.create_airship({'port_map': {'web': 1},
+                                       'socket_activation': ['web']})
+        bucket = airship.get_bucket(self.bucket.id_)
+        bucket.process_types = {'web': './runweb'}
+        self.mock_rpc.supervisor.getAllProcessInfo.return_value = [
+            {'group': 'd1-web', 'name': 'd1-web', 'statename': 'RUNNING'},
+        ]
+        self.assertTrue(wait_until_ready(bucket, 0))
+
+    def test_processes_must_notify_readiness(self):
+        import socket
+        from airship.deployer import wait_until_ready, ready_notifications
+        airship = self.create_airship({'notify_ready': ['web']})
+        bucket = airship.get_bucket(self.bucket.id_)
+        bucket.process_types = {'web': './runweb'}
+        self.mock_rpc.supervisor.getAllProcessInfo.return_value = [
+            {'group': 'd1-web', 'name': 'd1-web', 'statename': 'RUNNING'},
+        ]
+        notifications = ready_notifications(bucket)
+        self.addCleanup(notifications.close)
+        self.assertFalse(wait_until_ready(bucket, 0, notifications))
+        [notify_path] = bucket.notify_paths('web')
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        client.sendto('READY=1', notify_path)
+        client.close()
+        self.assertTrue(wait_until_ready(bucket, 1, notifications))
+
+    def test_all_instances_must_be_running(self):
+        from airship.deployer import wait_until_ready
+        self.mock_rpc.supervisor.getAllProcessInfo.return_value = [
+            {'group': 'd1-web', 'name': 'd1-web-0', 'statename': 'RUNNING'},
+            {'group': 'd1-web', 'name': 'd1-web-1', 'statename': 'STARTING'},
+        ]
+        self.assertFalse(wait_until_ready(self.bucket, 0))
+
+
+class RetentionTest(AirshipTestCase):
+
+    def setUp(self):
+        self.archive = self.tmp / 'app.tar'
+        make_app_tarball(self.archive)
+        self.wait_until_ready = self.patch('airship.deployer.wait_until_ready')
+        self.wait_until_ready.return_value = True
+
+    def deploy(self, airship, count):
+        from airship.deployer import deploy
+        for c in range(count):
+            deploy(airship, self.archive, force=True)
+
+    def states(self, airship):
+        return dict((b['id'], b['state'])
+                    for b in airship.list_buckets()['buckets'])
+
+    def test_old_buckets_are_destroyed_by_default(self):
+        airship = self.create_airship()
+        self.deploy(airship, 3)
+        self.assertEqual(self.states(airship), {'d3': 'running'})
+
+    def test_recent_buckets_are_stopped_and_kept(self):
+        airship = self.create_airship({'keep_buckets': 2})
+        self.deploy(airship, 4)
+        self.assertEqual(self.states(airship), {
+            'd2': 'stopped', 'd3': 'stopped', 'd4': 'running'})
+        self.assertFalse(airship.deploy_path.joinpath('d1').exists())
+
+    def test_rollback_activates_previous_bucket(self):
+        from airship.deployer import rollback
+        airship = self.create_airship({'keep_buckets': 2})
+        self.deploy(airship, 3)
+        rollback(airship)
+        self.assertEqual(airship.get_bucket().id_, 'd2')
+        self.assertEqual(self.states(airship), {
+            'd1': 'stopped', 'd2': 'running', 'd3': 'stopped'})
+
+    def test_rollback_to_chosen_bucket(self):
+        from airship.deployer import rollback
+        airship = self.create_airship({'keep_buckets': 2})
+        self.deploy(airship, 3)
+        rollback(airship, 'd1')
+        self.assertEqual(airship.get_bucket().id_, 'd1')
+        self.assertEqual(self.states(airship)['d3'], 'stopped')
+
+    def test_rollback_without_retained_bucket_fails(self):
+        from airship.deployer import rollback, DeployError
+        airship = self.create_airship()
+        self.deploy(airship, 2)
+        with self.assertRaises(DeployError):
+            rollback(airship)
+
+    def test_rollback_to_unknown_or_staged_bucket_fails(self):
+        from airship.deployer import rollback, stage, DeployError
+        airship = self.create_airship({'keep_buckets': 2})
+        self.deploy(airship, 2)
+        stage(airship, self.archive)
+        for bucket_id in ['d3', 'd7', 'x']:
+            with self.assertRaises(DeployError):
+                rollback(airship, bucket_id)
+        self.assertEqual(self.states(airship), {
+            'd1': 'stopped', 'd2': 'running', 'd3': 'staged'})
+
+    def test_failed_rollback_starts_active_bucket_again(self):
+        from airship.deployer import rollback, DeployError
+        airship = self.create_airship({'keep_buckets': 2,
+                                       'port_map': {'web': 8000}})
+        self.deploy(airship, 2)
+
+        def start_group(name):
+            if name == 'd1-web':
+                return [{'status': 60, 'description': "spawn error"}]
+            return []
+
+        self.mock_rpc.supervisor.startProcessGroup.side_effect = start_group
+        with self.assertRaises(DeployError):
+            rollback(airship, 'd1')
+        self.assertEqual(self.states(airship),
+                         {'d1': 'stopped', 'd2': 'running'})
+        self.assertEqual(airship.get_bucket().id_, 'd2')
+
+
+class StagingTest(AirshipTestCase):
+
+    def setUp(self):
+        self.archive = self.tmp / 'app.tar'
+        make_app_tarball(self.archive)
+        self.wait_until_ready = self.patch('airship.deployer.wait_until_ready')
+        self.wait_until_ready.return_value = True
+
+    def states(self, airship):
+        return dict((b['id'], b['state'])
+                    for b in airship.list_buckets()['buckets'])
+
+    def test_stage_prepares_bucket_without_starting_it(self):
+        from airship.deployer import deploy, stage
+        airship = self.create_airship()
+        deploy(airship, self.archive)
+        bucket = stage(airship, self.archive)
+        self.assertEqual(bucket.process_types, {'web': './runweb $PORT'})
+        self.assertEqual(self.states(airship),
+                         {'d1': 'running', 'd2': 'staged'})
+        self.assertEqual(airship.get_bucket().id_, 'd1')
+        started = [c[0][0] for c in
+                   self.mock_rpc.supervisor.startProcessGroup.call_args_list]
+        self.assertEqual(started, ['d1-web'])
+
+    def test_activate_starts_staged_bucket_and_retires_active_one(self):
+        from airship.deployer import deploy, stage, activate
+        airship = self.create_airship()
+        deploy(airship, self.archive)
+        bucket = stage(airship, self.archive)
+        activate(airship, bucket.id_)
+        self.assertEqual(self.states(airship), {'d2': 'running'})
+        self.assertEqual(airship.get_bucket().id_, 'd2')
+
+    def test_deploy_leaves_staged_buckets_alone(self):
+        from airship.deployer import deploy, stage
+        airship = self.create_airship()
+        stage(airship, self.archive)
+        deploy(airship, self.archive)
+        self.assertEqual(self.states(airship),
+                         {'d1': 'staged', 'd2': 'running'})
+
+    def test_failed_activation_keeps_previous_bucket_active(self):
+        from airship.deployer import deploy, stage, activate, DeployError
+        airship = self.create_airship({'port_pool': {'web': [8000, 8001]}})
+        deploy(airship, self.archive)
+        bucket = stage(airship, self.archive)
+        self.wait_until_ready.return_value = False
+        with self.assertRaises(DeployError):
+            activate(airship, bucket.id_)
+        self.assertEqual(self.states(airship),
+                         {'d1': 'running', 'd2': 'staged'})
+        self.assertEqual(airship.get_bucket().id_, 'd1')
+
+    def test_failed_deploy_keeps_active_pointer(self):
+        from airship.deployer import deploy, stage, DeployError
+        airship = self.create_airship({'port_pool': {'web': [8000, 8001]}})
+        deploy(airship, self.archive)
+        stage(airship, self.archive)
+        self.wait_until_ready.return_value = False
+        with self.assertRaises(DeployError) as raised:
+            deploy(airship, self.archive, force=True)
+        raised.exception.bucket.destroy()
+        self.assertEqual(airship.registry.get_active(), 'd1')
+        self.assertEqual(self.states(airship),
+                         {'d1': 'running', 'd2': 'staged'})
+
+    def test_failed_start_starts_previous_bucket_again(self):
+        from airship.deployer import deploy, stage, activate, DeployError
+        airship = self.create_airship()
+        deploy(airship, self.archive)
+        bucket = stage(airship, self.archive)
+
+        def start_group(name):
+            if name == 'd2-web':
+                return [{'status': 60, 'description': "spawn error"}]
+            return []
+
+        self.mock_rpc.supervisor.startProcessGroup.side_effect = start_group
+        with self.assertRaises(DeployError):
+            activate(airship, bucket.id_)
+        self.assertEqual(self.states(airship),
+                         {'d1': 'running', 'd2': 'staged'})
+        self.assertEqual(airship.get_bucket().id_, 'd1')
+        started = [c[0][0] for c in
+                   self.mock_rpc.supervisor.startProcessGroup.call_args_list]
+        self.assertEqual(started, ['d1-web', 'd2-web', 'd1-web'])
+
+    def test_activate_unknown_bucket_fails(self):
+        from airship.deployer import activate, DeployError
+        airship = self.create_airship()
+        with self.assertRaises(DeployError):
+            activate(airship, 'd7')
+
+    def test_only_staged_buckets_can_be_activated(self):
+        from airship.deployer import deploy, activate, DeployError
+        airship = self.create_airship()
+        deploy(airship, self.archive)
+        with self.assertRaises(DeployError):
+            activate(airship, 'd1')
+
+
+class UnchangedArchiveTest(AirshipTestCase):
+
+    def setUp(self):
+        self.archive = self.tmp / 'app.tar'
+        make_app_tarball(self.archive)
+        self.airship = self.create_airship()
+
+    def bucket_ids(self):
+        return [b['id'] for b in self.airship.list_buckets()['buckets']]
+
+    def test_deploy_records_archive_hash(self):
+        import hashlib
+        from airship.deployer import deploy
+        bucket = deploy(self.airship, self.archive)
+        record = self.airship.registry.get(bucket.id_)
+        self.assertEqual(record['archive_hash'],
+                         hashlib.sha256(self.archive.bytes()).hexdigest())
+
+    def test_identical_archive_is_not_deployed_again(self):
+        from airship.deployer import deploy
+        deploy(self.airship, self.archive)
+        bucket = deploy(self.airship, self.archive)
+        self.assertEqual(bucket.id_, 'd1')
+        self.assertEqual(self.bucket_ids(), ['d1'])
+        self.assertFalse(self.mock_rpc.supervisor.stopProcessGroup.called)
+
+    def test_identical_stream_is_discarded_after_extraction(self):
+        from airship.deployer import deploy
+        deploy(self.airship, self.archive)
+        with self.archive.open('rb') as f:
+            bucket = deploy(self.airship, f)
+        self.assertEqual(bucket.id_, 'd1')
+        self.assertEqual(self.bucket_ids(), ['d1'])
+
+    def test_restart_restarts_processes_of_active_bucket(self):
+        from airship.deployer import deploy
+        deploy(self.airship, self.archive)
+        supervisor = self.mock_rpc.supervisor
+        supervisor.startProcessGroup.return_value = [{'status': 80}]
+        supervisor.reset_mock()
+        deploy(self.airship, self.archive, restart=True)
+        self.assertEqual(supervisor.stopProcessGroup.call_args_list,
+                         [(('d1-web',),)])
+        self.assertEqual(supervisor.startProcessGroup.call_args_list,
+                         [(('d1-web',),)])
+
+    def test_force_deploys_identical_archive(self):
+        from airship.deployer import deploy
+        deploy(self.airship, self.archive)
+        bucket = deploy(self.airship, self.archive, force=True)
+        self.assertEqual(bucket.id_, 'd2')
+        self.assertEqual(self.bucket_ids(), ['d2'])
+
+
+class IncrementalDeployTest(AirshipTestCase):
+
+    def make_archive(self, name, members):
+        archive_path = self.tmp / name
+        with tarfile.open(archive_path, 'w') as tar:
+            for member_name, content in members:
+                info = tarfile.TarInfo(member_name)
+                info.size = len(content)
+                tar.addfile(info, StringIO(content))
+        return archive_path
+
+    def test_duplicate_members_dont_change_previous_bucket(self):
+        from airship.deployer import deploy, stage
+        airship = self.create_airship()
+        files = [('Procfile', 'web: ./runweb $PORT\n'),
+                 ('app.py', 'one\n'), ('data', 'x')]
+        old = deploy(airship, self.make_archive('a.tar', files))
+        # like an archive that was appended to with `tar -r`
+        new = stage(airship, self.make_archive('b.tar', files + [
+            ('app.py', 'two\n'), ('data', 'xyz')]), incremental=True)
+        self.assertEqual((old.folder / 'app.py').bytes(), 'one\n')
+        self.assertEqual((old.folder / 'data').bytes(), 'x')
+        self.assertEqual((new.folder / 'app.py').bytes(), 'two\n')
+        self.assertEqual((new.folder / 'data').bytes(), 'xyz')
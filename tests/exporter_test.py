@@ -0,0 +1,83 @@
+import os
+import json
+import socket
+import threading
+from common import AirshipTestCase
+
+
+class ExporterTest(AirshipTestCase):
+
+    def setUp(self):
+        self.airship = self.create_airship({'port_map': {'web': 8000}})
+        bucket = self.airship.new_bucket()
+        bucket.update_metadata(state='running', disk_size=2048)
+        self.airship.registry.set_active(bucket.id_)
+        self.mock_rpc.supervisor.getAllProcessInfo.return_value = [
+            {'group': 'd1-web', 'name': 'd1-web', 'pid': os.getpid(),
+             'statename': 'RUNNING'},
+        ]
+        self.airship.log_path.makedirs_p()
+        with open(self.airship.log_path / 'deploy-stats.log', 'wb') as f:
+            for total in [2, 4]:
+                f.write(json.dumps({'kind': 'deploy', 'total': total,
+                                    'phases': {'extract': 1}}) + '\n')
+
+    def render(self, ttl=10):
+        from airship.exporter import Collector
+        return Collector(self.airship, ttl).render()
+
+    def test_metrics_in_text_exposition_format(self):
+        text = self.render()
+        self.assertIn('# TYPE airship_deploy_duration_seconds summary\n',
+                      text)
+        self.assertIn('airship_deploy_duration_seconds'
+                      '{phase="total",quantile="0.9"} 4.0\n', text)
+        self.assertIn('airship_deploy_duration_seconds_sum'
+                      '{phase="total"} 6.0\n', text)
+        self.assertIn('airship_deploy_duration_seconds_count'
+                      '{phase="extract"} 2.0\n', text)
+        self.assertIn('airship_bucket_disk_bytes'
+                      '{bucket="d1",state="running"} 2048.0\n', text)
+        self.assertIn('airship_bucket_active{bucket="d1"} 1.0\n', text)
+        self.assertIn('airship_process_up{bucket="d1",'
+                      'name="d1-web:d1-web",procname="web"} 1.0\n', text)
+        self.assertIn('airship_process_resident_memory_bytes{', text)
+
+    def test_label_values_are_escaped(self):
+        from airship.exporter import Metrics
+        metrics = Metrics()
+        metrics.add('m', 1, {'l': 'a "b"\\\n'})
+        self.assertEqual(metrics.text(), 'm{l="a \\"b\\"\\\\\\n"} 1.0\n')
+
+    def test_metrics_are_cached_until_ttl_expires(self):
+        from airship.exporter import Collector
+        collector = Collector(self.airship, ttl=60)
+        collector.render()
+        collector.render()
+        self.assertEqual(
+            len(self.mock_rpc.supervisor.getAllProcessInfo.mock_calls), 1)
+        collector._expires = 0
+        collector.render()
+        self.assertEqual(
+            len(self.mock_rpc.supervisor.getAllProcessInfo.mock_calls), 2)
+
+    def test_serves_metrics_on_unix_socket(self):
+        from airship.exporter import make_server
+        server = make_server(self.airship, {'socket': 'var/run/metrics.sock'})
+        responses = []
+
+        def scrape():
+            client = socket.socket(socket.AF_UNIX)
+            client.connect(self.tmp / 'var' / 'run' / 'metrics.sock')
+            client.sendall('GET /metrics HTTP/1.0\r\n\r\n')
+            responses.append(''.join(iter(lambda: client.recv(4096), '')))
+
+        thread = threading.Thread(target=scrape)
+        thread.start()
+        server.handle_request()
+        thread.join()
+        server.server_close()
+        [response] = responses
+        self.assertTrue(response.startswith('HTTP/1.0 200'))
+        self.assertIn('Content-Type: text/plain; version=0.0.4', response)
+        self.assertIn('airship_bucket_active{bucket="d1"} 1.0\n', response)
@@ -0,0 +1,56 @@
+import os
+import sys
+import socket
+import threading
+import subprocess
+from common import AirshipTestCase
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ListenTest(AirshipTestCase):
+
+    def listen(self, port=0):
+        from airship.listen import listen
+        sock = listen('127.0.0.1', port)
+        self.addCleanup(sock.close)
+        return sock
+
+    def test_sockets_on_same_port_can_listen_together(self):
+        first = self.listen()
+        port = first.getsockname()[1]
+        second = self.listen(port)
+        self.assertEqual(second.getsockname()[1], port)
+        socket.create_connection(('127.0.0.1', port), timeout=1).close()
+
+    def test_command_inherits_socket_as_fd_3(self):
+        port = self.listen().getsockname()[1]
+        env = dict(os.environ, PYTHONPATH=REPO)
+        output = subprocess.check_output([
+            sys.executable, '-m', 'airship.listen', '--host', '127.0.0.1',
+            str(port), '/bin/bash', '-c',
+            'echo $LISTEN_FDS $(($LISTEN_PID == $$)); readlink /proc/$$/fd/3',
+        ], env=env)
+        lines = output.splitlines()
+        self.assertEqual(lines[0], "1 1")
+        self.assertTrue(lines[1].startswith('socket:'))
+
+    def test_command_gets_socket_from_holder(self):
+        from airship.sockets import make_server, fetch
+        socket_path = self.tmp / 'sockets.sock'
+        server = make_server(socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        port = self.listen().getsockname()[1]
+        held = fetch(socket_path, '127.0.0.1', port)
+        self.addCleanup(os.close, held)
+        env = dict(os.environ, PYTHONPATH=REPO)
+        output = subprocess.check_output([
+            sys.executable, '-m', 'airship.listen', '--host', '127.0.0.1',
+            '--holder', socket_path, str(port),
+            '/bin/bash', '-c', 'readlink /proc/$$/fd/3',
+        ], env=env)
+        self.assertEqual(output.strip(), 'socket:[%d]' % os.fstat(held).st_ino)
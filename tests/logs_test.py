@@ -0,0 +1,102 @@
+import os
+import re
+import gzip
+from StringIO import StringIO
+from common import AirshipTestCase
+
+
+class LogsTest(AirshipTestCase):
+
+    def setUp(self):
+        self.folder = self.tmp / 'var' / 'log' / 'd1'
+        self.folder.makedirs_p()
+
+    def write(self, name, lines, mtime=None):
+        log_path = self.folder / name
+        log_path.write_text(''.join('%s\n' % l for l in lines))
+        if mtime is not None:
+            os.utime(log_path, (mtime, mtime))
+        return log_path
+
+    def test_tail_reads_last_lines(self):
+        from airship import logs
+        log_path = self.write('web.log', ['line %d' % n for n in range(5000)])
+        self.assertEqual(logs.tail(log_path, 3),
+                         ['line 4997\n', 'line 4998\n', 'line 4999\n'])
+        self.assertEqual(len(logs.tail(log_path, 10000)), 5000)
+
+    def test_log_files_of_process_type_or_instance(self):
+        from airship import logs
+        for name in ['web-0.log', 'web-1.log', 'webhook.log', 'worker.log']:
+            self.write(name, [])
+        names = lambda p: [os.path.basename(f)
+                           for f in logs.log_files(self.folder, p)]
+        self.assertEqual(names('web'), ['web-0.log', 'web-1.log'])
+        self.assertEqual(names('web-1'), ['web-1.log'])
+        self.assertEqual(len(names(None)), 4)
+
+    def test_rotated_segments_are_compressed_and_pruned(self):
+        from airship import logs
+        self.write('web.log', ['current'])
+        for n, mtime in enumerate([3000, 2000, 1000], 1):
+            self.write('web.log.%d' % n, ['segment %d' % n], mtime)
+        self.assertEqual(logs.compress(self.tmp / 'var' / 'log', keep=2), 3)
+        compressed = sorted(f.name for f in self.folder.files('*.gz'))
+        self.assertEqual(len(compressed), 2)
+        self.assertEqual(sorted(f.name for f in self.folder.files()
+                                if not f.name.endswith('.gz')), ['web.log'])
+        newest = gzip.open(self.folder / compressed[-1]).read()
+        self.assertEqual(newest, 'segment 1\n')
+
+    def test_since_reads_segments_written_since_then(self):
+        from airship import logs
+        self.write('web.log.2', ['old'], 1000)
+        self.write('web.log.1', ['middle'], 3000)
+        logs.compress(self.tmp / 'var' / 'log')
+        self.write('web.log.1', ['newer'], 4000)
+        log_path = self.write('web.log', ['current'])
+        out = StringIO()
+        logs.show([log_path], since=2000, out=out)
+        self.assertEqual(out.getvalue(), 'middle\nnewer\ncurrent\n')
+
+    def test_grep_prints_matching_lines(self):
+        from airship import logs
+        log_path = self.write('web.log', ['GET /', 'POST /login', 'GET /a'])
+        out = StringIO()
+        logs.show([log_path], regex=re.compile('^GET', re.M), out=out)
+        self.assertEqual(out.getvalue(), 'GET /\nGET /a\n')
+
+    def test_several_logs_are_prefixed(self):
+        from airship import logs
+        paths = [self.write('web-0.log', ['a']),
+                 self.write('web-1.log', ['b'])]
+        out = StringIO()
+        logs.show(paths, lines=1, out=out)
+        self.assertEqual(out.getvalue(), 'web-0 | a\nweb-1 | b\n')
+
+    def test_follower_continues_across_rotation(self):
+        from airship import logs
+        log_path = self.write('web.log', ['before'])
+        follower = logs.Follower(log_path)
+        with open(log_path, 'ab') as f:
+            f.write('one\ntw')
+        self.assertEqual(follower.read_lines(), ['one\n'])
+        with open(log_path, 'ab') as f:
+            f.write('o\n')
+        log_path.rename(self.folder / 'web.log.1')
+        self.write('web.log', ['three'])
+        self.assertEqual(follower.read_lines(), ['two\n', 'three\n'])
+
+    def test_parse_since(self):
+        from airship.logs import parse_since
+        self.assertEqual(parse_since('90s', now=1000), 910)
+        self.assertEqual(parse_since('2h', now=10000), 2800)
+        with self.assertRaises(ValueError):
+            parse_since('yesterday')
+
+    def test_destroy_trashes_bucket_logs(self):
+        airship = self.create_airship()
+        bucket = airship.new_bucket()
+        bucket.log_folder.makedirs_p()
+        bucket.destroy()
+        self.assertFalse(bucket.log_folder.exists())
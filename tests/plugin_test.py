@@ -3,26 +3,91 @@ from mock import Mock, patch, call, ANY
 from common import AirshipTestCase
 
 
-class PluginTest(AirshipTestCase):
+fake_plugin_calls = []
 
-    def test_plugin_function_called(self):
-        from airship.core import load_plugins
-        airship = Mock()
-        entry_point = Mock()
-        with patch('airship.core._plugin_callbacks', [entry_point]):
-            load_plugins(airship)
-        self.assertEqual(entry_point.mock_calls, [call(airship)])
 
-    @patch('airship.deployer.subprocess')
+def fake_setup(airship, bucket, **extra):
+    pass
+
+
+def fake_plugin(airship):
+    from airship.signals import bucket_setup
+    fake_plugin_calls.append(airship)
+    bucket_setup.connect(fake_setup, airship)
+
+
+def fake_command_plugin(airship):
+    from airship.signals import define_arguments
+
+    @define_arguments.connect
+    def register(sender, create_command):
+        create_command('fake', Mock())
+
+    fake_command_plugin.register = register  # keep a strong reference
+
+
+class PluginRegistryTest(AirshipTestCase):
+
+    def setUp(self):
+        from airship.plugins import PluginRegistry
+        self.registry = PluginRegistry()
+        self.cache_path = self.tmp / 'var' / 'cache' / 'plugins.json'
+        fake_plugin_calls[:] = []
+        entry_point = Mock(module_name='plugin_test', attrs=('fake_plugin',))
+        entry_point.name = 'fake'
+        self.iter_entry_points = self.patch('pkg_resources.iter_entry_points')
+        self.iter_entry_points.return_value = [entry_point]
+
+    def test_scan_records_signals_of_plugin(self):
+        airship = self.create_airship()
+        self.registry.setup(airship, self.cache_path)
+        self.assertEqual(self.registry.plugins['fake'], {
+            'entry_point': 'plugin_test:fake_plugin',
+            'signals': ['bucket_setup'],
+            'commands': [],
+        })
+        self.assertEqual(fake_plugin_calls, [airship])
+
+    def test_scan_records_commands_of_plugin(self):
+        entry_point = Mock(module_name='plugin_test',
+                           attrs=('fake_command_plugin',))
+        entry_point.name = 'fake'
+        self.iter_entry_points.return_value = [entry_point]
+        self.registry.setup(self.create_airship(), self.cache_path)
+        self.assertEqual(self.registry.plugins['fake']['commands'], ['fake'])
+
+    def test_cached_plugin_is_loaded_when_its_signal_is_sent(self):
+        from airship.signals import bucket_setup
+        self.registry.setup(self.create_airship(), self.cache_path)
+        self.iter_entry_points.reset_mock()
+        airship = self.create_airship()
+        with patch('airship.plugins.registry', self.registry):
+            self.registry.setup(airship, self.cache_path)
+            self.assertEqual(self.iter_entry_points.mock_calls, [])
+            self.assertEqual(len(fake_plugin_calls), 1)
+            bucket_setup.send(airship, bucket=Mock())
+        self.assertEqual(fake_plugin_calls[1:], [airship])
+
+    def test_cache_is_rebuilt_when_sys_path_changes(self):
+        self.registry.setup(self.create_airship(), self.cache_path)
+        self.iter_entry_points.reset_mock()
+        with patch('airship.plugins.path_fingerprint', Mock(return_value='x')):
+            self.registry.setup(self.create_airship(), self.cache_path)
+        self.assertEqual(len(self.iter_entry_points.mock_calls), 1)
+
+    @patch('airship.deployer.stop_running_buckets')
+    @patch('airship.deployer.archive')
     @patch('airship.deployer.bucket_setup')
     @patch('airship.deployer.remove_old_buckets')
-    def test_deploy_sends_bucket_setup_signal(self, subprocess,
+    def test_deploy_sends_bucket_setup_signal(self, archive,
                                                     bucket_setup,
-                                                    remove_old_buckets):
+                                                    remove_old_buckets,
+                                                    stop_running_buckets):
         from airship.deployer import deploy
-        airship = Mock()
+        airship = Mock(config={}, log_path=self.tmp / 'log')
         bucket = airship.new_bucket.return_value
-        deploy(airship, Mock())
+        bucket.id_ = 'd1'
+        deploy(airship, Mock(), force=True)
         self.assertEqual(bucket_setup.send.mock_calls,
                          [call(airship, bucket=bucket)])
 
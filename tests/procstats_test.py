@@ -0,0 +1,75 @@
+import os
+import time
+from common import AirshipTestCase
+
+
+class ProcStatsTest(AirshipTestCase):
+
+    def test_sample_reads_memory_cpu_and_start_time(self):
+        from airship.procstats import sample
+        current = sample(os.getpid())
+        self.assertEqual(current.pid, os.getpid())
+        self.assertGreater(current.rss, 1024 * 1024)
+        self.assertGreater(current.cpu, 0)
+        self.assertLess(current.started, time.time())
+        self.assertGreater(current.started, time.time() - 24 * 3600)
+
+    def test_sample_includes_child_processes(self):
+        import sys
+        import subprocess
+        from airship.procstats import sample, descendants
+        script = 'x = "a" * 64 * 1024 * 1024; import time; time.sleep(30)'
+        shell = subprocess.Popen(['/bin/bash', '-c', '%s -c %r; true'
+                                  % (sys.executable, script)])
+        self.addCleanup(shell.wait)
+        self.addCleanup(shell.kill)
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            children = descendants(shell.pid)
+            if children and sample(children[0]).rss > 64 * 1024 * 1024:
+                break
+            time.sleep(.1)
+        self.assertEqual(len(children), 1)
+        self.addCleanup(os.kill, children[0], 9)
+        current = sample(shell.pid)
+        self.assertEqual(current.pid, shell.pid)
+        self.assertGreater(current.rss, 64 * 1024 * 1024)
+        self.assertGreaterEqual(current.cpu, sample(children[0]).cpu)
+
+    def test_memory_shared_with_forked_workers_is_counted_once(self):
+        import sys
+        import subprocess
+        from airship.procstats import sample, descendants
+        size = 64 * 1024 * 1024
+        script = ('import os, time\n'
+                  'x = "a" * %d\n'
+                  'for n in range(3):\n'
+                  '    if os.fork() == 0:\n'
+                  '        break\n'
+                  'time.sleep(30)\n' % size)
+        master = subprocess.Popen([sys.executable, '-c', script])
+        self.addCleanup(master.wait)
+        self.addCleanup(master.kill)
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            workers = descendants(master.pid)
+            if len(workers) == 3:
+                break
+            time.sleep(.1)
+        for worker in workers:
+            self.addCleanup(os.kill, worker, 9)
+        memory = sample(master.pid).rss
+        self.assertGreater(memory, size)
+        self.assertLess(memory, 2 * size)
+
+    def test_sample_of_missing_process_is_none(self):
+        from airship.procstats import sample
+        self.assertIsNone(sample(2 ** 22 + 1))
+
+    def test_cpu_percent_between_samples(self):
+        from airship.procstats import Sample, cpu_percent
+        first = Sample(pid=5, time=100, rss=0, cpu=10, started=1)
+        second = Sample(pid=5, time=110, rss=0, cpu=15, started=1)
+        self.assertEqual(cpu_percent(first, second), 50)
+        restarted = second._replace(started=105)
+        self.assertIsNone(cpu_percent(first, restarted))
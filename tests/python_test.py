@@ -1,3 +1,4 @@
+import os
 from mock import Mock
 from common import AirshipTestCase
 
@@ -63,3 +64,331 @@ class RunTest(AirshipTestCase):
             bucket.run('hello world')
         path_0 = calls[0].environ['PATH'].split(':')[0]
         self.assertEqual(path_0, venv / 'bin')
+
+
+class VirtualenvCacheTest(AirshipTestCase):
+
+    def setUp(self):
+        self.subprocess = self.patch('airship.contrib.python.subprocess')
+        self.subprocess.check_call.side_effect = self.fake_check_call
+        (self.tmp / 'dist').mkdir()
+        self.airship = self.create_airship(
+            {'python': {'dist': self.tmp / 'dist'}})
+
+    def fake_check_call(self, args):
+        if args[1].endswith('virtualenv.py'):
+            (args[2] / 'bin').makedirs()
+            (args[2] / 'bin' / 'python').write_text('#!/bin/sh\n')
+
+    def deploy_bucket(self, requirements="foo==1.0\n"):
+        from airship.contrib.python import set_up_virtualenv_and_requirements
+        bucket = self.airship.new_bucket()
+        (bucket.folder / 'requirements.txt').write_text(requirements)
+        set_up_virtualenv_and_requirements(self.airship, bucket)
+        return bucket
+
+    def test_virtualenv_is_linked_from_cache(self):
+        bucket = self.deploy_bucket()
+        venv = bucket.folder / '_virtualenv'
+        self.assertTrue(venv.islink())
+        cache_folder = self.tmp / 'var' / 'cache' / 'virtualenv'
+        self.assertEqual(venv.realpath().parent, cache_folder.realpath())
+
+    def test_unchanged_requirements_reuse_cached_virtualenv(self):
+        bucket_1 = self.deploy_bucket()
+        self.subprocess.reset_mock()
+        bucket_2 = self.deploy_bucket()
+        self.assertEqual(self.subprocess.check_call.mock_calls, [])
+        self.assertEqual((bucket_1.folder / '_virtualenv').realpath(),
+                         (bucket_2.folder / '_virtualenv').realpath())
+
+    def test_changed_requirements_build_new_virtualenv(self):
+        bucket_1 = self.deploy_bucket()
+        self.subprocess.reset_mock()
+        bucket_2 = self.deploy_bucket("foo==2.0\n")
+        self.assertEqual(len(self.subprocess.check_call.mock_calls), 3)
+        self.assertNotEqual((bucket_1.folder / '_virtualenv').realpath(),
+                            (bucket_2.folder / '_virtualenv').realpath())
+
+    def test_prune_evicts_least_recently_used_unused_entries(self):
+        from airship.contrib.python import venv_cache
+        bucket_1 = self.deploy_bucket("foo==1.0\n")
+        bucket_2 = self.deploy_bucket("foo==2.0\n")
+        bucket_3 = self.deploy_bucket("foo==3.0\n")
+        key_1 = (bucket_1.folder / '_virtualenv').realpath().name
+        key_3 = (bucket_3.folder / '_virtualenv').realpath().name
+        bucket_2.destroy()
+        bucket_3.destroy()
+        evicted = venv_cache(self.airship).prune(in_use=[key_1], max_size=0)
+        self.assertNotIn(key_1, evicted)
+        self.assertIn(key_3, evicted)
+        self.assertEqual(len(evicted), 2)
+
+    def test_prune_skips_locked_entries(self):
+        from airship.contrib.python import venv_cache
+        bucket_1 = self.deploy_bucket("foo==1.0\n")
+        bucket_2 = self.deploy_bucket("foo==2.0\n")
+        key_1 = (bucket_1.folder / '_virtualenv').realpath().name
+        key_2 = (bucket_2.folder / '_virtualenv').realpath().name
+        bucket_1.destroy()
+        bucket_2.destroy()
+        cache = venv_cache(self.airship)
+        building = cache.folder / 'building'
+        building.makedirs()
+        with cache.lock(key_2), cache.lock('building'):
+            evicted = cache.prune(max_size=0)
+        self.assertEqual(evicted, [key_1])
+        self.assertTrue((cache.folder / key_2).isdir())
+        self.assertTrue(building.isdir())
+
+
+class PrecompileTest(AirshipTestCase):
+
+    def setUp(self):
+        self.app = self.tmp / 'app'
+        (self.app / 'pkg' / 'tests').makedirs()
+        (self.app / 'pkg' / '__init__.py').write_text('')
+        (self.app / 'pkg' / 'views.py').write_text('X = 1\n')
+        (self.app / 'pkg' / 'tests' / 'test_views.py').write_text('')
+        (self.app / 'pkg' / 'broken.py').write_text('def (\n')
+        (self.app / 'README').write_text('')
+
+    def test_find_sources_applies_include_and_exclude_globs(self):
+        from airship.contrib.python.precompile import find_sources
+        found = find_sources(self.app, ['*.py'], ['*/tests/*', '*/broken.py'])
+        self.assertItemsEqual(found, [self.app / 'pkg' / '__init__.py',
+                                      self.app / 'pkg' / 'views.py'])
+
+    def test_compile_files_writes_bytecode_and_counts_failures(self):
+        import sys
+        from airship.contrib.python.precompile import (find_sources,
+                                                       compile_files)
+        sources = find_sources(self.app)
+        failed = compile_files(sys.executable, sources, workers=3)
+        self.assertEqual(failed, 1)
+        self.assertTrue((self.app / 'pkg' / 'views.pyc').isfile())
+        self.assertTrue((self.app / 'pkg' / 'tests' /
+                         'test_views.pyc').isfile())
+
+    def test_bucket_setup_compiles_bucket(self):
+        import sys
+        from airship.contrib.python import set_up_bucket
+        airship = self.create_airship({'python': {
+            'interpreter': sys.executable,
+            'precompile_exclude': ['app/pkg/tests/*'],
+        }})
+        bucket = airship.new_bucket()
+        self.app.rename(bucket.folder / 'app')
+        set_up_bucket(airship, bucket)
+        pkg = bucket.folder / 'app' / 'pkg'
+        self.assertTrue((pkg / 'views.pyc').isfile())
+        self.assertFalse((pkg / 'tests' / 'test_views.pyc').isfile())
+
+    def test_precompile_can_be_disabled(self):
+        from airship.contrib.python import precompile_bucket
+        airship = self.create_airship({'python': {'precompile': False}})
+        bucket = airship.new_bucket()
+        self.app.rename(bucket.folder / 'app')
+        precompile_bucket(airship, bucket)
+        compiled = bucket.folder / 'app' / 'pkg' / 'views.pyc'
+        self.assertFalse(compiled.isfile())
+
+
+def make_wheel(folder, name, version, files, requires=(), entry_points=None):
+    import zipfile
+    dist_info = '%s-%s.dist-info' % (name, version)
+    files = dict(files)
+    files[dist_info + '/WHEEL'] = ('Wheel-Version: 1.0\n'
+                                   'Root-Is-Purelib: true\n')
+    files[dist_info + '/METADATA'] = (
+        'Metadata-Version: 2.0\nName: %s\nVersion: %s\n' % (name, version) +
+        ''.join('Requires-Dist: %s\n' % r for r in requires))
+    if entry_points is not None:
+        files[dist_info + '/entry_points.txt'] = entry_points
+    files[dist_info + '/RECORD'] = ''
+    wheel_path = folder / ('%s-%s-py2.py3-none-any.whl' % (name, version))
+    with zipfile.ZipFile(wheel_path, 'w') as wheel:
+        for member, data in sorted(files.items()):
+            wheel.writestr(member, data)
+    return wheel_path
+
+
+class DirectWheelInstallTest(AirshipTestCase):
+
+    def setUp(self):
+        self.dist = self.tmp / 'dist'
+        self.dist.mkdir()
+        self.venv = self.tmp / 'venv'
+        self.paths = dict((key, self.venv / folder) for key, folder in [
+            ('purelib', 'lib'), ('platlib', 'lib'), ('scripts', 'bin'),
+            ('data', ''), ('include', 'include')])
+        make_wheel(self.dist, 'foo', '1.0', {
+            'foo/__init__.py': 'X = 1\n',
+            'foo-1.0.data/scripts/foo-tool': '#!python\nprint 1\n',
+            'foo-1.0.data/data/share/foo.txt': 'hi',
+        }, requires=['bar (>=2.0)', 'baz; extra == "test"'],
+           entry_points='[console_scripts]\nfoo = foo.cli:main\n')
+        make_wheel(self.dist, 'Bar', '2.0', {'bar.py': ''})
+        (self.dist / 'native-1.0-cp27-cp27mu-linux_x86_64.whl').write_text('')
+        self.requirements = self.tmp / 'requirements.txt'
+
+    def resolve(self, requirements):
+        from airship.contrib.python.wheels import resolve
+        self.requirements.write_text(requirements)
+        return resolve(self.requirements, self.dist, [2, 7])
+
+    def test_pinned_requirements_resolve_to_wheels(self):
+        found, leftover = self.resolve('foo==1.0\nbar==2.0  # comment\n'
+                                       'native==1.0\nother>=3\n')
+        self.assertEqual(sorted(w.name for w in found),
+                         ['Bar-2.0-py2.py3-none-any.whl',
+                          'foo-1.0-py2.py3-none-any.whl'])
+        self.assertEqual(leftover, ['native==1.0', 'other>=3'])
+
+    def test_unpinned_dependency_leaves_everything_to_pip(self):
+        found, leftover = self.resolve('foo==1.0\n')
+        self.assertEqual(found, [])
+        self.assertEqual(leftover, ['foo==1.0'])
+
+    def test_pip_options_leave_everything_to_pip(self):
+        found, leftover = self.resolve('--no-deps\nbar==2.0\n')
+        self.assertEqual(found, [])
+
+    def test_install_unpacks_data_scripts_and_record(self):
+        from airship.contrib.python.wheels import install_wheels
+        found, leftover = self.resolve('foo==1.0\nbar==2.0\n')
+        install_wheels(found, self.paths, '/venv/bin/python')
+        self.assertEqual((self.venv / 'lib' / 'foo' / '__init__.py').text(),
+                         'X = 1\n')
+        self.assertTrue((self.venv / 'lib' / 'bar.py').isfile())
+        self.assertEqual((self.venv / 'share' / 'foo.txt').text(), 'hi')
+        tool = self.venv / 'bin' / 'foo-tool'
+        self.assertEqual(tool.text(), '#!/venv/bin/python\nprint 1\n')
+        self.assertTrue(os.access(tool, os.X_OK))
+        console_script = (self.venv / 'bin' / 'foo').text()
+        self.assertTrue(console_script.startswith('#!/venv/bin/python\n'))
+        self.assertIn('from foo.cli import main\n', console_script)
+        record = (self.venv / 'lib' / 'foo-1.0.dist-info' / 'RECORD').lines()
+        self.assertIn('foo/__init__.py,sha256=', ''.join(record))
+        self.assertIn('../bin/foo,sha256=', ''.join(record))
+        self.assertIn('foo-1.0.dist-info/RECORD,,\n', record)
+
+    def test_build_virtualenv_uses_pip_only_for_leftovers(self):
+        from airship.contrib import python
+        subprocess = self.patch('airship.contrib.python.subprocess')
+        target_info = self.patch('airship.contrib.python.wheels.target_info')
+        target_info.return_value = {'version': [2, 7], 'paths': self.paths}
+        airship = self.create_airship({'python': {'dist': self.dist}})
+        self.requirements.write_text('foo==1.0\nbar==2.0\nother==3\n')
+        pip_requirements = []
+        subprocess.check_call.side_effect = lambda args: (
+            pip_requirements.append(open(args[3]).read())
+            if '-r' in args else None)
+        python.build_virtualenv(airship, Mock(), self.venv, self.requirements)
+        self.assertTrue((self.venv / 'lib' / 'foo' / '__init__.py').isfile())
+        self.assertEqual(pip_requirements, ['other==3\n'])
+
+
+class WheelhouseTest(AirshipTestCase):
+
+    def setUp(self):
+        from airship.contrib.python.wheelhouse import Wheelhouse
+        self.dist = self.tmp / 'dist'
+        self.dist.mkdir()
+        (self.dist / 'Foo_Bar-1.0-py2-none-any.whl').write_text('foo')
+        (self.dist / 'baz-2.0.tar.gz').write_text('baz')
+        self.wheelhouse = Wheelhouse(self.dist)
+
+    def test_update_writes_simple_index_and_manifest(self):
+        import hashlib
+        self.wheelhouse.update()
+        root = (self.dist / 'simple' / 'index.html').text()
+        self.assertIn('<a href="foo-bar/">foo-bar</a>', root)
+        self.assertIn('<a href="baz/">baz</a>', root)
+        page = (self.dist / 'simple' / 'foo-bar' / 'index.html').text()
+        sha = hashlib.sha256('foo').hexdigest()
+        self.assertIn('href="../../Foo_Bar-1.0-py2-none-any.whl#sha256=%s"'
+                      % sha, page)
+        manifest = self.wheelhouse.manifest()
+        self.assertEqual(manifest['baz-2.0.tar.gz']['project'], 'baz')
+        self.assertEqual(manifest['Foo_Bar-1.0-py2-none-any.whl']['sha256'],
+                         sha)
+
+    def test_update_only_hashes_new_files(self):
+        from mock import patch
+        self.wheelhouse.update()
+        (self.dist / 'qux-1.0-py2-none-any.whl').write_text('qux')
+        with patch('airship.contrib.python.wheelhouse._sha256') as sha256:
+            sha256.return_value = 'abc'
+            self.assertEqual(self.wheelhouse.update(), set(['qux']))
+        self.assertEqual(len(sha256.mock_calls), 1)
+        self.assertTrue((self.dist / 'simple' / 'qux' / 'index.html').isfile())
+
+    def test_removed_files_are_dropped_from_index(self):
+        self.wheelhouse.update()
+        (self.dist / 'baz-2.0.tar.gz').unlink()
+        self.assertEqual(self.wheelhouse.update(), set(['baz']))
+        self.assertFalse((self.dist / 'simple' / 'baz').exists())
+        self.assertNotIn('baz', (self.dist / 'simple' / 'index.html').text())
+
+    def test_wheelhouse_is_stale_until_updated(self):
+        self.assertTrue(self.wheelhouse.is_stale())
+        self.wheelhouse.update()
+        self.assertFalse(self.wheelhouse.is_stale())
+
+
+class WheelBuildTest(AirshipTestCase):
+
+    def setUp(self):
+        self.dist = self.tmp / 'dist'
+        self.dist.mkdir()
+        make_wheel(self.dist, 'foo', '1.0', {})
+        self.airship = self.create_airship({'python': {'dist': self.dist}})
+        self.requirements = self.tmp / 'requirements.txt'
+        self.requirements.write_text('foo==1.0\nbar==2.0\nbaz>=1\n')
+        self.call = self.patch('airship.contrib.python.wheelbuild'
+                               '.subprocess.call')
+        self.call.side_effect = self.fake_pip_wheel
+
+    def fake_pip_wheel(self, args, stdout, stderr):
+        line = args[-1]
+        stdout.write('building %s\n' % line)
+        if line == 'bar==2.0':
+            make_wheel(self.dist, 'bar', '2.0', {})
+            return 0
+        return 1
+
+    def run_wheel(self):
+        from StringIO import StringIO
+        from mock import patch
+        from airship.contrib import python
+        args = Mock(requirements=self.requirements, jobs=2)
+        with patch('sys.stdout', StringIO()) as stdout:
+            with self.assertRaises(SystemExit):
+                python.do_wheel(self.airship, args)
+        return stdout.getvalue()
+
+    def test_builds_only_missing_wheels_and_summarizes(self):
+        output = self.run_wheel()
+        built = sorted(c[0][0][-1] for c in self.call.call_args_list)
+        self.assertEqual(built, ['bar==2.0', 'baz>=1'])
+        self.assertIn("1 built, 1 skipped, 1 failed", output)
+        log = self.tmp / 'var' / 'log' / 'wheel' / 'baz-1.log'
+        self.assertIn("Failed to build baz>=1, see %s" % log, output)
+        self.assertEqual(log.text(), 'building baz>=1\n')
+
+    def test_each_build_gets_its_own_build_folder(self):
+        self.run_wheel()
+        build_dirs = [c[0][0][c[0][0].index('--build') + 1]
+                      for c in self.call.call_args_list]
+        self.assertEqual(len(set(build_dirs)), 2)
+        for build_dir in build_dirs:
+            self.assertFalse(os.path.exists(build_dir))
+
+    def test_built_wheels_are_added_to_index(self):
+        self.run_wheel()
+        self.assertTrue((self.dist / 'simple' / 'bar' / 'index.html').isfile())
+        self.call.reset_mock()
+        self.run_wheel()
+        self.assertEqual([c[0][0][-1] for c in self.call.call_args_list],
+                         ['baz>=1'])
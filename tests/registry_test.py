@@ -0,0 +1,66 @@
+from common import AirshipTestCase
+
+
+class BucketRegistryTest(AirshipTestCase):
+
+    def test_newest_bucket_is_found_by_number(self):
+        airship = self.create_airship()
+        airship.meta_db['next_bucket_id'] = 9
+        airship.new_bucket()
+        airship.new_bucket()
+        self.assertEqual(airship.get_bucket().id_, 'd10')
+
+    def test_active_bucket_is_returned_instead_of_newest(self):
+        airship = self.create_airship()
+        bucket_1 = airship.new_bucket()
+        bucket_1.start()
+        airship.new_bucket()
+        self.assertEqual(airship.get_bucket().id_, bucket_1.id_)
+
+    def test_bucket_state_follows_start_and_stop(self):
+        airship = self.create_airship()
+        bucket = airship.new_bucket()
+        self.assertEqual(airship.registry.get(bucket.id_)['state'], 'staged')
+        bucket.start()
+        record = airship.registry.get(bucket.id_)
+        self.assertEqual(record['state'], 'running')
+        self.assertIsNotNone(record['activated'])
+        bucket.stop()
+        self.assertEqual(airship.registry.get(bucket.id_)['state'], 'stopped')
+
+    def test_listing_contains_metadata(self):
+        airship = self.create_airship()
+        bucket_1 = airship.new_bucket()
+        bucket_1.update_metadata(archive_hash='abc', disk_size=13)
+        bucket_1.start()
+        bucket_2 = airship.new_bucket()
+        [info_1, info_2] = airship.list_buckets()['buckets']
+        self.assertEqual(info_1['id'], 'd1')
+        self.assertEqual(info_1['archive_hash'], 'abc')
+        self.assertEqual(info_1['disk_size'], 13)
+        self.assertEqual(info_1['state'], 'running')
+        self.assertTrue(info_1['active'])
+        self.assertEqual(info_2['state'], 'staged')
+        self.assertFalse(info_2['active'])
+
+    def test_destroying_active_bucket_clears_pointer(self):
+        airship = self.create_airship()
+        bucket = airship.new_bucket()
+        bucket.start()
+        bucket.destroy()
+        self.assertIsNone(airship.registry.get_active())
+
+    def test_extra_metadata_is_kept_in_bucket_config(self):
+        airship = self.create_airship()
+        bucket = airship.new_bucket()
+        bucket.update_metadata(ports={'web': 8001})
+        self.assertEqual(airship.get_bucket(bucket.id_).config,
+                         {'ports': {'web': 8001}})
+
+    def test_buckets_from_key_value_table_are_imported(self):
+        from kv import KV
+        KV(self.tmp / 'etc' / 'buckets.db', table='bucket')['d3'] = {}
+        airship = self.create_airship()
+        self.assertEqual([r['id'] for r in airship.registry.records()],
+                         ['d3'])
+        self.assertEqual(airship.get_bucket().id_, 'd3')
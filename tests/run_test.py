@@ -37,6 +37,19 @@ class MockProcessTest(AirshipTestCase):
             bucket.run('thing')
         self.assertEqual(calls[0].environ['PORT'], '13')
 
+    def test_run_starts_socket_activated_process_through_listen(self):
+        import sys
+        bucket = self.create_airship({'port_map': {'web': 13},
+                                      'socket_activation': ['web']}
+                                     ).new_bucket()
+        bucket.process_types = {'web': "serve"}
+        with mock_exec() as calls:
+            bucket.run('web')
+        self.assertEqual(calls[0].args, [
+            sys.executable, '-m', 'airship.listen', '--host', '0.0.0.0',
+            '--holder', self.tmp / 'var' / 'run' / 'sockets.sock',
+            '13', '/bin/bash', '-c', "serve"])
+
     def test_run_starts_process_from_list(self):
         THING_PROC = "run the 'thing' process"
         bucket = self.create_airship().new_bucket()
@@ -44,3 +57,99 @@ class MockProcessTest(AirshipTestCase):
         with mock_exec() as calls:
             bucket.run('thing')
         self.assertEqual(calls[0].args[-1], THING_PROC)
+
+
+class LauncherTest(AirshipTestCase):
+
+    def write_launcher(self, config, command="./serve $PORT"):
+        bucket = self.create_airship(config).new_bucket()
+        bucket.process_types = {'web': command}
+        bucket.write_launchers()
+        return bucket, bucket.launcher_path('web')
+
+    def test_launcher_exports_config_env_and_port(self):
+        bucket, launcher = self.write_launcher({
+            'env': {'GREETING': "hello there!"},
+            'port_map': {'web': 13},
+        })
+        script = launcher.text()
+        self.assertIn("export GREETING='hello there!'\n", script)
+        self.assertIn('export PROCESS_INDEX="${1:-0}"\n', script)
+        self.assertIn("export PORT=$((13 + PROCESS_INDEX))\n", script)
+        self.assertIn("cd %s\n" % bucket.folder, script)
+        self.assertTrue(script.endswith("exec /bin/bash -c './serve $PORT'\n"))
+
+    def test_launcher_exports_env_equal_to_airship_environment(self):
+        from airship.core import bucket_run
+
+        def set_lang(airship, bucket, environ):
+            environ['LC_ALL'] = 'C'
+
+        with patch.dict('os.environ', {'LANG': 'C', 'LC_ALL': 'C'}):
+            with bucket_run.connected_to(set_lang):
+                bucket, launcher = self.write_launcher({'env': {'LANG': 'C'}})
+        script = launcher.text()
+        self.assertIn("export LANG=C\n", script)
+        self.assertIn("export LC_ALL=C\n", script)
+        self.assertNotIn("export HOME=", script)
+
+    def test_launcher_extends_path_instead_of_replacing_it(self):
+        from airship.core import bucket_run
+
+        def add_venv(airship, bucket, environ):
+            environ['PATH'] = '/venv/bin:' + environ['PATH']
+
+        with bucket_run.connected_to(add_venv):
+            bucket, launcher = self.write_launcher({})
+        self.assertIn('export PATH=/venv/bin:"$PATH"\n', launcher.text())
+
+    def test_launcher_runs_command_with_environment(self):
+        import subprocess
+        bucket, launcher = self.write_launcher(
+            {'env': {'GREETING': "hi"}, 'port_map': {'web': 13}},
+            command='echo "$GREETING $PORT `pwd`"')
+        output = subprocess.check_output([launcher])
+        self.assertEqual(output, "hi 13 %s\n" % bucket.folder)
+
+    def test_launcher_offsets_port_by_instance_number(self):
+        import subprocess
+        bucket, launcher = self.write_launcher(
+            {'port_map': {'web': 13}}, command='echo "$PROCESS_INDEX $PORT"')
+        output = subprocess.check_output([launcher, '2'])
+        self.assertEqual(output, "2 15\n")
+
+    def test_launcher_passes_listening_socket_with_socket_activation(self):
+        import subprocess
+        import threading
+        from airship.sockets import make_server
+        bucket, launcher = self.write_launcher(
+            {'port_map': {'web': 0}, 'socket_activation': ['web'],
+             'socket_host': '127.0.0.1'},
+            command='echo $LISTEN_FDS; readlink /proc/$$/fd/3')
+        self.assertIn(' -m airship.listen --host 127.0.0.1 --holder %s '
+                      '"$PORT" /bin/bash -c ' % bucket.airship.sockets_path,
+                      launcher.text())
+        server = make_server(bucket.airship.sockets_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output(
+            [launcher], env=dict(os.environ, PYTHONPATH=repo))
+        self.assertEqual(output.splitlines()[0], "1")
+        [held] = server.holder.sockets.values()
+        self.assertEqual(output.splitlines()[1],
+                         'socket:[%d]' % os.fstat(held.fileno()).st_ino)
+
+    def test_launcher_sets_notify_socket_of_instance(self):
+        bucket, launcher = self.write_launcher({'notify_ready': ['web']})
+        self.assertIn('export NOTIFY_SOCKET=%s/web-"$PROCESS_INDEX"\n'
+                      % (self.tmp / 'var' / 'run' / 'notify' / bucket.id_),
+                      launcher.text())
+
+    def test_destroy_removes_launchers(self):
+        bucket, launcher = self.write_launcher({})
+        bucket.destroy()
+        self.assertFalse(launcher.exists())
@@ -35,6 +35,73 @@ class ShellTest(AirshipTestCase):
         imp('airship.core').main([str(self.tmp), 'run', 'some', 'other thing'])
         self.assertEqual(run.mock_calls, [call("some 'other thing'")])
 
+    def test_crashloop_reset_starts_parked_processes(self):
+        from airship.crashloop import CrashLoop
+        airship = self.create_airship()
+        (self.tmp / 'var' / 'run').makedirs_p()
+        tracker = CrashLoop(self.tmp / 'var' / 'run' / 'crashloop.json')
+        tracker.save({'d1-web:d1-web': {'parked': True},
+                      'd1-worker:d1-worker': {'parked': False}})
+        with patch('sys.stdout', StringIO()):
+            imp('airship.core').main([str(self.tmp), 'crashloop', '--reset'])
+        self.assertEqual(self.mock_rpc.supervisor.startProcess.mock_calls,
+                         [call('d1-web:d1-web')])
+        self.assertEqual(tracker.load(), {})
+
+    @patch('airship.core.Bucket.start')
+    def test_scale_stores_concurrency_and_restarts_bucket(self, start):
+        airship = self.create_airship()
+        bucket = airship.new_bucket()
+        (bucket.folder / 'Procfile').write_text('web: ./runweb $PORT\n')
+        airship.registry.update(bucket.id_, state='running')
+        imp('airship.core').main([str(self.tmp), 'scale', 'web=5'])
+        bucket = airship.get_bucket(bucket.id_)
+        self.assertEqual(bucket.instances('web'), 5)
+        self.assertEqual(start.mock_calls, [call()])
+
+    @patch('airship.core.Bucket.start')
+    def test_scale_rejects_counts_below_one(self, start):
+        airship = self.create_airship()
+        bucket = airship.new_bucket()
+        (bucket.folder / 'Procfile').write_text('web: ./runweb $PORT\n')
+        airship.registry.update(bucket.id_, state='running')
+        for count in ['0', '-2', 'many']:
+            with patch('sys.stdout', StringIO()) as stdout:
+                imp('airship.core').main([str(self.tmp), 'scale',
+                                          'web=' + count])
+            self.assertIn("Invalid count", stdout.getvalue())
+        bucket = airship.get_bucket(bucket.id_)
+        self.assertEqual(bucket.instances('web'), 1)
+        self.assertEqual(start.mock_calls, [])
+
+    @patch('airship.core.Bucket.start')
+    def test_scale_rejects_malformed_arguments(self, start):
+        airship = self.create_airship()
+        bucket = airship.new_bucket()
+        (bucket.folder / 'Procfile').write_text('web: ./runweb $PORT\n')
+        for item in ['web', 'web:3']:
+            with patch('sys.stdout', StringIO()) as stdout:
+                imp('airship.core').main([str(self.tmp), 'scale', item])
+            self.assertIn("Expected PROCNAME=COUNT", stdout.getvalue())
+        self.assertEqual(start.mock_calls, [])
+
+    @patch('airship.core.Bucket.start')
+    def test_scale_rejects_overlapping_port_ranges(self, start):
+        (self.tmp / 'etc' / 'airship.yaml').write_text(json.dumps(
+            {'port_map': {'web': 8000, 'worker': 8002}}))
+        airship = self.create_airship()
+        bucket = airship.new_bucket()
+        (bucket.folder / 'Procfile').write_text('web: ./runweb $PORT\n'
+                                                'worker: ./work $PORT\n')
+        airship.registry.update(bucket.id_, state='running')
+        with patch('sys.stdout', StringIO()) as stdout:
+            imp('airship.core').main([str(self.tmp), 'scale', 'web=3'])
+        self.assertIn("port 8002", stdout.getvalue())
+        self.assertEqual(airship.get_bucket(bucket.id_).instances('web'), 1)
+        imp('airship.core').main([str(self.tmp), 'scale', 'web=2'])
+        self.assertEqual(airship.get_bucket(bucket.id_).instances('web'), 2)
+        self.assertEqual(start.mock_calls, [call()])
+
     @patch('airship.core.Airship.list_buckets')
     def test_destroy_bucket_calls_api_method(self, list_buckets):
         data = {'some': ['json', 'data']}
@@ -0,0 +1,79 @@
+import os
+import socket
+import threading
+from common import HandyTestCase
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class SocketHolderTest(HandyTestCase):
+
+    def start_holder(self):
+        from airship.sockets import make_server
+        socket_path = self.tmp / 'sockets.sock'
+        server = make_server(socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return socket_path
+
+    def fetch(self, socket_path, port):
+        from airship.sockets import fetch
+        fd = fetch(socket_path, '127.0.0.1', port, timeout=1)
+        self.addCleanup(os.close, fd)
+        return fd
+
+    def test_every_client_gets_the_same_socket(self):
+        socket_path = self.start_holder()
+        port = free_port()
+        first = self.fetch(socket_path, port)
+        second = self.fetch(socket_path, port)
+        self.assertNotEqual(first, second)
+        self.assertEqual(os.fstat(first).st_ino, os.fstat(second).st_ino)
+
+    def test_port_stays_open_without_clients(self):
+        socket_path = self.start_holder()
+        from airship.sockets import fetch
+        port = free_port()
+        os.close(fetch(socket_path, '127.0.0.1', port))
+        client = socket.create_connection(('127.0.0.1', port), timeout=1)
+        client.close()
+
+    def test_missing_holder_raises_socket_error(self):
+        from airship.sockets import fetch
+        with self.assertRaises(socket.error):
+            fetch(self.tmp / 'nothing.sock', '127.0.0.1', 0, timeout=0)
+
+
+class ReadyNotificationsTest(HandyTestCase):
+
+    def notify(self, socket_path, message):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.sendto(message, socket_path)
+        sock.close()
+
+    def test_ready_once_every_socket_is_notified(self):
+        from airship.sockets import ReadyNotifications
+        paths = [self.tmp / 'notify' / 'web-0', self.tmp / 'notify' / 'web-1']
+        notifications = ReadyNotifications(paths)
+        self.addCleanup(notifications.close)
+        self.notify(paths[0], 'STATUS=booting')
+        self.assertFalse(notifications.receive(0.1))
+        self.notify(paths[0], 'READY=1\nSTATUS=serving')
+        self.assertFalse(notifications.receive(0.1))
+        self.notify(paths[1], 'READY=1')
+        self.assertTrue(notifications.receive(0.1))
+
+    def test_close_removes_sockets(self):
+        from airship.sockets import ReadyNotifications
+        socket_path = self.tmp / 'web-0'
+        ReadyNotifications([socket_path]).close()
+        self.assertFalse(socket_path.exists())
@@ -0,0 +1,72 @@
+import json
+from StringIO import StringIO
+from mock import patch
+from common import AirshipTestCase, imp
+from deploy_test import make_app_tarball
+
+
+class DeployStatsTest(AirshipTestCase):
+
+    def setUp(self):
+        self.archive = self.tmp / 'app.tar'
+        make_app_tarball(self.archive)
+        self.stats_path = self.tmp / 'var' / 'log' / 'deploy-stats.log'
+
+    def read_stats(self):
+        return [json.loads(l) for l in self.stats_path.lines()]
+
+    def test_deploy_records_phases_and_receivers(self):
+        from airship.deployer import deploy
+        from airship.signals import bucket_setup
+
+        def slow_setup(airship, bucket):
+            pass
+
+        airship = self.create_airship()
+        with bucket_setup.connected_to(slow_setup):
+            deploy(airship, self.archive)
+        [record] = self.read_stats()
+        self.assertEqual(record['bucket'], 'd1')
+        self.assertTrue(record['ok'])
+        self.assertEqual(sorted(record['phases']),
+                         ['bucket_setup', 'extract', 'hash',
+                          'remove_old_buckets', 'start',
+                          'stop_old_buckets'])
+        self.assertEqual(record['receivers'].keys(),
+                         ['bucket_setup stats_test.slow_setup'])
+
+    def test_failed_deploy_is_recorded(self):
+        from airship.deployer import deploy, DeployError
+        airship = self.create_airship()
+        (self.tmp / 'broken.tar').write_text('not a tarball')
+        with self.assertRaises(DeployError):
+            deploy(airship, self.tmp / 'broken.tar')
+        [record] = self.read_stats()
+        self.assertFalse(record['ok'])
+        self.assertIn('extract', record['phases'])
+
+    def test_summary_has_percentiles_per_phase(self):
+        from airship.stats import summarize
+        records = [{'total': n + 1, 'phases': {'extract': n}, 'receivers': {}}
+                   for n in range(1, 11)]
+        rows = dict((r['name'], r) for r in summarize(records))
+        self.assertEqual(rows['extract']['count'], 10)
+        self.assertEqual(rows['extract']['p50'], 5)
+        self.assertEqual(rows['extract']['p90'], 9)
+        self.assertEqual(rows['extract']['max'], 10)
+        self.assertEqual(rows['total']['p50'], 6)
+
+    def test_stats_command_summarizes_recent_deploys(self):
+        self.stats_path.parent.makedirs_p()
+        self.stats_path.write_text(
+            json.dumps({'total': 100, 'phases': {'extract': 99}}) + '\n' +
+            'garbage\n' +
+            json.dumps({'total': 2, 'phases': {'extract': 1}}) + '\n')
+        self.create_airship()
+        with patch('sys.stdout', StringIO()) as stdout:
+            imp('airship.core').main([str(self.tmp), 'stats', '--json',
+                                      '--last', '2'])
+        data = json.loads(stdout.getvalue())
+        self.assertEqual(data['deploys'], 1)
+        self.assertEqual(data['phases'][0]['name'], 'extract')
+        self.assertEqual(data['phases'][0]['max'], 1)
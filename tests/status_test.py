@@ -0,0 +1,50 @@
+import os
+from common import AirshipTestCase
+
+
+class StatusTest(AirshipTestCase):
+
+    def setUp(self):
+        self.airship = self.create_airship({'port_map': {'web': 8000}})
+        self.bucket = self.airship.new_bucket()
+        self.bucket.update_metadata(concurrency={'web': 2}, state='running')
+        self.airship.registry.set_active(self.bucket.id_)
+        pid = os.getpid()
+        self.mock_rpc.supervisor.getAllProcessInfo.return_value = [
+            {'group': 'd1-web', 'name': 'd1-web-1', 'pid': pid,
+             'statename': 'RUNNING'},
+            {'group': 'd1-web', 'name': 'd1-web-0', 'pid': 0,
+             'statename': 'STOPPED'},
+            {'group': 'airship-crashloop', 'name': 'airship-crashloop',
+             'pid': pid, 'statename': 'RUNNING'},
+        ]
+
+    def test_processes_are_joined_with_bucket_and_proc_stats(self):
+        from airship.status import collect
+        [stopped, running] = collect(self.airship)
+        self.assertEqual(stopped['name'], 'd1-web:d1-web-0')
+        self.assertEqual(stopped['port'], 8000)
+        self.assertIsNone(stopped['rss'])
+        self.assertEqual(running['port'], 8001)
+        self.assertEqual(running['pid'], os.getpid())
+        self.assertTrue(running['active'])
+        self.assertEqual(running['bucket_state'], 'running')
+        self.assertGreater(running['rss'], 0)
+        self.assertGreater(running['fds'], 2)
+        self.assertGreaterEqual(running['uptime'], 0)
+        self.assertIsNotNone(running['cpu'])
+
+    def test_restarts_come_from_crash_loop_record(self):
+        from airship.crashloop import CrashLoop
+        from airship.status import collect
+        (self.tmp / 'var' / 'run').makedirs_p()
+        CrashLoop(self.tmp / 'var' / 'run' / 'crashloop.json').save(
+            {'d1-web:d1-web-1': {'exits': 4}})
+        self.assertEqual([r['restarts'] for r in collect(self.airship)],
+                         [0, 4])
+
+    def test_table_lists_one_process_per_line(self):
+        from airship.status import collect, format_table
+        lines = format_table(collect(self.airship)).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[2].startswith('d1-web:d1-web-1 * RUNNING'))
@@ -1,7 +1,6 @@
 import sys
 import ConfigParser
-from path import path
-from mock import call, ANY
+from mock import call, patch
 from common import AirshipTestCase
 
 
@@ -32,7 +31,7 @@ def config_file_checker(cfg_path):
 class SupervisorConfigurationTest(AirshipTestCase):
 
     def setUp(self):
-        self.mock_supervisorctl = self.patch('airship.daemons.Supervisor.ctl')
+        self.mock_update = self.patch('airship.daemons.Supervisor.update')
 
     def test_generate_supervisord_cfg_with_no_deployments(self):
         self.create_airship().generate_supervisord_configuration()
@@ -52,6 +51,46 @@ class SupervisorConfigurationTest(AirshipTestCase):
         eq_config('supervisorctl', 'serverurl',
                   'unix://' + self.tmp / 'var' / 'run' / 'supervisor.sock')
         eq_config('include', 'files', self.tmp / 'etc/supervisor.d/*')
+        eq_config('eventlistener:airship-crashloop', 'command',
+                  '%s -m airship.crashloop %s' % (
+                      sys.executable,
+                      self.tmp / 'var' / 'run' / 'crashloop.json'))
+
+    def test_watchdog_listener_is_added_when_configured(self):
+        self.create_airship().generate_supervisord_configuration()
+        config = read_config(self.tmp / 'etc' / 'supervisor.conf')
+        self.assertFalse(config.has_section('eventlistener:airship-watchdog'))
+        self.create_airship({'watchdog': {'limits': {}}}
+                            ).generate_supervisord_configuration()
+        eq_config = config_file_checker(self.tmp / 'etc' / 'supervisor.conf')
+        eq_config('eventlistener:airship-watchdog', 'command',
+                  '%s -m airship.watchdog %s' % (sys.executable, self.tmp))
+
+    def test_exporter_program_is_added_when_configured(self):
+        self.create_airship({'exporter': {'port': 9105}}
+                            ).generate_supervisord_configuration()
+        eq_config = config_file_checker(self.tmp / 'etc' / 'supervisor.conf')
+        eq_config('program:airship-exporter', 'command',
+                  '%s -m airship.exporter %s' % (sys.executable, self.tmp))
+
+    def test_socket_holder_is_added_with_socket_activation(self):
+        self.create_airship().generate_supervisord_configuration()
+        config = read_config(self.tmp / 'etc' / 'supervisor.conf')
+        self.assertFalse(config.has_section('program:airship-sockets'))
+        self.create_airship({'socket_activation': ['web']}
+                            ).generate_supervisord_configuration()
+        eq_config = config_file_checker(self.tmp / 'etc' / 'supervisor.conf')
+        eq_config('program:airship-sockets', 'command',
+                  '%s -m airship.sockets %s' % (
+                      sys.executable,
+                      self.tmp / 'var' / 'run' / 'sockets.sock'))
+
+    def test_crashloop_settings_are_passed_to_event_listener(self):
+        self.create_airship({'crashloop': {'threshold': 2, 'park_after': 4}}
+                            ).generate_supervisord_configuration()
+        config = read_config(self.tmp / 'etc' / 'supervisor.conf')
+        command = config.get('eventlistener:airship-crashloop', 'command')
+        self.assertTrue(command.endswith(' --threshold 2 --park-after 4'))
 
     def bucket_cfg(self, bucket):
         return self.tmp / 'etc' / 'supervisor.d' / bucket.id_
@@ -69,11 +108,48 @@ class SupervisorConfigurationTest(AirshipTestCase):
         section = 'program:%s-one' % bucket.id_
 
         eq_config(section, 'command',
-                  'bin/airship run -d {0} one'.format(bucket.id_))
+                  self.tmp / 'var' / 'launch' / bucket.id_ / 'one')
         eq_config(section, 'redirect_stderr', 'true')
         eq_config(section, 'stdout_logfile',
-                  self.tmp / 'var' / 'log' / 'one.log')
+                  self.tmp / 'var' / 'log' / bucket.id_ / 'one.log')
+        eq_config(section, 'stdout_logfile_maxbytes', '50MB')
+        eq_config(section, 'stdout_logfile_backups', '10')
         eq_config(section, 'startretries', '1')
+        self.assertTrue((self.tmp / 'var' / 'log' / bucket.id_).isdir())
+
+    def test_log_rotation_settings(self):
+        airship = self.create_airship({'logs': {'maxbytes': '1MB',
+                                                'backups': 3}})
+        airship.generate_supervisord_configuration()
+        bucket = airship.new_bucket()
+        (bucket.folder / 'Procfile').write_text('web: ./runweb $PORT\n')
+        bucket._read_procfile()
+        bucket.start()
+        eq_config = config_file_checker(self.bucket_cfg(bucket))
+        eq_config('program:%s-web' % bucket.id_,
+                  'stdout_logfile_maxbytes', '1MB')
+        eq_config('program:%s-web' % bucket.id_,
+                  'stdout_logfile_backups', '3')
+        eq_config = config_file_checker(self.tmp / 'etc' / 'supervisor.conf')
+        eq_config('eventlistener:airship-logs', 'command',
+                  '%s -m airship.logs %s --keep 3' % (
+                      sys.executable, self.tmp / 'var' / 'log'))
+
+    def test_concurrency_runs_several_instances(self):
+        bucket = self.create_airship({'concurrency': {'web': 3}}).new_bucket()
+        (bucket.folder / 'Procfile').write_text('web: ./runweb $PORT\n')
+        bucket._read_procfile()
+        bucket.start()
+
+        eq_config = config_file_checker(self.bucket_cfg(bucket))
+        section = 'program:%s-web' % bucket.id_
+        eq_config(section, 'numprocs', '3')
+        eq_config(section, 'process_name', '%(program_name)s-%(process_num)d')
+        eq_config(section, 'command', bucket.launcher_path('web') +
+                                      ' %(process_num)d')
+        eq_config(section, 'stdout_logfile',
+                  self.tmp / 'var' / 'log' / bucket.id_ /
+                  'web-%(process_num)d.log')
 
     def test_bucket_start_changes_autostart_to_true(self):
         bucket = self.create_airship().new_bucket()
@@ -100,27 +176,27 @@ class SupervisorConfigurationTest(AirshipTestCase):
 
     def test_bucket_start_triggers_supervisord_update(self):
         bucket = self.create_airship().new_bucket()
-        self.mock_supervisorctl.reset_mock()
+        bucket.process_types = {'web': './runweb $PORT'}
+        self.mock_update.reset_mock()
         bucket.start()
-        self.assertEqual(self.mock_supervisorctl.mock_calls,
-                         [call(['update'])])
+        self.assertEqual(self.mock_update.mock_calls,
+                         [call(bucket.id_,
+                               start_groups=['%s-web' % bucket.id_])])
 
     def test_bucket_stop_triggers_supervisord_update(self):
         bucket = self.create_airship().new_bucket()
         bucket.start()
-        self.mock_supervisorctl.reset_mock()
+        self.mock_update.reset_mock()
         bucket.stop()
-        self.assertEqual(self.mock_supervisorctl.mock_calls,
-                         [call(['update'])])
+        self.assertEqual(self.mock_update.mock_calls, [call(bucket.id_)])
 
     def test_bucket_destroy_triggers_supervisord_update(self):
         bucket = self.create_airship().new_bucket()
         bucket.start()
         bucket.stop()
-        self.mock_supervisorctl.reset_mock()
+        self.mock_update.reset_mock()
         bucket.destroy()
-        self.assertEqual(self.mock_supervisorctl.mock_calls,
-                         [call(['update'])])
+        self.assertEqual(self.mock_update.mock_calls, [call(bucket.id_)])
 
     def test_destroy_bucket_removes_its_supervisor_configuration(self):
         bucket = self.create_airship().new_bucket()
@@ -131,15 +207,33 @@ class SupervisorConfigurationTest(AirshipTestCase):
         self.assertFalse(cfg_path.isfile())
 
 
-class SupervisorInvocationTest(AirshipTestCase):
-
-    def test_invoke_supervisorctl(self):
-        self.mock_subprocess.reset_mock()
-        self.create_airship().daemons.ctl(['hello', 'world!'])
-        supervisorctl_path = (path(sys.prefix).abspath() /
-                              'bin' / 'supervisorctl')
-        cfg_path = self.tmp / 'etc' / 'supervisor.conf'
-        self.assertEqual(self.mock_subprocess.check_call.mock_calls,
-                         [call([supervisorctl_path,
-                                '-c', cfg_path,
-                                'hello', 'world!'], stdout=ANY)])
+class SupervisorUpdateTest(AirshipTestCase):
+
+    def test_update_only_touches_programs_of_bucket(self):
+        supervisor = self.mock_rpc.supervisor
+        supervisor.reloadConfig.return_value = [[
+            ['d1-web', 'd12-web'],
+            ['d1-worker', 'd12-worker'],
+            ['d1-old', 'd12-old'],
+        ]]
+        self.create_airship().daemons.update('d1')
+        self.assertEqual(supervisor.mock_calls[1:], [
+            call.stopProcessGroup('d1-old'),
+            call.removeProcessGroup('d1-old'),
+            call.stopProcessGroup('d1-worker'),
+            call.removeProcessGroup('d1-worker'),
+            call.addProcessGroup('d1-worker'),
+            call.addProcessGroup('d1-web'),
+        ])
+
+    def test_update_starts_requested_groups(self):
+        supervisor = self.mock_rpc.supervisor
+        supervisor.startProcessGroup.return_value = [{'status': 80}]
+        self.create_airship().daemons.update('d1', start_groups=['d1-web'])
+        self.assertEqual(supervisor.startProcessGroup.mock_calls,
+                         [call('d1-web')])
+
+    def test_update_is_skipped_when_supervisorctl_is_disabled(self):
+        with patch.dict('os.environ', {'AIRSHIP_NO_SUPERVISORCTL': '1'}):
+            self.create_airship().daemons.update('d1')
+        self.assertEqual(self.mock_rpc.mock_calls, [])
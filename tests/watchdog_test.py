@@ -0,0 +1,72 @@
+from common import AirshipTestCase
+
+MB = 1024 * 1024
+
+
+class WatchdogTest(AirshipTestCase):
+
+    def setUp(self):
+        self.usage = {}
+
+    def info(self, name, pid, start=0, group='d1-worker'):
+        return {'group': group, 'name': name, 'pid': pid, 'start': start,
+                'statename': 'RUNNING'}
+
+    def sample(self, pid, now):
+        from airship.procstats import Sample
+        rss, cpu = self.usage.get(pid, (10 * MB, 0))
+        return Sample(pid=pid, time=now, rss=rss, cpu=cpu, started=0)
+
+    def check(self, watchdog, infos, now):
+        return watchdog.check(infos, now, sample=self.sample)
+
+    def test_process_over_rss_limit_is_recycled(self):
+        from airship.watchdog import Watchdog
+        watchdog = Watchdog({'worker': {'max_rss': 100}})
+        self.usage[11] = (200 * MB, 0)
+        infos = [self.info('worker-0', 10), self.info('worker-1', 11)]
+        self.assertEqual(self.check(watchdog, infos, 100),
+                         [('d1-worker:worker-1', "rss 200MB over 100MB")])
+
+    def test_process_types_without_limits_are_left_alone(self):
+        from airship.watchdog import Watchdog
+        watchdog = Watchdog({'worker': {'max_rss': 100}})
+        self.usage[10] = (200 * MB, 0)
+        infos = [self.info('d1-web', 10, group='d1-web')]
+        self.assertEqual(self.check(watchdog, infos, 100), [])
+
+    def test_one_instance_per_group_is_recycled_at_a_time(self):
+        from airship.watchdog import Watchdog
+        watchdog = Watchdog({'worker': {'max_rss': 100}})
+        self.usage[10] = self.usage[11] = (200 * MB, 0)
+        infos = [self.info('worker-0', 10), self.info('worker-1', 11)]
+        self.assertEqual([n for n, r in self.check(watchdog, infos, 100)],
+                         ['d1-worker:worker-0'])
+        infos[0]['pid'] = 12
+        self.assertEqual([n for n, r in self.check(watchdog, infos, 130)],
+                         ['d1-worker:worker-1'])
+
+    def test_cpu_must_stay_over_limit_for_the_whole_period(self):
+        from airship.watchdog import Watchdog
+        watchdog = Watchdog({'worker': {'max_cpu': 50, 'cpu_period': 60}})
+        infos = [self.info('worker-0', 10)]
+        results = []
+        for now, cpu in [(0, 0), (30, 27), (60, 30), (90, 57), (120, 84)]:
+            self.usage[10] = (10 * MB, cpu)
+            results.append(self.check(watchdog, infos, now))
+        self.assertEqual(results[:4], [[], [], [], []])
+        self.assertEqual(results[4],
+                         [('d1-worker:worker-0', "cpu over 50% for 60s")])
+
+    def test_max_age_is_spread_by_jitter(self):
+        from airship.watchdog import Watchdog
+        watchdog = Watchdog({'worker': {'max_age': 1000, 'jitter': 0.5}})
+        infos = [self.info('worker-%d' % n, n) for n in range(20)]
+        self.assertEqual(self.check(watchdog, infos, 499), [])
+        recycled = []
+        for now in range(500, 1001, 10):
+            recycled += [n for n, r in self.check(watchdog, infos, now)]
+            infos = [i for i in infos
+                     if '%s:%s' % (i['group'], i['name']) not in recycled]
+        self.assertEqual(len(recycled), 20)
+        self.assertEqual(infos, [])
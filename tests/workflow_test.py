@@ -1,4 +1,5 @@
-from common import AirshipTestCase
+from mock import call
+from common import AirshipTestCase, HandyTestCase
 
 
 class WorkflowTest(AirshipTestCase):
@@ -22,3 +23,40 @@ class WorkflowTest(AirshipTestCase):
         self.bucket.stop()
         self.bucket.destroy()
         self.bucket.destroy()
+
+    def test_bucket_destroy_moves_folder_to_trash(self):
+        self.bucket.destroy()
+        trash_path = self.tmp / 'var' / 'trash'
+        [trashed] = trash_path.listdir()
+        self.assertTrue(trashed.name.startswith(self.bucket.id_ + '-'))
+        self.assertEqual(self.mock_reaper_spawn.mock_calls,
+                         [call(trash_path)])
+
+
+class ReaperTest(HandyTestCase):
+
+    def fill_trash(self):
+        trash = self.tmp / 'trash'
+        for name in ['d1-abc', 'd2-def']:
+            (trash / name / 'lib').makedirs()
+            (trash / name / 'lib' / 'module.py').write_text('')
+            (self.tmp / 'venv').mkdir_p()
+            (self.tmp / 'venv').symlink(trash / name / '_virtualenv')
+        return trash
+
+    def test_reap_deletes_trash_contents_without_following_links(self):
+        from airship.reaper import reap
+        trash = self.fill_trash()
+        (self.tmp / 'venv' / 'keep.txt').write_text('')
+        reap(trash, batch_size=1, pause=0)
+        self.assertEqual([f.name for f in trash.listdir()], ['.lock'])
+        self.assertTrue((self.tmp / 'venv' / 'keep.txt').isfile())
+
+    def test_reap_returns_if_another_reaper_holds_lock(self):
+        import fcntl
+        from airship.reaper import reap
+        trash = self.fill_trash()
+        with open(trash / '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            reap(trash)
+        self.assertEqual(len(trash.listdir()), 3)